@@ -0,0 +1,61 @@
+# app/api/ops.py
+# Operational endpoints, mounted at the root (not under /api/v1) and left out of the OpenAPI schema
+import asyncio
+
+from fastapi import APIRouter, status
+from fastapi.responses import JSONResponse, Response
+
+from app.core import cache, database
+from app.core.config import READINESS_TIMEOUT_SECONDS
+from app.core.metrics import CONTENT_TYPE, render_metrics, startup_timings
+
+router = APIRouter(include_in_schema=False)
+
+@router.get("/metrics")
+async def metrics():
+    # Prometheus text exposition format
+    return Response(content=render_metrics(), media_type=CONTENT_TYPE)
+
+@router.get("/healthz")
+async def healthz():
+    # Liveness: answers without touching MongoDB or Redis, so a slow dependency never gets the process restarted
+    return {
+        "status": "ok",
+        "mongodb": {"pools": database.pool_stats()},
+        "redis": {"available": cache.redis_available(), "pool": cache.redis_pool_stats()},
+        "startup_seconds": startup_timings, # Per phase of this worker's boot (benchmarks/bench_boot.py reads it)
+    }
+
+async def _check(ping) -> dict:
+    try:
+        return {"ok": True, "latency_ms": round(await ping() * 1000, 2)}
+    except Exception as e: # Includes asyncio.TimeoutError from READINESS_TIMEOUT_SECONDS
+        return {"ok": False, "error": str(e) or type(e).__name__}
+
+async def _ping_mongo() -> float:
+    if database.db_client is None:
+        raise RuntimeError("not connected")
+    return await database.ping(READINESS_TIMEOUT_SECONDS)
+
+async def _ping_redis() -> float:
+    if cache.redis_client is None:
+        raise RuntimeError("not connected")
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    await asyncio.wait_for(cache.redis_client.ping(), READINESS_TIMEOUT_SECONDS)
+    return loop.time() - start
+
+@router.get("/readyz")
+async def readyz():
+    # Readiness: MongoDB is required; without Redis the app still serves (from Mongo), so it only reports "degraded"
+    mongo, redis_result = await asyncio.gather(_check(_ping_mongo), _check(_ping_redis))
+    mongo["pools"] = database.pool_stats()
+    redis_result["pool"] = cache.redis_pool_stats()
+
+    if not mongo["ok"]:
+        state, code = "unavailable", status.HTTP_503_SERVICE_UNAVAILABLE
+    elif not redis_result["ok"]:
+        state, code = "degraded", status.HTTP_200_OK
+    else:
+        state, code = "ready", status.HTTP_200_OK
+    return JSONResponse(status_code=code, content={"status": state, "mongodb": mongo, "redis": redis_result})
@@ -1,14 +1,20 @@
+from datetime import datetime, timezone
 from fastapi import APIRouter, HTTPException, status, Depends, BackgroundTasks 
 from fastapi.security import OAuth2PasswordRequestForm # For standard OAuth2 password flow
 
 from app.models.user import User, UserCreate, UserLogin # Import updated user models
 from app.models.token import Token # Import Token model for response
-from app.core.security import get_password_hash, verify_password, create_access_token
+from app.core.security import get_password_hash_async, verify_and_update_password, create_access_token
 from app.core.mailer import send_welcome_email
+from app.core.mail_queue import enqueue_welcome_email
+from app.core.cache import invalidate_tags, user_tag, USERS_TAG
+from app.core.config import EMBED_USER_CLAIMS
+from app.core.ratelimit import rate_limit
 
 router = APIRouter()
 
-@router.post("/register", response_model=User, status_code=status.HTTP_201_CREATED)
+# Both routes cost a bcrypt hash, so they share the strict per-IP "auth" bucket
+@router.post("/register", response_model=User, status_code=status.HTTP_201_CREATED, dependencies=[rate_limit("auth")])
 async def register_user(user_in: UserCreate, background_tasks: BackgroundTasks):
     # Check if a user with this email already exists
     existing_user = await User.find_one(User.email == user_in.email)
@@ -19,7 +25,7 @@ async def register_user(user_in: UserCreate, background_tasks: BackgroundTasks):
         )
 
     # Hash the plain password
-    hashed_password = get_password_hash(user_in.password)
+    hashed_password = await get_password_hash_async(user_in.password) # Runs off the event loop
 
     # Create a new User document with the hashed password
     new_user = User(
@@ -29,21 +35,43 @@ async def register_user(user_in: UserCreate, background_tasks: BackgroundTasks):
     )
 
     await new_user.insert() # Save to MongoDB
-    background_tasks.add_task(send_welcome_email, new_user.email, new_user.name)
+    await invalidate_tags(USERS_TAG)
+    # Hand the email to the durable queue; only send from this worker if the queue is unavailable
+    if not await enqueue_welcome_email(new_user.email, new_user.name):
+        background_tasks.add_task(send_welcome_email, new_user.email, new_user.name)
     return new_user # Returns the user object (FastAPI/Pydantic will filter out hashed_password unless specified)
 
-@router.post("/token", response_model=Token)
+@router.post("/token", response_model=Token, dependencies=[rate_limit("auth")])
 async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends()):
     # OAuth2PasswordRequestForm provides username (email in our case) and password
     user = await User.find_one(User.email == form_data.username) # 'username' field in form is email
 
-    if not user or not verify_password(form_data.password, user.hashed_password):
+    if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
 
+    valid, new_hash = await verify_and_update_password(form_data.password, user.hashed_password)
+    if not valid:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Incorrect email or password",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    if new_hash:
+        # Hash was made with an older cost factor; upgrade it now that we know the plain password
+        # A write like any other: bump the version and drop cached copies, or their ETags go stale
+        await User.get_pymongo_collection().update_one(
+            {"_id": user.id},
+            {"$set": {"hashed_password": new_hash, "updated_at": datetime.now(timezone.utc)}, "$inc": {"version": 1}},
+        )
+        await invalidate_tags(USERS_TAG, user_tag(user.id))
+
     # If authentication successful, create an access token
-    access_token = create_access_token(data={"sub": user.email}) # 'sub' is standard for subject
+    claims = {"sub": user.email} # 'sub' is standard for subject
+    if EMBED_USER_CLAIMS:
+        claims.update(uid=str(user.id), name=user.name) # Lets get_current_user skip the database entirely
+    access_token = create_access_token(data=claims)
     return {"access_token": access_token, "token_type": "bearer"}
\ No newline at end of file
@@ -1,132 +1,603 @@
 # app/api/v1/products/products.py
-from fastapi import APIRouter, HTTPException, status, Depends
-from typing import List, Annotated
+from fastapi import APIRouter, HTTPException, status, Depends, Query, Request, Response, Header
+from fastapi.responses import StreamingResponse
+from typing import List, Annotated, Optional, Literal
 from beanie import PydanticObjectId # Beanie's ObjectId type for path parameters
+from pydantic import TypeAdapter
+from pymongo import ASCENDING, DESCENDING, DeleteOne, InsertOne, UpdateOne, ReturnDocument
+from datetime import datetime, timedelta, timezone
 
 # Import models
-from app.models.product import Product, ProductCreate
-from app.models.response_models import ProductWithUser
+from app.models.product import Product, ProductCreate, ProductPatch, ProductBulkCreate, ProductBulkUpdate, ProductView, PRODUCT_VIEW_FIELDS, PRODUCT_SORTS
+from app.models.response_models import (
+    ProductWithUser, BulkResult, RelationLoader, USER_PUBLIC_PROJECTION,
+    ProductSearchResult, ProductSearchFacets, CategoryFacet, PriceBucketFacet, BufferedUpdate,
+)
+from app.models.pagination import CursorPage
+from app.models.product_stats import CategoryStats, CreatorStats
 from app.models.user import User # Import User to validate creator_id
 
 from fastapi.security import OAuth2PasswordBearer
-from app.core.security import decode_access_token
-from app.core.cache import get_redis_client
-import json
+from app.core.security import create_access_token, decode_access_token
+from app.core.cache import cached, invalidate_tags, principal_cache, tags_etag, user_tag, CACHE_TTL_SECONDS, PRODUCTS_TAG, USERS_TAG
+from app.core.conditional import (
+    document_etag, is_not_modified, not_modified, validators, check_if_match, if_match_versions, precondition_failed, version_filter,
+)
+from app.core.config import (
+    PRINCIPAL_CACHE_TTL_SECONDS, FAST_SERIALIZATION, EVENTS_ENABLED, WRITE_BEHIND_ENABLED, EMBED_USER_CLAIMS,
+    EVENTS_SESSION_TTL_SECONDS, EVENTS_SESSION_COOKIE_SECURE,
+)
+from app.core.bulk import iter_request_items, run_bulk, DEFAULT_BULK_BATCH_SIZE, MAX_BULK_BATCH_SIZE
+from app.core.pagination import paginate, parse_fields, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from app.core.serialization import dump_json, raw_json, json_response, model_projection, JSON_MEDIA_TYPE
+from app.core.write_behind import product_writes
+from app.core.database import heavy_collection
+from app.core.ratelimit import rate_limit, concurrency_limit, HEAVY_READS, EXPORTS, BULK_WRITES, EVENT_STREAMS
+from app.core.events import product_events, EVENT_STREAM_MEDIA_TYPE, EVENT_STREAM_HEADERS
+from app.core import stats
+from app.core.stats import StatsDelta, STATS_PROJECTION, stats_collection, stats_view
+from app.core.streaming import stream_query, NDJSON_MEDIA_TYPE, DEFAULT_EXPORT_BATCH_SIZE, MAX_EXPORT_BATCH_SIZE
 import logging
+import time
 
 # Define the OAuth2 scheme (remains the same)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/v1/auth/token")
-CACHE_TTL_SECONDS = 60
+optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/v1/auth/token", auto_error=False)
+EVENTS_SCOPE = "product_events" # Tokens with this scope only open /products/events
+EVENTS_SESSION_COOKIE = "product_events_session"
+EVENTS_PATH = "/api/v1/products/events"
+
+# Joins each product with its creator; shared by the list and export endpoints
+PRODUCTS_WITH_USERS_PIPELINE = [
+    {
+        "$lookup": {
+            "from": "users",  # The collection name for users
+            "localField": "creator_id",
+            "foreignField": "_id",
+            "pipeline": [{"$project": USER_PUBLIC_PROJECTION}], # Never ship hashed_password through the join
+            "as": "creator"
+        }
+    },
+    {
+        "$unwind": "$creator"  # Unwind the creator field to get a single object
+    }
+]
+SEARCH_SORTS = ("relevance", "price", "-price")
+PRICE_BUCKET_BOUNDARIES = [0, 10, 25, 50, 100, 250, 500, 1000] # Prices from the last boundary up land in an open-ended bucket
+MAX_CATEGORY_FACETS = 50
+MAX_SEARCH_PAGE_SIZE = 100
+MAX_SEARCH_OFFSET = 1000 # Deep pages of a relevance ranking are not useful; narrow the query instead
 logger = logging.getLogger(__name__)
 
-# Dependency to get the current authenticated user (remains the same)
-async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)]) -> User:
+def build_search_pipeline(
+    q: Optional[str] = None,
+    category: Optional[str] = None,
+    min_price: Optional[float] = None,
+    max_price: Optional[float] = None,
+    sort: str = "relevance",
+    limit: int = 20,
+    offset: int = 0,
+) -> list:
+    """
+    One aggregation answering /products/search: the page of hits, the total and the facet counts.
+    $match and $sort come before $facet so the query planner can serve them from the Product.Settings
+    indexes (text index, category_price_id, price_id or _id); the $facet branches then only see matching documents.
+    """
+    match = {}
+    if q:
+        match["$text"] = {"$search": q} # Must be in the first $match stage
+    if category is not None:
+        match["category"] = category
+    price_range = {}
+    if min_price is not None:
+        price_range["$gte"] = min_price
+    if max_price is not None:
+        price_range["$lte"] = max_price
+    if price_range:
+        match["price"] = price_range
+
+    if sort == "relevance" and q:
+        order = {"score": {"$meta": "textScore"}, "_id": ASCENDING}
+    elif sort in ("price", "-price"):
+        direction = DESCENDING if sort.startswith("-") else ASCENDING
+        order = {"price": direction, "_id": direction}
+    else:
+        order = {"_id": ASCENDING} # Relevance without a query string: stable _id order
+
+    pipeline = [{"$match": match}, {"$sort": order}]
+    if q:
+        pipeline.append({"$addFields": {"score": {"$meta": "textScore"}}})
+    pipeline.append({
+        "$facet": {
+            "items": [{"$skip": offset}, {"$limit": limit}],
+            "total": [{"$count": "count"}],
+            "categories": [
+                {"$group": {"_id": "$category", "count": {"$sum": 1}}},
+                {"$sort": {"count": DESCENDING, "_id": ASCENDING}},
+                {"$limit": MAX_CATEGORY_FACETS},
+            ],
+            "price_buckets": [
+                {"$bucket": {
+                    "groupBy": "$price",
+                    "boundaries": PRICE_BUCKET_BOUNDARIES,
+                    "default": "above",
+                    "output": {"count": {"$sum": 1}},
+                }},
+            ],
+        }
+    })
+    return pipeline
+
+def _price_bucket(bucket: dict) -> PriceBucketFacet:
+    if bucket["_id"] == "above":
+        return PriceBucketFacet(min=PRICE_BUCKET_BOUNDARIES[-1], count=bucket["count"])
+    upper = PRICE_BUCKET_BOUNDARIES[PRICE_BUCKET_BOUNDARIES.index(bucket["_id"]) + 1]
+    return PriceBucketFacet(min=bucket["_id"], max=upper, count=bucket["count"])
+
+async def _user_from_token(token: str, scope: Optional[str] = None) -> User:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
     payload = decode_access_token(token)
-    if payload is None:
+    if payload is None or payload.get("scope") != scope: # A scoped token is only good for its own route
         raise credentials_exception
     
     email: str = payload.get("sub")
     if email is None:
         raise credentials_exception
-    
+
+    # Tokens issued with EMBED_USER_CLAIMS carry everything the routes need: no database I/O at all
+    if "uid" in payload:
+        return User.model_construct(id=PydanticObjectId(payload["uid"]), name=payload.get("name"), email=email)
+
+    cache_key = payload.get("jti") or token
+    user = principal_cache.get(cache_key)
+    if user is not None:
+        return user
+
+    # The user's id (and so its tag) is unknown until the read, but every user write also bumps USERS_TAG:
+    # if it moved while find_one was in flight, the user may be stale and is not cached
+    snapshot = principal_cache.snapshot([USERS_TAG])
     user = await User.find_one(User.email == email)
     if user is None:
         raise credentials_exception
-    
+
+    # Never cache past the token's own expiry; update_user/delete_user evict it through the user's tag
+    ttl = min(PRINCIPAL_CACHE_TTL_SECONDS, payload["exp"] - time.time()) if "exp" in payload else None
+    if principal_cache.snapshot([USERS_TAG]) == snapshot:
+        principal_cache.set(cache_key, user, ttl=ttl, tags=[user_tag(user.id)])
     return user
 
+# Dependency to get the current authenticated user
+async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)]) -> User:
+    return await _user_from_token(token)
+
+async def get_event_stream_user(request: Request, token: Annotated[Optional[str], Depends(optional_oauth2_scheme)]) -> User:
+    # Bearer token like everywhere else, or the cookie from POST /products/events/session for browser EventSource,
+    # which cannot set headers (and sends the cookie again on every reconnect)
+    if token is not None:
+        return await _user_from_token(token)
+    return await _user_from_token(request.cookies.get(EVENTS_SESSION_COOKIE, ""), scope=EVENTS_SCOPE)
+
+def rate_limited(cost: float = 1):
+    # Per-user token bucket; get_current_user is resolved once per request and shared with the router dependency
+    return rate_limit("api", cost, user_dependency=get_current_user)
+
 router = APIRouter(dependencies=[Depends(get_current_user)]) # <-- Global dependency for this router!
+# Routes authenticating differently; app.main includes it before `router`, whose /products/{product_id} would shadow them
+events_router = APIRouter()
 
-@router.post("/products", response_model=Product, status_code=status.HTTP_201_CREATED)
+@router.post("/products", response_model=Product, status_code=status.HTTP_201_CREATED, dependencies=[rate_limited()])
 async def create_product(product_in: ProductCreate, current_user: User = Depends(get_current_user)):
-    # Optional: Validate if the creator_id actually belongs to an existing user
-    creator_exists = await User.find_one(User.id == current_user.id)
-    if not creator_exists:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail=f"Creator with ID {product_in.creator_id} not found."
-        )
-
+    # current_user was already resolved by get_current_user, no need to look the creator up again
     new_product = Product(**product_in.model_dump(), creator_id=current_user.id)
     await new_product.insert()
+    await stats.record(None, new_product.model_dump())
+    await invalidate_tags(PRODUCTS_TAG) # After the stats, so a /products/stats ETag never outlives them
     return new_product
 
-@router.get("/products/withUsers", response_model=List[ProductWithUser])
-async def get_products():
-    redis_client = get_redis_client()
-    cache_key = "all_products"
+async def _existing_ids(document, ids) -> set:
+    """One $in query (covered by the _id index) telling which of `ids` exist in the document's collection."""
+    if not ids:
+        return set()
+    found = await document.get_pymongo_collection().find({"_id": {"$in": list(ids)}}, {"_id": 1}).to_list()
+    return {doc["_id"] for doc in found}
 
-    cached_products_json = await redis_client.get(cache_key)
+async def _find_by_ids(document, ids, projection) -> dict:
+    """Like _existing_ids, but returns the projected documents by _id."""
+    if not ids:
+        return {}
+    found = await document.get_pymongo_collection().find({"_id": {"$in": list(ids)}}, projection).to_list()
+    return {doc["_id"]: doc for doc in found}
 
-    if cached_products_json:
-        logger.info("Cache hit for products!")
-        return json.loads(cached_products_json)
+def _stats_recorder(changes: dict):
+    """
+    on_written callback for run_bulk: applies the (before, after) product images that `prepare` stored in
+    `changes` by item index, for the items that were actually written.
+    """
+    async def on_written(ops):
+        delta = StatsDelta()
+        for index, _, _ in ops:
+            delta.change(*changes[index])
+        changes.clear()
+        await stats.apply(delta)
+    return on_written
 
-    logger.info("Cache miss for products. Fetching from database...")
+@router.post("/products/bulk", response_model=BulkResult, dependencies=[rate_limited(20), concurrency_limit(BULK_WRITES)])
+async def bulk_create_products(
+    request: Request,
+    current_user: User = Depends(get_current_user),
+    batch_size: int = Query(DEFAULT_BULK_BATCH_SIZE, ge=1, le=MAX_BULK_BATCH_SIZE),
+    ordered: bool = Query(False, description="Stop at the first failing item"),
+    return_ids: bool = Query(False, description="Include the _ids of the created products"),
+):
+    # Body: JSON array or NDJSON (Content-Type: application/x-ndjson) of ProductBulkCreate items
+    changes = {}
 
-    products = await Product.aggregate([
-        {
-            "$lookup": {
-                "from": "users",  # The collection name for users
-                "localField": "creator_id",
-                "foreignField": "_id",
-                "as": "creator"
+    async def prepare(batch):
+        # Creators other than the caller are checked with a single $in query per batch
+        creators = await _existing_ids(User, {item.creator_id for _, item in batch if item.creator_id not in (None, current_user.id)})
+        ops, failures = [], []
+        for index, item in batch:
+            creator_id = item.creator_id or current_user.id
+            if creator_id != current_user.id and creator_id not in creators:
+                failures.append((index, f"Creator with ID {creator_id} not found."))
+                continue
+            doc = {
+                "_id": PydanticObjectId(), **item.model_dump(exclude={"creator_id"}), "creator_id": creator_id,
+                "version": 1, "updated_at": datetime.now(timezone.utc), # What Product's insert hook would set
             }
-        },
-        {
-            "$unwind": "$creator"  # Unwind the creator field to get a single object
-        }
-    ], projection_model=ProductWithUser).to_list()
-    return products
+            ops.append((index, InsertOne(doc), doc["_id"]))
+            changes[index] = (None, doc)
+        return ops, failures
 
-@router.get("/products", response_model=List[Product])
-async def get_products():
-    products = await Product.find_all().to_list()
-    return products
+    result = await run_bulk(
+        iter_request_items(request), TypeAdapter(ProductBulkCreate), Product.get_pymongo_collection(),
+        prepare, batch_size, ordered, collect_ids=return_ids, on_written=_stats_recorder(changes),
+    )
+    if result.succeeded:
+        await invalidate_tags(PRODUCTS_TAG)
+    return result
 
-@router.get("/products/{product_id}", response_model=Product)
-async def get_product(product_id: PydanticObjectId):
-    product = await Product.find_one(Product.id == product_id)
-    if product:
-        return product
+@router.put("/products/bulk", response_model=BulkResult, dependencies=[rate_limited(20), concurrency_limit(BULK_WRITES)])
+async def bulk_update_products(
+    request: Request,
+    batch_size: int = Query(DEFAULT_BULK_BATCH_SIZE, ge=1, le=MAX_BULK_BATCH_SIZE),
+    ordered: bool = Query(False, description="Stop at the first failing item"),
+):
+    # Body: JSON array or NDJSON of ProductBulkUpdate items
+    changes = {}
+
+    async def prepare(batch):
+        # Current stats fields of each product, tracked through the batch in case an id appears more than once
+        current = await _find_by_ids(Product, {item.id for _, item in batch}, STATS_PROJECTION)
+        creators = await _existing_ids(User, {item.creator_id for _, item in batch if item.creator_id})
+        ops, failures = [], []
+        for index, item in batch:
+            before = current.get(item.id)
+            if before is None:
+                failures.append((index, f"Product with ID {item.id} not found."))
+            elif item.creator_id and item.creator_id not in creators:
+                failures.append((index, f"New creator with ID {item.creator_id} not found."))
+            else:
+                # Fields left out of the item keep their stored value; creator_id only changes when one is given
+                fields = item.model_dump(exclude={"id", "creator_id"}, exclude_unset=True)
+                if item.creator_id is not None:
+                    fields["creator_id"] = item.creator_id
+                fields["updated_at"] = datetime.now(timezone.utc)
+                ops.append((index, UpdateOne({"_id": item.id}, {"$set": fields, "$inc": {"version": 1}}), item.id))
+                current[item.id] = {**before, **fields}
+                changes[index] = (before, current[item.id])
+        return ops, failures
+
+    result = await run_bulk(
+        iter_request_items(request), TypeAdapter(ProductBulkUpdate), Product.get_pymongo_collection(),
+        prepare, batch_size, ordered, on_written=_stats_recorder(changes),
+    )
+    if result.succeeded:
+        await invalidate_tags(PRODUCTS_TAG)
+    return result
+
+@router.delete("/products/bulk", response_model=BulkResult, dependencies=[rate_limited(20), concurrency_limit(BULK_WRITES)])
+async def bulk_delete_products(
+    request: Request,
+    batch_size: int = Query(DEFAULT_BULK_BATCH_SIZE, ge=1, le=MAX_BULK_BATCH_SIZE),
+    ordered: bool = Query(False, description="Stop at the first failing item"),
+):
+    # Body: JSON array or NDJSON of product ids
+    changes = {}
+
+    async def prepare(batch):
+        existing = await _find_by_ids(Product, {product_id for _, product_id in batch}, STATS_PROJECTION)
+        ops, failures, deleted = [], [], set()
+        for index, product_id in batch:
+            if product_id in existing:
+                ops.append((index, DeleteOne({"_id": product_id}), product_id))
+                # A repeated id deletes nothing the second time
+                changes[index] = (None if product_id in deleted else existing[product_id], None)
+                deleted.add(product_id)
+            else:
+                failures.append((index, f"Product with ID {product_id} not found."))
+        return ops, failures
+
+    result = await run_bulk(
+        iter_request_items(request), TypeAdapter(PydanticObjectId), Product.get_pymongo_collection(),
+        prepare, batch_size, ordered, on_written=_stats_recorder(changes),
+    )
+    if result.succeeded:
+        await invalidate_tags(PRODUCTS_TAG)
+    return result
+
+@router.get("/products/withUsers", response_model=List[ProductWithUser], dependencies=[rate_limited(20), concurrency_limit(HEAVY_READS)])
+@cached("products_with_users", ttl=CACHE_TTL_SECONDS, model=List[ProductWithUser], tags=[PRODUCTS_TAG, USERS_TAG])
+async def get_products(
+    strategy: Literal["lookup", "batched"] = Query("lookup", description="lookup: server-side $lookup join; batched: one $in query per batch of products"),
+):
+    if strategy == "batched":
+        products = [product async for product in RelationLoader().iter_with_creators(Product.find_all())]
+        return dump_json(List[ProductWithUser], products) if FAST_SERIALIZATION else products
+    pipeline = PRODUCTS_WITH_USERS_PIPELINE + [{"$project": model_projection(ProductWithUser)}]
+    products = await (await heavy_collection(Product).aggregate(pipeline)).to_list()
+    # Fast path: joined documents go from the cursor to JSON without ever becoming models
+    return raw_json(products) if FAST_SERIALIZATION else products
+
+@router.get("/products/withUsers/export", response_class=StreamingResponse, dependencies=[rate_limited(50), concurrency_limit(EXPORTS)])
+async def export_products_with_users(
+    fmt: Literal["ndjson", "json"] = Query("ndjson", alias="format"),
+    batch_size: int = Query(DEFAULT_EXPORT_BATCH_SIZE, ge=1, le=MAX_EXPORT_BATCH_SIZE),
+    strategy: Literal["lookup", "batched"] = Query("lookup"),
+):
+    # Streams straight off the cursor, so memory stays at one batch regardless of catalog size
+    if strategy == "batched":
+        query = RelationLoader().iter_with_creators(Product.find_all(batch_size=batch_size), batch_size)
     else:
+        pipeline = PRODUCTS_WITH_USERS_PIPELINE + [{"$project": model_projection(ProductWithUser)}]
+        query = await heavy_collection(Product).aggregate(pipeline, batchSize=batch_size)
+    return StreamingResponse(
+        stream_query(query, fmt, batch_size, model=None if FAST_SERIALIZATION else ProductWithUser),
+        media_type=NDJSON_MEDIA_TYPE if fmt == "ndjson" else JSON_MEDIA_TYPE,
+    )
+
+@router.get("/products", response_model=CursorPage[ProductView], response_model_exclude_unset=True, dependencies=[rate_limited()])
+async def list_products(
+    response: Response,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    fields: Optional[str] = Query(None, description="Comma-separated fields to return, e.g. name,price"),
+    category: Optional[str] = None,
+    min_price: Optional[float] = Query(None, ge=0),
+    max_price: Optional[float] = Query(None, ge=0),
+    creator_id: Optional[PydanticObjectId] = None,
+    sort: str = Query("id", description="id, -id, price or -price"),
+    if_none_match: Optional[str] = Header(None),
+):
+    filters = {}
+    if category is not None:
+        filters["category"] = category
+    if creator_id is not None:
+        filters["creator_id"] = creator_id
+    price_range = {}
+    if min_price is not None:
+        price_range["$gte"] = min_price
+    if max_price is not None:
+        price_range["$lte"] = max_price
+    if price_range:
+        filters["price"] = price_range
+
+    field_set = parse_fields(fields, PRODUCT_VIEW_FIELDS)
+    # Pollers re-sending the ETag get a 304 from one Redis round trip, without querying Mongo
+    etag = await tags_etag("products_list", [filters, sort, limit, cursor, sorted(field_set or ()), FAST_SERIALIZATION], [PRODUCTS_TAG])
+    if is_not_modified(etag, if_none_match):
+        return not_modified(etag)
+
+    page = await paginate(
+        Product, ProductView, filters, sort, PRODUCT_SORTS, limit,
+        cursor=cursor, fields=field_set, raw=FAST_SERIALIZATION,
+    )
+    if FAST_SERIALIZATION:
+        return json_response(raw_json(page), headers=validators(etag))
+    response.headers.update(validators(etag))
+    return page
+
+@router.get("/products/search", response_model=ProductSearchResult, dependencies=[rate_limited(5), concurrency_limit(HEAVY_READS)])
+@cached("product_search", ttl=CACHE_TTL_SECONDS, model=ProductSearchResult, tags=[PRODUCTS_TAG])
+async def search_products(
+    q: Optional[str] = Query(None, min_length=1, description="Text searched in name and description"),
+    category: Optional[str] = None,
+    min_price: Optional[float] = Query(None, ge=0),
+    max_price: Optional[float] = Query(None, ge=0),
+    sort: Literal["relevance", "price", "-price"] = "relevance",
+    limit: int = Query(20, ge=1, le=MAX_SEARCH_PAGE_SIZE),
+    offset: int = Query(0, ge=0, le=MAX_SEARCH_OFFSET),
+):
+    pipeline = build_search_pipeline(q, category, min_price, max_price, sort, limit, offset)
+    [result] = await (await heavy_collection(Product).aggregate(pipeline)).to_list()
+    return ProductSearchResult(
+        total=result["total"][0]["count"] if result["total"] else 0,
+        items=result["items"],
+        facets=ProductSearchFacets(
+            categories=[CategoryFacet(category=c["_id"], count=c["count"]) for c in result["categories"]],
+            price_buckets=[_price_bucket(b) for b in result["price_buckets"]],
+        ),
+    )
+
+@router.post("/products/events/session", status_code=status.HTTP_204_NO_CONTENT, dependencies=[rate_limited()])
+async def create_product_events_session(response: Response, current_user: User = Depends(get_current_user)):
+    # For browsers: call this with the bearer token, then `new EventSource("/api/v1/products/events")`.
+    # The HttpOnly cookie holds a token that opens nothing but the event stream, and is only sent to its path.
+    claims = {"sub": current_user.email, "scope": EVENTS_SCOPE}
+    if EMBED_USER_CLAIMS:
+        claims.update(uid=str(current_user.id), name=current_user.name)
+    token = create_access_token(claims, expires_delta=timedelta(seconds=EVENTS_SESSION_TTL_SECONDS))
+    response.set_cookie(
+        EVENTS_SESSION_COOKIE, token, max_age=EVENTS_SESSION_TTL_SECONDS, path=EVENTS_PATH,
+        httponly=True, secure=EVENTS_SESSION_COOKIE_SECURE, samesite="strict",
+    )
+
+@events_router.get(
+    "/products/events", response_class=StreamingResponse,
+    dependencies=[Depends(get_event_stream_user), rate_limit("api", user_dependency=get_event_stream_user), concurrency_limit(EVENT_STREAMS)],
+)
+async def product_events_stream(
+    category: Optional[List[str]] = Query(None, description="Only changes to products in these categories; deletes are always sent"),
+    last_event_id: Optional[str] = Header(None, description="Sent by EventSource when it reconnects; missed events are replayed"),
+):
+    # Server-Sent Events: insert / update / replace / delete events with the product, plus `reset` when
+    # events were missed that can no longer be replayed. Push instead of polling /products for changes.
+    # Authenticated by bearer token (non-browser clients) or by the POST /products/events/session cookie (EventSource).
+    if not EVENTS_ENABLED:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Product events are disabled")
+    subscriber, backlog = product_events.subscribe(category, last_event_id)
+    return StreamingResponse(product_events.stream(subscriber, backlog), media_type=EVENT_STREAM_MEDIA_TYPE, headers=EVENT_STREAM_HEADERS)
+
+# Materialized in product_stats (app/core/stats.py): one small document per group, whatever the catalog size.
+# Declared before /products/{product_id} so "stats" is not taken for an id.
+@router.get("/products/stats/categories", response_model=List[CategoryStats], dependencies=[rate_limited()])
+async def get_category_stats(response: Response, if_none_match: Optional[str] = Header(None)):
+    etag = await tags_etag("product_stats", ["categories"], [PRODUCTS_TAG])
+    if is_not_modified(etag, if_none_match):
+        return not_modified(etag)
+    docs = await stats_collection().find({"dimension": "category"}).sort("key", ASCENDING).to_list() # dimension_key index
+    response.headers.update(validators(etag))
+    return [CategoryStats(category=doc["key"], **stats_view(doc)) for doc in docs]
+
+@router.get("/products/stats/categories/{category}", response_model=CategoryStats, dependencies=[rate_limited()])
+async def get_one_category_stats(category: str):
+    doc = await stats_collection().find_one({"dimension": "category", "key": category})
+    if not doc:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No products in this category")
+    return CategoryStats(category=doc["key"], **stats_view(doc))
+
+@router.get("/products/stats/creators", response_model=List[CreatorStats], dependencies=[rate_limited()])
+async def get_creator_stats(
+    response: Response,
+    limit: int = Query(100, ge=1, le=1000, description="Creators with the most products first"),
+    if_none_match: Optional[str] = Header(None),
+):
+    etag = await tags_etag("product_stats", ["creators", limit], [PRODUCTS_TAG])
+    if is_not_modified(etag, if_none_match):
+        return not_modified(etag)
+    docs = await (
+        stats_collection().find({"dimension": "creator"}).sort([("product_count", DESCENDING), ("key", ASCENDING)]).limit(limit).to_list()
+    ) # dimension_count_key index
+    response.headers.update(validators(etag))
+    return [CreatorStats(creator_id=doc["key"], **stats_view(doc)) for doc in docs]
+
+@router.get("/products/stats/creators/{creator_id}", response_model=CreatorStats, dependencies=[rate_limited()])
+async def get_one_creator_stats(creator_id: PydanticObjectId):
+    doc = await stats_collection().find_one({"dimension": "creator", "key": creator_id})
+    if not doc:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No products by this creator")
+    return CreatorStats(creator_id=doc["key"], **stats_view(doc))
+
+@router.get("/products/{product_id}", response_model=Product, dependencies=[rate_limited()])
+async def get_product(
+    product_id: PydanticObjectId,
+    response: Response,
+    if_none_match: Optional[str] = Header(None),
+    if_modified_since: Optional[str] = Header(None),
+):
+    if if_none_match is not None or if_modified_since is not None:
+        # Revalidation: the validators alone decide a 304, so fetch just those and load the full document only for a 200
+        current = await Product.get_pymongo_collection().find_one({"_id": product_id}, {"version": 1, "updated_at": 1})
+        if not current:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Product not found")
+        validated = Product.model_construct(id=product_id, version=current.get("version", 0), updated_at=current.get("updated_at"))
+        etag = document_etag(validated)
+        if is_not_modified(etag, if_none_match, validated.updated_at, if_modified_since):
+            return not_modified(etag, validated.updated_at) # Skips loading and serializing the document
+    product = await Product.find_one(Product.id == product_id)
+    if not product:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Product not found")
+    response.headers.update(validators(document_etag(product), product.updated_at))
+    return product
 
-@router.put("/products/{product_id}", response_model=Product)
-async def update_product(product_id: PydanticObjectId, product_update: ProductCreate):
+@router.put("/products/{product_id}", response_model=Product, dependencies=[rate_limited()])
+async def update_product(
+    product_id: PydanticObjectId,
+    product_update: ProductCreate,
+    response: Response,
+    if_match: Optional[str] = Header(None, description="ETag from a previous GET; the update fails with 412 if the product changed since"),
+):
     product = await Product.find_one(Product.id == product_id)
     if not product:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Product not found")
+    check_if_match(if_match, document_etag(product))
+
+    filters = {"_id": product_id}
+    if if_match is not None:
+        filters["version"] = version_filter([product.version]) # Compare-and-set: also fails if someone wrote after the check above
+    fields = {**product_update.model_dump(), "updated_at": datetime.now(timezone.utc)}
+    # The exact pre-image feeds the stats delta; the new document is that plus the update
+    before = await Product.get_pymongo_collection().find_one_and_update(
+        filters, {"$set": fields, "$inc": {"version": 1}}, return_document=ReturnDocument.BEFORE,
+    )
+    if before is None:
+        if if_match is not None:
+            raise precondition_failed()
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Product not found")
+    updated = {**before, **fields, "version": before.get("version", 0) + 1}
 
-    # Update fields from product_update
-    product.name = product_update.name
-    product.description = product_update.description
-    product.price = product_update.price
-    product.category = product_update.category
-    # If creator_id is updated, validate it again
-    if product.creator_id != product_update.creator_id:
-        creator_exists = await User.find_one(User.id == product_update.creator_id)
-        if not creator_exists:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail=f"New creator with ID {product_update.creator_id} not found."
-            )
-        product.creator_id = product_update.creator_id
-
-
-    await product.save()
+    await stats.record(before, updated)
+    await invalidate_tags(PRODUCTS_TAG)
+    product = Product.model_validate(updated)
+    response.headers.update(validators(document_etag(product), product.updated_at))
     return product
 
-@router.delete("/products/{product_id}", status_code=status.HTTP_204_NO_CONTENT)
+@router.patch(
+    "/products/{product_id}", response_model=Product, dependencies=[rate_limited()],
+    responses={status.HTTP_202_ACCEPTED: {"model": BufferedUpdate, "description": "Buffered, not written yet"}},
+)
+async def patch_product(
+    product_id: PydanticObjectId,
+    patch: ProductPatch,
+    response: Response,
+    buffered: bool = Query(False, description="Coalesce with other updates to this product and write them together (app/core/write_behind.py)"),
+    wait: bool = Query(False, description="buffered only: answer once the update is written instead of when it is queued"),
+    if_match: Optional[str] = Header(None, description="ETag from a previous GET; the update fails with 412 if the product changed since"),
+):
+    # Only the fields sent are $set, in one round trip: no read of the current document first
+    fields = patch.model_dump(exclude_unset=True)
+    if buffered and WRITE_BEHIND_ENABLED:
+        if if_match is not None:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="If-Match cannot be combined with buffered updates")
+        waiter = product_writes.submit(product_id, fields, wait)
+        if waiter is None:
+            return json_response(dump_json(BufferedUpdate, BufferedUpdate(id=product_id, status="queued")), status_code=status.HTTP_202_ACCEPTED)
+        if await waiter == "not_found":
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Product not found")
+        return json_response(dump_json(BufferedUpdate, BufferedUpdate(id=product_id, status="written")))
+
+    filters = {"_id": product_id}
+    versions = if_match_versions(if_match, product_id)
+    if versions is not None:
+        filters["version"] = version_filter(versions) # Compare-and-set in the same write
+    fields["updated_at"] = datetime.now(timezone.utc)
+    before = await Product.get_pymongo_collection().find_one_and_update(
+        filters, {"$set": fields, "$inc": {"version": 1}}, return_document=ReturnDocument.BEFORE,
+    )
+    if before is None:
+        # Only the failure path pays for telling a stale If-Match from a missing product
+        if versions is not None and await Product.get_pymongo_collection().count_documents({"_id": product_id}, limit=1):
+            raise precondition_failed()
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Product not found")
+    updated = {**before, **fields, "version": before.get("version", 0) + 1}
+
+    await stats.record(before, updated)
+    await invalidate_tags(PRODUCTS_TAG)
+    product = Product.model_validate(updated)
+    response.headers.update(validators(document_etag(product), product.updated_at))
+    return product
+
+@router.delete("/products/{product_id}", status_code=status.HTTP_204_NO_CONTENT, dependencies=[rate_limited()])
 async def delete_product(product_id: PydanticObjectId):
-    product = await Product.find_one(Product.id == product_id)
+    # One round trip, and the deleted document is exactly what the stats have to subtract
+    product = await Product.get_pymongo_collection().find_one_and_delete({"_id": product_id}, projection=STATS_PROJECTION)
     if not product:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Product not found")
 
-    await product.delete()
+    await stats.record(product, None)
+    await invalidate_tags(PRODUCTS_TAG)
     return {"message": "Product deleted"}
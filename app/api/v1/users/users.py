@@ -1,15 +1,48 @@
 # app/api/v1/endpoints/users.py
-from fastapi import APIRouter, HTTPException, status # Import status for clearer HTTP codes
-from typing import List
+from fastapi import APIRouter, HTTPException, status, Query, Response, Header # Import status for clearer HTTP codes
+from fastapi.responses import StreamingResponse
+from typing import List, Optional, Literal, Tuple
+from pymongo import ASCENDING, ReturnDocument
+from datetime import datetime, timezone
 from beanie import PydanticObjectId # Beanie's ObjectId type for path parameters
 
 # Import models
-from app.models.user import User, UserCreate
-from app.models.response_models import UserWithProducts
+from app.models.user import User, UserCreate, UserView, UserPublic, USER_VIEW_FIELDS
+from app.models.product import PRODUCT_SORTS
+from app.models.response_models import UserWithProducts, RelationLoader, USER_PUBLIC_PROJECTION
+from app.models.pagination import CursorPage
+from app.core.pagination import paginate, parse_fields, parse_sort, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from app.core.cache import cached, invalidate_tags, tags_etag, user_tag, CACHE_TTL_SECONDS, PRODUCTS_TAG, USERS_TAG
+from app.core.conditional import content_etag, is_not_modified, not_modified, validators, check_if_match, precondition_failed, version_filter
+from app.core.config import FAST_SERIALIZATION
+from app.core.serialization import dump_json, raw_json, json_response, model_projection, JSON_MEDIA_TYPE
+from app.core.database import heavy_collection
+from app.core.ratelimit import rate_limit, concurrency_limit, HEAVY_READS, EXPORTS
+from app.core.streaming import stream_query, NDJSON_MEDIA_TYPE, DEFAULT_EXPORT_BATCH_SIZE, MAX_EXPORT_BATCH_SIZE
 
 router = APIRouter()
+USER_SORTS = ("id", "name")
 
-@router.post("/users", response_model=User, status_code=status.HTTP_201_CREATED)
+def users_with_products_pipeline(limit: Optional[int] = None, sort: Tuple[str, int] = ("_id", ASCENDING)) -> list:
+    """Embeds each user's products (optionally only the first `limit` in `sort` order); shared by the list and export endpoints."""
+    field, direction = sort
+    products_pipeline = [{"$sort": {field: direction, **({"_id": direction} if field != "_id" else {})}}]
+    if limit:
+        products_pipeline.append({"$limit": limit})
+    return [
+        {"$project": USER_PUBLIC_PROJECTION}, # Never ship hashed_password
+        {
+            "$lookup": {
+                "from": "products",
+                "localField": "_id",
+                "foreignField": "creator_id",
+                "pipeline": products_pipeline,
+                "as": "products"
+            },
+        }
+    ]
+
+@router.post("/users", response_model=User, status_code=status.HTTP_201_CREATED, dependencies=[rate_limit("auth")])
 async def create_user(user_in: UserCreate): # Renamed to avoid conflict with 'User' model
     # Beanie documents are Pydantic models, so user_in is already validated
     # Create a User document from the incoming UserCreate data
@@ -29,32 +62,72 @@ async def create_user(user_in: UserCreate): # Renamed to avoid conflict with 'Us
             detail=f"Failed to create user: {e}"
         )
     
+    await invalidate_tags(USERS_TAG)
     # Beanie's insert() automatically populates the _id, so new_user now has it.
     # It also handles the ObjectId -> str conversion for the response_model.
     return new_user
 
-@router.get('/users/withProducts', response_model=List[UserWithProducts])
-async def get_users_with_products():
-    users_with_products = await User.aggregate([
-        {
-            "$lookup": {
-                "from": "products",
-                "localField": "_id",
-                "foreignField": "creator_id",
-                "as": "products"
-            },
-        }
-    ]).to_list()
-    return users_with_products
+@router.get('/users/withProducts', response_model=List[UserWithProducts], dependencies=[rate_limit(cost=20), concurrency_limit(HEAVY_READS)])
+@cached("users_with_products", ttl=CACHE_TTL_SECONDS, model=List[UserWithProducts], tags=[USERS_TAG, PRODUCTS_TAG])
+async def get_users_with_products(
+    strategy: Literal["lookup", "batched"] = Query("lookup", description="lookup: server-side $lookup join; batched: one $in aggregation per batch of users"),
+    products_limit: Optional[int] = Query(None, ge=1, description="Embed at most this many products per user"),
+    products_sort: str = Query("id", description="Order of the embedded products: id, -id, price or -price"),
+):
+    sort = parse_sort(products_sort, PRODUCT_SORTS)
+    if strategy == "batched":
+        users = await User.find_all().project(UserPublic).to_list()
+        users_with_products = await RelationLoader().with_products(users, products_limit, sort)
+        return dump_json(List[UserWithProducts], users_with_products) if FAST_SERIALIZATION else users_with_products
+    pipeline = users_with_products_pipeline(products_limit, sort) + [{"$project": model_projection(UserWithProducts)}]
+    users_with_products = await (await heavy_collection(User).aggregate(pipeline)).to_list()
+    # Fast path: embedded documents go from the cursor to JSON without ever becoming models
+    return raw_json(users_with_products) if FAST_SERIALIZATION else users_with_products
+
+@router.get('/users/withProducts/export', response_class=StreamingResponse, dependencies=[rate_limit(cost=50), concurrency_limit(EXPORTS)])
+async def export_users_with_products(
+    fmt: Literal["ndjson", "json"] = Query("ndjson", alias="format"),
+    batch_size: int = Query(DEFAULT_EXPORT_BATCH_SIZE, ge=1, le=MAX_EXPORT_BATCH_SIZE),
+    products_limit: Optional[int] = Query(None, ge=1, description="Embed at most this many products per user"),
+    products_sort: str = Query("id", description="Order of the embedded products: id, -id, price or -price"),
+):
+    # Streams straight off the aggregation cursor, so memory stays at one batch regardless of collection size
+    sort = parse_sort(products_sort, PRODUCT_SORTS)
+    pipeline = users_with_products_pipeline(products_limit, sort) + [{"$project": model_projection(UserWithProducts)}]
+    query = await heavy_collection(User).aggregate(pipeline, batchSize=batch_size)
+    return StreamingResponse(
+        stream_query(query, fmt, batch_size, model=None if FAST_SERIALIZATION else UserWithProducts),
+        media_type=NDJSON_MEDIA_TYPE if fmt == "ndjson" else JSON_MEDIA_TYPE,
+    )
 
-@router.get("/users", response_model=List[User])
-async def get_users():
-    # Use Beanie's find_all() method to retrieve all documents
-    # find_all() returns a Cursor. .to_list() converts it to a list of User objects.
-    users = await User.find_all().to_list()
-    return users
+@router.get("/users", response_model=CursorPage[UserView], response_model_exclude_unset=True, dependencies=[rate_limit()])
+async def get_users(
+    response: Response,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    fields: Optional[str] = Query(None, description="Comma-separated fields to return, e.g. name,email"),
+    name: Optional[str] = None,
+    sort: str = Query("id", description="id, -id, name or -name"),
+    if_none_match: Optional[str] = Header(None),
+):
+    # Keyset pagination: one bounded index scan per page instead of loading the whole collection
+    filters = {"name": name} if name is not None else {}
+    field_set = parse_fields(fields, USER_VIEW_FIELDS)
+    etag = await tags_etag("users_list", [filters, sort, limit, cursor, sorted(field_set or ()), FAST_SERIALIZATION], [USERS_TAG])
+    if is_not_modified(etag, if_none_match):
+        return not_modified(etag)
 
-@router.get("/users/{user_id}", response_model=User)
+    page = await paginate(
+        User, UserView, filters, sort, USER_SORTS, limit,
+        cursor=cursor, fields=field_set, raw=FAST_SERIALIZATION,
+    )
+    if FAST_SERIALIZATION:
+        return json_response(raw_json(page), headers=validators(etag))
+    response.headers.update(validators(etag))
+    return page
+
+@router.get("/users/{user_id}", response_model=User, dependencies=[rate_limit()])
+@cached("user", ttl=CACHE_TTL_SECONDS, model=User, tags=lambda user_id: [user_tag(user_id)])
 async def get_user(user_id: PydanticObjectId): # Use Beanie's PydanticObjectId for path param
     # Use Beanie's find_one() method by primary key (_id)
     user = await User.find_one(User.id == user_id) # Type-safe query!
@@ -63,21 +136,34 @@ async def get_user(user_id: PydanticObjectId): # Use Beanie's PydanticObjectId f
     else:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
 
-@router.put("/users/{user_id}", response_model=User)
-async def update_user(user_id: PydanticObjectId, user_update: UserCreate):
+def user_etag(user: User) -> str:
+    # GET /users/{user_id} is cached and its ETag is the hash of these exact bytes
+    return content_etag(dump_json(User, user))
+
+@router.put("/users/{user_id}", response_model=User, dependencies=[rate_limit()])
+async def update_user(
+    user_id: PydanticObjectId,
+    user_update: UserCreate,
+    if_match: Optional[str] = Header(None, description="ETag from a previous GET; the update fails with 412 if the user changed since"),
+):
     # Find the user by ID
     user = await User.find_one(User.id == user_id)
     if not user:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
+    check_if_match(if_match, user_etag(user))
 
-    # Update the document using Beanie's set or update methods
-    # `set` replaces fields, `update` uses MongoDB operators like $set
-    # Beanie allows direct assignment and then saving
-    user.name = user_update.name
-    user.email = user_update.email
-
+    filters = {"_id": user_id}
+    if if_match is not None:
+        filters["version"] = version_filter([user.version]) # Compare-and-set: also fails if someone wrote after the check above
     try:
-        await user.save() # Save the updated document
+        updated = await User.get_pymongo_collection().find_one_and_update(
+            filters,
+            {
+                "$set": {"name": user_update.name, "email": user_update.email, "updated_at": datetime.now(timezone.utc)},
+                "$inc": {"version": 1},
+            },
+            return_document=ReturnDocument.AFTER,
+        )
     except Exception as e:
         if "duplicate key error" in str(e):
             raise HTTPException(
@@ -88,10 +174,17 @@ async def update_user(user_id: PydanticObjectId, user_update: UserCreate):
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to update user: {e}"
         )
+    if updated is None:
+        if if_match is not None:
+            raise precondition_failed()
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
 
-    return user
+    await invalidate_tags(USERS_TAG, user_tag(user_id))
+    # Serialized exactly like the cached GET, so the ETag sent here is the one the next GET will carry
+    body = dump_json(User, User.model_validate(updated))
+    return json_response(body, headers={"ETag": content_etag(body)})
 
-@router.delete("/users/{user_id}", status_code=status.HTTP_204_NO_CONTENT) # 204 No Content for successful deletion
+@router.delete("/users/{user_id}", status_code=status.HTTP_204_NO_CONTENT, dependencies=[rate_limit()]) # 204 No Content for successful deletion
 async def delete_user(user_id: PydanticObjectId):
     # Find the user by ID
     user = await User.find_one(User.id == user_id)
@@ -100,4 +193,5 @@ async def delete_user(user_id: PydanticObjectId):
 
     # Delete the document using Beanie's delete() method
     await user.delete()
+    await invalidate_tags(USERS_TAG, user_tag(user_id))
     return {"message": "User deleted"} # Or simply return None for 204
@@ -0,0 +1,155 @@
+import json
+from typing import Any, AsyncIterator, Awaitable, Callable, List, Optional, Tuple
+
+from fastapi import HTTPException, Request, status
+from pydantic import TypeAdapter, ValidationError
+from pymongo import ReplaceOne, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from app.core.streaming import NDJSON_MEDIA_TYPE
+from app.models.response_models import BulkItemError, BulkResult
+
+DEFAULT_BULK_BATCH_SIZE = 1000
+MAX_BULK_BATCH_SIZE = 10_000
+MAX_REPORTED_ERRORS = 1000 # Past this only the failure count keeps growing
+
+# (index of the item in the upload, pymongo write op, _id of the affected document)
+BulkOp = Tuple[int, Any, Any]
+# (index of the item in the upload, error message)
+BulkFailure = Tuple[int, str]
+PrepareBatch = Callable[[List[Tuple[int, Any]]], Awaitable[Tuple[List[BulkOp], List[BulkFailure]]]]
+OnWritten = Callable[[List[BulkOp]], Awaitable[None]]
+
+
+async def iter_request_items(request: Request) -> AsyncIterator[Any]:
+    """
+    Yields the raw items of a bulk upload: a JSON array body, or an application/x-ndjson body
+    (one JSON document per line), which is consumed as it arrives instead of being buffered whole.
+    NDJSON lines are yielded as bytes and parsed during validation, so a malformed line is a per-item error.
+    """
+    content_type = request.headers.get("content-type", "").split(";")[0].strip()
+    if content_type in (NDJSON_MEDIA_TYPE, "application/ndjson"):
+        pending = b""
+        async for chunk in request.stream():
+            pending += chunk
+            *lines, pending = pending.split(b"\n")
+            for line in lines:
+                if line.strip():
+                    yield line
+        if pending.strip():
+            yield pending
+        return
+
+    try:
+        items = json.loads(await request.body())
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Body must be a JSON array or NDJSON")
+    if not isinstance(items, list):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Body must be a JSON array or NDJSON")
+    for item in items:
+        yield item
+
+
+def record_error(result: BulkResult, index: int, error: str):
+    result.failed += 1
+    if len(result.errors) < MAX_REPORTED_ERRORS:
+        result.errors.append(BulkItemError(index=index, error=error))
+    else:
+        result.errors_truncated = True
+
+
+def _format_validation_error(e: ValidationError) -> str:
+    return "; ".join(f"{'.'.join(map(str, err['loc'])) or 'item'}: {err['msg']}" for err in e.errors())
+
+
+async def run_bulk(
+    items: AsyncIterator[Any],
+    adapter: TypeAdapter,
+    collection,
+    prepare: PrepareBatch,
+    batch_size: int,
+    ordered: bool,
+    collect_ids: bool = False,
+    on_written: Optional[OnWritten] = None,
+) -> BulkResult:
+    """
+    Validates `items` with `adapter` and writes them `batch_size` at a time with one bulk_write per batch.
+
+    `prepare` turns a batch of validated (index, item) pairs into write ops, doing any per-batch lookups
+    (e.g. a single $in query for referenced documents) and recording per-item errors on the result.
+    With ordered=True processing stops at the first failing item, like an ordered bulk_write; items before
+    it are still written. Otherwise every valid item is written and all failures are reported.
+    `on_written`, if given, is called after each batch with the ops that were actually written. An update or
+    replace whose document was deleted after `prepare` looked it up matches nothing and counts as failed.
+    """
+    result = BulkResult(ids=[] if collect_ids else None)
+    batch: List[Tuple[int, Any]] = []
+    index = -1
+
+    async def flush() -> bool:
+        """Writes the current batch; returns False when an ordered run has to stop."""
+        valid, failures = [], []
+        for item_index, raw in batch:
+            try:
+                valid.append((item_index, adapter.validate_json(raw) if isinstance(raw, bytes) else adapter.validate_python(raw)))
+            except ValidationError as e:
+                failures.append((item_index, _format_validation_error(e)))
+        batch.clear()
+
+        ops, prepare_failures = await prepare(valid)
+        failures.extend(prepare_failures)
+        stop_at: Optional[int] = None
+        if ordered and failures:
+            stop_at = min(item_index for item_index, _ in failures)
+            failures = [f for f in failures if f[0] == stop_at]
+            ops = [op for op in ops if op[0] < stop_at]
+        for item_index, error in sorted(failures):
+            record_error(result, item_index, error)
+
+        failed_positions = set()
+        matched: Optional[int] = None
+        if ops:
+            try:
+                matched = (await collection.bulk_write([op for _, op, _ in ops], ordered=ordered)).matched_count
+            except BulkWriteError as e:
+                matched = e.details.get("nMatched")
+                write_errors = e.details.get("writeErrors", [])
+                for write_error in write_errors:
+                    failed_positions.add(write_error["index"])
+                    record_error(result, ops[write_error["index"]][0], write_error.get("errmsg", "Write failed"))
+                if ordered and write_errors:
+                    # An ordered bulk_write stops at its first error; nothing after it was attempted
+                    first = write_errors[0]["index"]
+                    failed_positions |= set(range(first, len(ops)))
+                    stop_at = ops[first][0]
+
+        # bulk_write only reports how many updates matched in total: if some did not, one $in query tells which
+        updates = [position for position, (_, op, _) in enumerate(ops) if position not in failed_positions and isinstance(op, (UpdateOne, ReplaceOne))]
+        if matched is not None and matched < len(updates):
+            remaining = {doc["_id"] for doc in await collection.find({"_id": {"$in": list({ops[p][2] for p in updates})}}, {"_id": 1}).to_list()}
+            for position in updates:
+                item_index, _, doc_id = ops[position]
+                if doc_id not in remaining:
+                    failed_positions.add(position)
+                    record_error(result, item_index, f"Document with ID {doc_id} no longer exists.")
+                    if ordered:
+                        stop_at = min(item_index, stop_at) if stop_at is not None else item_index
+
+        written = [op for position, op in enumerate(ops) if position not in failed_positions]
+        result.succeeded += len(written)
+        if collect_ids:
+            result.ids.extend(doc_id for _, _, doc_id in written)
+        if on_written and written:
+            await on_written(written)
+        return stop_at is None
+
+    async for raw in items:
+        index += 1
+        batch.append((index, raw))
+        if len(batch) >= batch_size and not await flush():
+            break
+    else:
+        if batch:
+            await flush()
+    result.processed = index + 1
+    return result
@@ -1,25 +1,113 @@
+import asyncio
+import functools
+import hashlib
+import inspect
+import json
+import logging
+import random
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Union
+
 import redis.asyncio as redis # Use async Redis client
-from app.core.config import REDIS_URL
+from fastapi import Header, Response
+from pydantic import TypeAdapter
+from app.core.config import (
+    REDIS_URL, REDIS_MAX_CONNECTIONS, REDIS_POOL_TIMEOUT_SECONDS, REDIS_SOCKET_TIMEOUT_SECONDS,
+    REDIS_CONNECT_TIMEOUT_SECONDS, REDIS_HEALTH_CHECK_INTERVAL, REDIS_RETRY_SECONDS, LOCAL_CACHE_MAX_ENTRIES, LOCAL_CACHE_MAX_BYTES, LOCAL_CACHE_TTL_SECONDS,
+    PRINCIPAL_CACHE_MAX_ENTRIES, PRINCIPAL_CACHE_TTL_SECONDS,
+)
+from app.core.conditional import content_etag, is_not_modified, not_modified
+from app.core.local_cache import LocalCache
+from app.core.metrics import Counter, Gauge, InstrumentedRedis, on_scrape, record_startup
+from app.core.serialization import JSON_MEDIA_TYPE
+
+logger = logging.getLogger(__name__)
 
 # Global Redis client instance
 redis_client: redis.Redis = None
 
+# Cache tags. Every cached entry lists the tags it depends on; writes bump the tag versions,
+# which changes the key every dependent entry is stored under, so stale values are never read again
+# (they simply expire). Bumping is O(1) no matter how many keys depend on a tag.
+# Versions are random tokens rather than counters, so a version key that was lost (eviction, flush)
+# comes back with a value it never had before; list ETags are built from them and must never repeat.
+CACHE_TTL_SECONDS = 60 # TTL of @cached route responses; writes drop them earlier through their tags
+PRODUCTS_TAG = "products"
+USERS_TAG = "users"
+TAG_KEY_PREFIX = "cache:tag:"
+LOCK_TIMEOUT_MS = 10_000 # Upper bound for one loader run; the lock expires on its own if a worker dies mid-load
+LOCK_POLL_SECONDS = 0.05
+INVALIDATION_CHANNEL = "cache:invalidate" # Pub/sub channel telling every worker which tags to drop from its local cache
+
+# Deletes the lock only if we still own it (it may have expired and been taken by another worker)
+_RELEASE_LOCK_LUA = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+# In-process single-flight: concurrent misses for the same key inside one worker share one load
+_inflight: Dict[str, asyncio.Future] = {}
+
+class _LoadAbandoned(Exception):
+    """Set on a single-flight future whose owner was cancelled (e.g. its client disconnected) mid-load."""
+
+# Per-worker L1 in front of Redis. Holds pre-serialized response bodies, so a hit costs neither a
+# network round trip nor JSON parsing / response_model validation.
+local_cache = LocalCache(
+    max_entries=LOCAL_CACHE_MAX_ENTRIES,
+    max_bytes=LOCAL_CACHE_MAX_BYTES,
+    default_ttl=LOCAL_CACHE_TTL_SECONDS,
+)
+# Resolved users for bearer tokens, keyed by token id and tagged with user_tag(user.id),
+# so update/delete of a user evicts its principals in every worker. Bounded by entry count only.
+principal_cache = LocalCache(
+    max_entries=PRINCIPAL_CACHE_MAX_ENTRIES,
+    max_bytes=0,
+    default_ttl=PRINCIPAL_CACHE_TTL_SECONDS,
+)
+_local_caches = (local_cache, principal_cache)
+redis_stats = {"hits": 0, "misses": 0, "errors": 0}
+_invalidation_listener: asyncio.Task = None
+_redis_down_until = 0.0 # While Redis is failing, skip it until then and serve from Mongo
+_pending_invalidations: set = set() # Tags whose version bump could not reach Redis yet
+
 async def connect_to_redis():
-    """Establishes connection to Redis."""
+    """
+    Creates the Redis client. If Redis is unreachable the app still starts: cached routes are served
+    straight from Mongo and Redis is retried every REDIS_RETRY_SECONDS.
+    """
     global redis_client
     if not redis_client:
-        redis_client = redis.from_url(REDIS_URL, decode_responses=True)
+        # Blocking pool: under saturation a request waits up to REDIS_POOL_TIMEOUT_SECONDS for a connection
+        # instead of opening an unbounded number of them
+        pool = redis.BlockingConnectionPool.from_url(
+            REDIS_URL,
+            max_connections=REDIS_MAX_CONNECTIONS,
+            timeout=REDIS_POOL_TIMEOUT_SECONDS,
+            socket_timeout=REDIS_SOCKET_TIMEOUT_SECONDS,
+            socket_connect_timeout=REDIS_CONNECT_TIMEOUT_SECONDS,
+            health_check_interval=REDIS_HEALTH_CHECK_INTERVAL,
+            decode_responses=True,
+        )
+        redis_client = InstrumentedRedis.from_pool(pool) # Times every command for /metrics
+        start = time.perf_counter()
         try:
             # Ping Redis to ensure connection is established
             await redis_client.ping()
             print("Successfully connected to Redis!")
         except Exception as e:
-            print(f"Could not connect to Redis: {e}")
-            redis_client = None # Set to None if connection fails
+            print(f"Could not connect to Redis, serving from MongoDB until it is back: {e}")
+            mark_redis_down(e)
+        record_startup("redis_connect", time.perf_counter() - start)
+        start_invalidation_listener()
 
 async def close_redis_connection():
     """Closes the Redis connection."""
     global redis_client
+    await stop_invalidation_listener()
     if redis_client:
         await redis_client.close()
         print("Redis connection closed.")
@@ -29,4 +117,320 @@ def get_redis_client() -> redis.Redis:
     """Returns the Redis client instance."""
     if not redis_client:
         raise RuntimeError("Redis client not initialized. Call connect_to_redis() first.")
-    return redis_client
\ No newline at end of file
+    if not redis_available():
+        raise RuntimeError("Redis is unavailable.")
+    return redis_client
+
+def redis_available() -> bool:
+    """False if there is no client or a Redis call failed less than REDIS_RETRY_SECONDS ago."""
+    return redis_client is not None and time.monotonic() >= _redis_down_until
+
+def mark_redis_down(error: Exception):
+    """Called after a failed Redis call: everything that checks redis_available() bypasses Redis for a while."""
+    global _redis_down_until
+    redis_stats["errors"] += 1
+    if time.monotonic() >= _redis_down_until: # Log once per outage window, not once per request
+        logger.warning(f"Redis unavailable, bypassing it for {REDIS_RETRY_SECONDS}s: {error}")
+    _redis_down_until = time.monotonic() + REDIS_RETRY_SECONDS
+
+def redis_pool_stats() -> Dict[str, Any]:
+    """Connection pool usage; saturation is in-use connections over max_connections."""
+    if redis_client is None:
+        return {}
+    pool = redis_client.connection_pool
+    in_use = len(pool._in_use_connections)
+    return {
+        "in_use": in_use,
+        "idle": len([c for c in pool._available_connections if c is not None]), # The blocking pool pads its queue with None
+        "max": pool.max_connections,
+        "saturation": round(in_use / pool.max_connections, 3),
+    }
+
+def user_tag(user_id: Any) -> str:
+    """Tag for entries that depend on a single user document."""
+    return f"user:{user_id}"
+
+async def invalidate_tags(*tags: str):
+    """
+    Bumps the version of each tag, orphaning every Redis entry that depends on it, and tells every
+    worker (this one immediately, the others over pub/sub) to drop local entries carrying those tags.
+    """
+    if not tags:
+        return
+    for cache in _local_caches:
+        cache.invalidate_tags(tags)
+    _pending_invalidations.update(tags)
+    await _publish_invalidations()
+
+def invalidate_local_tags(*tags: str):
+    """Drops this worker's local entries carrying `tags`, without bumping Redis versions or notifying other workers."""
+    for cache in _local_caches:
+        cache.invalidate_tags(tags)
+
+async def _publish_invalidations():
+    """
+    Sends the pending tag bumps to Redis. If Redis is down they stay pending and go out with the next
+    Redis call once it is back, so entries cached before the outage are not served afterwards.
+    """
+    if not _pending_invalidations or not redis_available():
+        return
+    tags = sorted(_pending_invalidations)
+    try:
+        async with redis_client.pipeline(transaction=False) as pipe:
+            for tag in tags:
+                pipe.set(TAG_KEY_PREFIX + tag, uuid.uuid4().hex)
+            pipe.publish(INVALIDATION_CHANNEL, json.dumps(tags))
+            await pipe.execute()
+        _pending_invalidations.difference_update(tags)
+    except redis.RedisError as e:
+        mark_redis_down(e)
+
+async def _listen_for_invalidations():
+    while True:
+        pubsub = redis_client.pubsub()
+        try:
+            await pubsub.subscribe(INVALIDATION_CHANNEL)
+            # Messages published while we were not subscribed are lost, so start from a clean slate
+            _clear_local_caches()
+            await _publish_invalidations()
+            while True:
+                # Explicit timeout: a plain listen() would hit the pool's socket timeout whenever the channel is quiet
+                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                if message is not None and message["type"] == "message":
+                    tags = json.loads(message["data"])
+                    for cache in _local_caches:
+                        cache.invalidate_tags(tags)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            if redis_available():
+                logger.warning(f"Cache invalidation subscription lost, retrying: {e}")
+            _clear_local_caches()
+            await asyncio.sleep(REDIS_RETRY_SECONDS)
+        finally:
+            await pubsub.aclose()
+
+def _clear_local_caches():
+    for cache in _local_caches:
+        cache.clear()
+
+def start_invalidation_listener():
+    global _invalidation_listener
+    if _invalidation_listener is None:
+        _invalidation_listener = asyncio.create_task(_listen_for_invalidations())
+
+async def stop_invalidation_listener():
+    global _invalidation_listener
+    if _invalidation_listener is not None:
+        _invalidation_listener.cancel()
+        try:
+            await _invalidation_listener
+        except asyncio.CancelledError:
+            pass
+        _invalidation_listener = None
+
+def cache_stats() -> Dict[str, Any]:
+    """Hit/miss/eviction counters for this worker's local caches and its Redis lookups."""
+    return {"local": local_cache.stats(), "principal": principal_cache.stats(), "redis": dict(redis_stats, available=redis_available())}
+
+CACHE_REQUESTS = Counter("cache_requests_total", "Cache lookups by tier and result", ("tier", "result"))
+CACHE_EVICTIONS = Counter("cache_evictions_total", "Entries dropped from a local cache to stay within its limits", ("tier",))
+CACHE_ENTRIES = Gauge("cache_entries", "Entries currently held in a local cache", ("tier",))
+CACHE_BYTES = Gauge("cache_bytes", "Bytes currently held in a local cache", ("tier",))
+
+@on_scrape
+def _export_cache_stats():
+    for tier, cache in (("local", local_cache), ("principal", principal_cache)):
+        CACHE_REQUESTS.set_total(tier, "hit", value=cache.hits)
+        CACHE_REQUESTS.set_total(tier, "miss", value=cache.misses)
+        CACHE_EVICTIONS.set_total(tier, value=cache.evictions)
+        CACHE_ENTRIES.set(tier, value=len(cache))
+        CACHE_BYTES.set(tier, value=cache.current_bytes)
+    CACHE_REQUESTS.set_total("redis", "hit", value=redis_stats["hits"])
+    CACHE_REQUESTS.set_total("redis", "miss", value=redis_stats["misses"])
+    CACHE_REQUESTS.set_total("redis", "error", value=redis_stats["errors"])
+
+def _fingerprint(value: Any) -> str:
+    return hashlib.sha1(json.dumps(value, sort_keys=True, default=str).encode()).hexdigest()
+
+async def _tag_versions(client: redis.Redis, tags: List[str]) -> List[str]:
+    if not tags:
+        return []
+    keys = [TAG_KEY_PREFIX + t for t in tags]
+    versions = await client.mget(keys)
+    if None in versions:
+        # Never bumped (or evicted): start it at a fresh random version
+        async with client.pipeline(transaction=False) as pipe:
+            for key, version in zip(keys, versions):
+                if version is None:
+                    pipe.set(key, uuid.uuid4().hex, nx=True)
+            await pipe.execute()
+        versions = await client.mget(keys)
+    return versions
+
+async def tags_etag(namespace: str, params: Dict[str, Any], tags: Iterable[str]) -> Optional[str]:
+    """
+    Strong ETag for a response fully determined by `params` and the data behind `tags`: it changes with
+    every invalidate_tags() of one of them. None while Redis is unavailable (the response then has no ETag).
+    """
+    if not redis_available():
+        return None
+    try:
+        await _publish_invalidations()
+        versions = await _tag_versions(redis_client, sorted(tags))
+    except redis.RedisError as e:
+        mark_redis_down(e)
+        return None
+    return f'"{_fingerprint([namespace, params, versions])}"'
+
+async def _versioned_key(client: redis.Redis, namespace: str, params: Dict[str, Any], tags: Iterable[str]) -> str:
+    tags = sorted(tags)
+    versions = await _tag_versions(client, tags)
+    return f"cache:{namespace}:{_fingerprint(params)}:{_fingerprint([f'{t}={v or 0}' for t, v in zip(tags, versions)])}"
+
+async def _load_and_store(client: redis.Redis, key: str, ttl: int, loader: Callable[[], Awaitable[str]]) -> str:
+    """
+    Runs `loader` under a short-lived Redis lock so that, across all workers, only one of them recomputes
+    an expired key while the others wait for its result instead of piling the same query onto Mongo.
+    """
+    lock_key = f"{key}:lock"
+    token = uuid.uuid4().hex
+    try:
+        locked = await client.set(lock_key, token, nx=True, px=LOCK_TIMEOUT_MS)
+        if not locked:
+            deadline = time.monotonic() + LOCK_TIMEOUT_MS / 1000
+            while time.monotonic() < deadline:
+                await asyncio.sleep(LOCK_POLL_SECONDS)
+                value = await client.get(key)
+                if value is not None:
+                    return value
+                # The holder may have failed (404, bad sort, Mongo error) and released the lock without storing
+                # anything: take the lock over right away instead of waiting out LOCK_TIMEOUT_MS
+                locked = await client.set(lock_key, token, nx=True, px=LOCK_TIMEOUT_MS)
+                if locked:
+                    break
+            else:
+                logger.warning(f"Timed out waiting for {key} to be populated; loading it directly")
+    except redis.RedisError as e:
+        mark_redis_down(e)
+        return await loader()
+    try:
+        value = await loader()
+        try:
+            # A little jitter keeps entries written together from all expiring in the same instant
+            await client.set(key, value, ex=ttl + random.randint(0, max(1, ttl // 10)))
+        except redis.RedisError as e:
+            mark_redis_down(e) # The value is still good; it just isn't cached
+        return value
+    finally:
+        if locked and redis_available():
+            try:
+                await client.eval(_RELEASE_LOCK_LUA, 1, lock_key, token)
+            except redis.RedisError as e:
+                mark_redis_down(e) # The lock expires on its own
+
+async def get_or_load(
+    namespace: str,
+    params: Dict[str, Any],
+    tags: Iterable[str],
+    ttl: int,
+    loader: Callable[[], Awaitable[str]],
+) -> str:
+    """
+    Returns the cached JSON for (namespace, params) at the current tag versions, loading it on a miss.
+    Any Redis failure falls back to calling `loader` directly.
+    """
+    if not redis_available():
+        return await loader()
+    client = redis_client
+    try:
+        await _publish_invalidations()
+        key = await _versioned_key(client, namespace, params, tags)
+        value = await client.get(key)
+    except redis.RedisError as e:
+        mark_redis_down(e)
+        return await loader()
+    if value is not None:
+        redis_stats["hits"] += 1
+        logger.info(f"Cache hit for {namespace}")
+        return value
+    redis_stats["misses"] += 1
+    logger.info(f"Cache miss for {namespace}")
+
+    if key in _inflight:
+        try:
+            return await asyncio.shield(_inflight[key])
+        except _LoadAbandoned:
+            return await loader() # The load we were waiting on was cancelled: don't fail this request for it
+    future = asyncio.get_running_loop().create_future()
+    _inflight[key] = future
+    try:
+        value = await _load_and_store(client, key, ttl, loader)
+        future.set_result(value)
+        return value
+    except Exception as e:
+        future.set_exception(e)
+        raise
+    finally:
+        del _inflight[key]
+        if not future.done(): # Cancelled (CancelledError is not an Exception): release the waiters anyway
+            future.set_exception(_LoadAbandoned())
+        future.exception() # Mark any exception as retrieved so an unwaited future doesn't log "exception never retrieved"
+
+def cached(namespace: str, ttl: int, model: Any, tags: Union[Iterable[str], Callable[..., Iterable[str]]]):
+    """
+    Two-tier read-through cache decorator for route handlers.
+    The handler's keyword arguments (path/query params) are part of the key; `tags` is either a fixed list
+    or a callable receiving the same keyword arguments, e.g. `lambda user_id: [user_tag(user_id)]`.
+
+    `model` is the route's response_model: on a miss the handler result is serialized through it once and
+    the bytes are stored in Redis and in the worker's local cache. Hits return those bytes as-is in a
+    Response, which FastAPI sends without re-validating, while the declared response_model keeps the OpenAPI schema.
+    A handler may also return JSON bytes it serialized itself; those are cached as they are.
+
+    Responses carry a strong ETag hashed from the body (kept next to it in the local cache), and a matching
+    If-None-Match is answered with 304 - on a local hit without any I/O or serialization.
+    """
+    adapter = TypeAdapter(model)
+
+    def decorator(func):
+        @functools.wraps(func) # Keeps the signature so FastAPI still sees the handler's parameters
+        async def wrapper(**kwargs):
+            if_none_match = kwargs.pop("if_none_match")
+            resolved_tags = tuple(tags(**kwargs) if callable(tags) else tags)
+            local_key = (namespace, _fingerprint(kwargs))
+
+            async def loader() -> str:
+                result = await func(**kwargs)
+                if isinstance(result, bytes): # Already serialized by the handler (FAST_SERIALIZATION)
+                    return result.decode()
+                return adapter.dump_json(adapter.validate_python(result), by_alias=True).decode()
+
+            if not redis_available():
+                # Without Redis other workers' invalidations don't reach this one, so skip both tiers
+                body = (await loader()).encode()
+                etag = content_etag(body)
+            else:
+                entry = local_cache.get(local_key)
+                if entry is None:
+                    snapshot = local_cache.snapshot(resolved_tags)
+                    body = (await get_or_load(namespace, kwargs, resolved_tags, ttl, loader)).encode()
+                    etag = content_etag(body)
+                    local_cache.set(
+                        local_key, (body, etag), ttl=min(ttl, LOCAL_CACHE_TTL_SECONDS), tags=resolved_tags,
+                        size=len(body), snapshot=snapshot,
+                    )
+                else:
+                    body, etag = entry
+            if is_not_modified(etag, if_none_match):
+                return not_modified(etag)
+            return Response(content=body, media_type=JSON_MEDIA_TYPE, headers={"ETag": etag})
+
+        # FastAPI reads the handler's signature; add the If-None-Match header to it
+        signature = inspect.signature(func)
+        wrapper.__signature__ = signature.replace(parameters=[
+            *signature.parameters.values(),
+            inspect.Parameter("if_none_match", inspect.Parameter.KEYWORD_ONLY, default=Header(None), annotation=Optional[str]),
+        ])
+        return wrapper
+    return decorator
@@ -0,0 +1,116 @@
+"""
+HTTP conditional request helpers (RFC 9110 section 13): ETag / Last-Modified validators,
+If-None-Match / If-Modified-Since for reads (304) and If-Match for updates (412).
+
+Three kinds of strong ETags are used:
+  document_etag  "<id>-<version>" for single documents, from the version bumped on every write
+  content_etag   hash of a response body, for the routes served from the response cache
+  tag versions   cache.tags_etag() for list endpoints, from the cache tag versions every write bumps,
+                 so a 304 needs one Redis round trip and no MongoDB query at all
+"""
+import hashlib
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Dict, Iterable, List, Optional
+
+from fastapi import HTTPException, Response, status
+
+
+def content_etag(body: bytes) -> str:
+    return '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+
+def document_etag(document) -> str:
+    return f'"{document.id}-{document.version}"'
+
+
+def _as_utc(value: datetime) -> datetime:
+    # PyMongo returns naive datetimes that are in UTC
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value
+
+
+def http_date(value: datetime) -> str:
+    return format_datetime(_as_utc(value), usegmt=True)
+
+
+def _parse_etags(header: str) -> List[str]:
+    return [tag.strip() for tag in header.split(",") if tag.strip()]
+
+
+def validators(etag: Optional[str], last_modified: Optional[datetime] = None) -> Dict[str, str]:
+    headers = {}
+    if etag:
+        headers["ETag"] = etag
+    if last_modified:
+        headers["Last-Modified"] = http_date(last_modified)
+    return headers
+
+
+def is_not_modified(
+    etag: Optional[str],
+    if_none_match: Optional[str],
+    last_modified: Optional[datetime] = None,
+    if_modified_since: Optional[str] = None,
+) -> bool:
+    """True if the client's cached copy is current. If-None-Match (weak comparison) takes precedence over If-Modified-Since."""
+    if if_none_match is not None:
+        if etag is None:
+            return False
+        if if_none_match.strip() == "*":
+            return True
+        return any(tag.removeprefix("W/") == etag.removeprefix("W/") for tag in _parse_etags(if_none_match))
+    if if_modified_since and last_modified:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        # HTTP dates have one-second resolution
+        return _as_utc(last_modified).replace(microsecond=0) <= _as_utc(since)
+    return False
+
+
+def not_modified(etag: Optional[str], last_modified: Optional[datetime] = None) -> Response:
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=validators(etag, last_modified))
+
+
+def precondition_failed() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_412_PRECONDITION_FAILED,
+        detail="The resource has been modified since it was fetched",
+    )
+
+
+def check_if_match(if_match: Optional[str], etag: str):
+    """Raises 412 unless If-Match is absent, '*' or lists `etag` (strong comparison: weak tags never match)."""
+    if if_match is None or if_match.strip() == "*":
+        return
+    if etag not in _parse_etags(if_match):
+        raise precondition_failed()
+
+
+def if_match_versions(if_match: Optional[str], document_id) -> Optional[List[int]]:
+    """
+    Versions of `document_id` listed in If-Match (see document_etag), so a write can compare-and-set on
+    "version" without reading the document first. None when there is no condition (header absent or '*');
+    an empty list matches nothing.
+    """
+    if if_match is None or if_match.strip() == "*":
+        return None
+    prefix = f'"{document_id}-'
+    versions = []
+    for tag in _parse_etags(if_match):
+        version = tag[len(prefix):-1] if tag.startswith(prefix) and tag.endswith('"') else ""
+        if version.isdigit():
+            versions.append(int(version))
+    return versions
+
+
+def version_filter(versions: Iterable[int]) -> Dict[str, list]:
+    """
+    Compare-and-set condition on "version" for the versions an If-Match allows. Documents written before
+    versioning have no version field at all, yet their ETag says 0, so 0 must also match a missing field.
+    """
+    allowed: list = list(versions)
+    if 0 in allowed:
+        allowed.append(None) # {"$in": [None]} matches a missing field
+    return {"$in": allowed}
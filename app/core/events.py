@@ -0,0 +1,309 @@
+"""
+Product change feed behind GET /products/events (Server-Sent Events).
+
+Each worker runs one ProductEventHub: a single watcher on the products collection whose changes are fanned
+out to all of the worker's subscribers, however many there are, and serialized once per change rather than
+once per subscriber. The watcher is a MongoDB change stream when the deployment supports one (replica set or
+sharded cluster). On a standalone server it falls back to polling the updated_at_id index, which sees
+inserts and updates but not deletes, and misses a write that commits more than EVENTS_POLL_OVERLAP_SECONDS after
+the updated_at its writer gave it.
+
+Every subscriber has a bounded queue. One that falls EVENTS_QUEUE_SIZE events behind is disconnected instead
+of slowing the watcher or buffering without limit; the EventSource reconnects with Last-Event-ID. Event ids
+are the change stream's resume tokens ("<updated_at ms>-<_id>" when polling), identical in every worker, and
+the last EVENTS_REPLAY_SIZE events are kept so a reconnect to any worker replays what it missed. An id that
+is no longer in the buffer gets a `reset` event, after which the client should refetch what it displays.
+
+Category filters match the product's category after the change; deletes carry no document and go to everyone.
+
+Browsers' EventSource cannot send an Authorization header, so besides the usual bearer token the stream accepts
+the HttpOnly cookie set by POST /products/events/session, which holds a token valid for this route only.
+
+The same watcher also invalidates the products cache tag on every change, so writes made outside the API
+(scripts, other services, rebuilds) stop being served from cache: this worker's L1 entries are dropped right
+away, and the Redis tag version is bumped once per burst of changes (INVALIDATION_DEBOUNCE_SECONDS), not per change.
+"""
+import asyncio
+import logging
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from typing import Any, AsyncIterator, Deque, Dict, FrozenSet, List, NamedTuple, Optional, Set, Tuple
+
+from pymongo.errors import OperationFailure, PyMongoError
+
+from app.core.cache import invalidate_local_tags, invalidate_tags, PRODUCTS_TAG
+from app.core.config import (
+    EVENTS_MODE, EVENTS_POLL_INTERVAL_SECONDS, EVENTS_POLL_OVERLAP_SECONDS, EVENTS_QUEUE_SIZE, EVENTS_REPLAY_SIZE,
+    EVENTS_HEARTBEAT_SECONDS, EVENTS_RETRY_SECONDS,
+)
+from app.core.metrics import Counter, Gauge, on_scrape
+from app.core.serialization import model_projection, raw_json
+from app.models.product import Product
+
+logger = logging.getLogger(__name__)
+
+EVENT_STREAM_MEDIA_TYPE = "text/event-stream"
+EVENT_STREAM_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"} # No proxy buffering of the stream
+PRODUCT_EVENT_PROJECTION = model_projection(Product)
+POLL_BATCH_SIZE = 500
+RECONNECT_MILLISECONDS = 3000 # EventSource retry delay, sent once per connection
+INVALIDATION_DEBOUNCE_SECONDS = 0.1 # Changes within this long of each other share one Redis tag bump
+
+# Server error codes
+CHANGE_STREAM_UNSUPPORTED = 40573 # "The $changeStream stage is only supported on replica sets"
+CHANGE_STREAM_HISTORY_LOST = 286 # Resume token fell off the oplog
+CHANGE_STREAM_FATAL = 280
+
+_CLOSE = None # Queue sentinel: end the subscriber's stream
+
+EVENTS_PUBLISHED = Counter("product_events_total", "Product change events published by this worker's watcher", ("operation",))
+EVENT_SUBSCRIBERS_DROPPED = Counter("product_event_subscribers_dropped_total", "Event subscribers disconnected for falling behind")
+EVENT_SUBSCRIBERS = Gauge("product_event_subscribers", "Open /products/events connections in this worker")
+
+
+class ProductEvent(NamedTuple):
+    id: str
+    operation: str # insert, update, replace or delete
+    category: Optional[str] # None for deletes
+    frame: bytes # The complete SSE frame, built once for every subscriber
+
+
+def _frame(event_id: str, operation: str, data: bytes) -> bytes:
+    return f"id: {event_id}\nevent: {operation}\ndata: ".encode() + data + b"\n\n"
+
+
+def _event(event_id: str, operation: str, product_id: Any, document: Optional[dict]) -> ProductEvent:
+    data = raw_json({"operation": operation, "id": product_id, "product": document})
+    category = document.get("category") if document else None
+    return ProductEvent(event_id, operation, category, _frame(event_id, operation, data))
+
+
+RESET_FRAME = b"id: \nevent: reset\ndata: {}\n\n" # The empty id clears the client's Last-Event-ID
+
+
+class Subscriber:
+    def __init__(self, categories: Optional[FrozenSet[str]], queue_size: int):
+        self.categories = categories
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+
+    def wants(self, event: ProductEvent) -> bool:
+        return not self.categories or event.category is None or event.category in self.categories
+
+    def offer(self, event: ProductEvent) -> bool:
+        """Queues `event`; returns False, and closes the subscriber, if its queue is full."""
+        try:
+            self.queue.put_nowait(event)
+            return True
+        except asyncio.QueueFull:
+            self.close()
+            return False
+
+    def close(self):
+        # Whatever is still queued is dropped: the client reconnects and replays from its Last-Event-ID
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(_CLOSE)
+
+
+class ProductEventHub:
+    def __init__(self, mode: str, queue_size: int, replay_size: int, poll_interval: float, poll_overlap: float):
+        if mode not in ("auto", "change_stream", "poll"):
+            raise ValueError(f"Unknown EVENTS_MODE '{mode}'. Allowed: auto, change_stream, poll")
+        self.requested_mode = mode
+        self.mode: Optional[str] = None # The watcher actually running
+        self.queue_size = queue_size
+        self.poll_interval = poll_interval
+        self.poll_overlap = timedelta(seconds=poll_overlap)
+        self.subscribers: Set[Subscriber] = set()
+        self.replay: Deque[ProductEvent] = deque(maxlen=replay_size)
+        self._task: Optional[asyncio.Task] = None
+        self._invalidation: Optional[asyncio.Task] = None # Pending debounced Redis bump
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._invalidation is not None:
+            self._invalidation.cancel()
+            self._invalidation = None
+        self.drain()
+
+    def drain(self):
+        """Ends every open stream. Called when shutdown starts: the streams would otherwise hold the graceful drain open."""
+        for subscriber in list(self.subscribers):
+            subscriber.close()
+        self.subscribers.clear()
+
+    def subscribe(self, categories: Optional[List[str]] = None, last_event_id: Optional[str] = None):
+        """
+        Registers a subscriber and returns (subscriber, backlog). The backlog is the replayed events after
+        `last_event_id`, or None if that id is too old to replay (the client must be sent a reset).
+        """
+        subscriber = Subscriber(frozenset(categories) if categories else None, self.queue_size)
+        backlog: Optional[List[ProductEvent]] = []
+        if last_event_id:
+            backlog = None
+            for position, event in enumerate(self.replay):
+                if event.id == last_event_id:
+                    backlog = [e for e in list(self.replay)[position + 1:] if subscriber.wants(e)]
+                    break
+        self.subscribers.add(subscriber)
+        return subscriber, backlog
+
+    def unsubscribe(self, subscriber: Subscriber):
+        self.subscribers.discard(subscriber)
+
+    def publish(self, event: ProductEvent):
+        EVENTS_PUBLISHED.inc(event.operation)
+        self.replay.append(event)
+        self._invalidate_cache()
+        for subscriber in list(self.subscribers):
+            if subscriber.wants(event) and not subscriber.offer(event):
+                self.subscribers.discard(subscriber)
+                EVENT_SUBSCRIBERS_DROPPED.inc()
+
+    def _reset_all(self):
+        # Changes may have been missed: nothing in the replay buffer can be trusted as a resume point
+        self.replay.clear()
+        self._invalidate_cache()
+        self.drain()
+
+    def _invalidate_cache(self):
+        # L1 right away; the Redis bump (which also reaches the other workers) once the burst is over
+        invalidate_local_tags(PRODUCTS_TAG)
+        if self._invalidation is None:
+            self._invalidation = asyncio.create_task(self._bump_products_tag())
+
+    async def _bump_products_tag(self):
+        await asyncio.sleep(INVALIDATION_DEBOUNCE_SECONDS)
+        self._invalidation = None # Changes from here on schedule the next bump
+        await invalidate_tags(PRODUCTS_TAG) # Never raises: a Redis outage leaves the bump pending
+
+    async def stream(self, subscriber: Subscriber, backlog: Optional[List[ProductEvent]]) -> AsyncIterator[bytes]:
+        """SSE body for one subscriber; unsubscribes when the client goes away or the hub drops it."""
+        try:
+            yield f"retry: {RECONNECT_MILLISECONDS}\n\n".encode()
+            if backlog is None:
+                yield RESET_FRAME
+            else:
+                for event in backlog:
+                    yield event.frame
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscriber.queue.get(), EVENTS_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield b": keepalive\n\n"
+                    continue
+                if event is _CLOSE:
+                    return
+                yield event.frame
+        finally:
+            self.unsubscribe(subscriber)
+
+    async def _run(self):
+        if self.requested_mode != "poll":
+            try:
+                await self._watch()
+                return
+            except OperationFailure as e:
+                if e.code != CHANGE_STREAM_UNSUPPORTED or self.requested_mode == "change_stream":
+                    raise
+                logger.warning("Change streams need a replica set; polling products.updated_at for /products/events instead")
+        await self._poll()
+
+    async def _watch(self):
+        collection = Product.get_pymongo_collection()
+        pipeline = [
+            {"$match": {"operationType": {"$in": ["insert", "update", "replace", "delete"]}}},
+            {"$project": {"operationType": 1, "documentKey": 1, "fullDocument": PRODUCT_EVENT_PROJECTION}},
+        ]
+        resume_token = None
+        while True:
+            try:
+                # updateLookup: update events carry the current document, so they can be filtered by category
+                async with await collection.watch(pipeline, full_document="updateLookup", resume_after=resume_token) as stream:
+                    self.mode = "change_stream"
+                    async for change in stream:
+                        resume_token = change["_id"]
+                        if change["operationType"] == "invalidate": # Collection dropped or renamed
+                            resume_token = None
+                            self._reset_all()
+                            break
+                        self.publish(_event(
+                            resume_token["_data"], change["operationType"],
+                            change["documentKey"]["_id"], change.get("fullDocument"),
+                        ))
+            except OperationFailure as e:
+                if e.code == CHANGE_STREAM_UNSUPPORTED:
+                    raise
+                if e.code in (CHANGE_STREAM_HISTORY_LOST, CHANGE_STREAM_FATAL):
+                    logger.warning(f"Product change stream cannot resume, restarting from now: {e}")
+                    resume_token = None
+                    self._reset_all()
+                else:
+                    logger.warning(f"Product change stream failed, resuming: {e}")
+                await asyncio.sleep(EVENTS_RETRY_SECONDS)
+            except PyMongoError as e:
+                logger.warning(f"Product change stream failed, resuming: {e}")
+                await asyncio.sleep(EVENTS_RETRY_SECONDS)
+
+    async def _poll(self):
+        # updated_at is set by the writer, so a write can commit after the poller has moved past its timestamp.
+        # Every round re-reads the last poll_overlap of updated_at and skips the (_id, updated_at, version) already
+        # published; a write that commits more than poll_overlap after its timestamp is still missed.
+        collection = Product.get_pymongo_collection()
+        self.mode = "poll"
+        seen: Dict[Tuple[Any, datetime, Any], datetime] = {}
+        watermark: Optional[datetime] = None # Latest updated_at seen
+        initialized = False
+        while True:
+            try:
+                if not initialized:
+                    last = await collection.find_one({"updated_at": {"$ne": None}}, {"updated_at": 1}, sort=[("updated_at", -1), ("_id", -1)])
+                    watermark = last["updated_at"] if last else None
+                since = watermark - self.poll_overlap if watermark else None
+                position = None # (updated_at, _id) of the last document read this round
+                while True:
+                    if position:
+                        updated_at, last_id = position
+                        filters = {"$or": [{"updated_at": {"$gt": updated_at}}, {"updated_at": updated_at, "_id": {"$gt": last_id}}]}
+                    else:
+                        filters = {"updated_at": {"$gte": since}} if since else {"updated_at": {"$ne": None}}
+                    docs = await (
+                        collection.find(filters, PRODUCT_EVENT_PROJECTION).sort([("updated_at", 1), ("_id", 1)]).limit(POLL_BATCH_SIZE).to_list()
+                    )
+                    for doc in docs:
+                        position = (doc["updated_at"], doc["_id"])
+                        key = (doc["_id"], doc["updated_at"], doc.get("version"))
+                        if key in seen:
+                            continue
+                        seen[key] = doc["updated_at"]
+                        watermark = max(watermark, doc["updated_at"]) if watermark else doc["updated_at"]
+                        if initialized: # The first round only records what existed before we started
+                            # Same id in every worker, like a resume token
+                            event_id = f"{int(doc['updated_at'].replace(tzinfo=timezone.utc).timestamp() * 1000)}-{doc['_id']}"
+                            self.publish(_event(event_id, "insert" if doc.get("version") == 1 else "update", doc["_id"], doc))
+                    if len(docs) < POLL_BATCH_SIZE:
+                        break
+                initialized = True
+                if watermark:
+                    horizon = watermark - self.poll_overlap
+                    seen = {key: updated_at for key, updated_at in seen.items() if updated_at >= horizon}
+            except PyMongoError as e:
+                logger.warning(f"Product change polling failed, retrying: {e}")
+            await asyncio.sleep(self.poll_interval)
+
+product_events = ProductEventHub(EVENTS_MODE, EVENTS_QUEUE_SIZE, EVENTS_REPLAY_SIZE, EVENTS_POLL_INTERVAL_SECONDS, EVENTS_POLL_OVERLAP_SECONDS)
+
+
+@on_scrape
+def _export_subscribers():
+    EVENT_SUBSCRIBERS.set(value=len(product_events.subscribers))
@@ -0,0 +1,133 @@
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Iterable, NamedTuple, Optional, Set, Tuple
+
+
+class _Entry(NamedTuple):
+    value: Any
+    expires_at: float
+    size: int
+    tags: Tuple[str, ...]
+
+
+class LocalCache:
+    """
+    Bounded in-process LRU cache with per-entry TTL, a total size cap and tag-based invalidation.
+
+    One instance lives in each worker process in front of Redis. It is not thread-safe; it is only
+    touched from the event loop. Entries are dropped when their TTL passes, when the LRU needs room
+    (either cap), or when one of their tags is invalidated.
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int, default_ttl: float):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self._entries: "OrderedDict[Hashable, _Entry]" = OrderedDict()
+        self._keys_by_tag: Dict[str, Set[Hashable]] = {}
+        self._tag_generations: Dict[str, int] = {}
+        self._epoch = 0 # Bumped by clear()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        if entry.expires_at <= time.monotonic():
+            self._remove(key)
+            self.expirations += 1
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry.value
+
+    def snapshot(self, tags: Iterable[str]) -> Tuple[int, ...]:
+        """
+        Returns the invalidation generation of `tags`. Take it before loading a value and pass it to set():
+        if any tag was invalidated while the load was in flight, the (possibly stale) value is not stored.
+        """
+        return (self._epoch, *(self._tag_generations.get(t, 0) for t in tags))
+
+    def set(
+        self,
+        key: Hashable,
+        value: Any,
+        ttl: Optional[float] = None,
+        tags: Iterable[str] = (),
+        size: Optional[int] = None,
+        snapshot: Optional[Tuple[int, ...]] = None,
+    ):
+        tags = tuple(tags)
+        if snapshot is not None and snapshot != self.snapshot(tags):
+            return
+        if size is None:
+            size = len(value) if isinstance(value, (bytes, str)) else 0
+        if size > self.max_bytes:
+            return # Would evict everything else and still not fit
+        if key in self._entries:
+            self._remove(key)
+
+        ttl = self.default_ttl if ttl is None else ttl
+        self._entries[key] = _Entry(value, time.monotonic() + ttl, size, tags)
+        self.current_bytes += size
+        for tag in tags:
+            self._keys_by_tag.setdefault(tag, set()).add(key)
+
+        while len(self._entries) > self.max_entries or self.current_bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def delete(self, key: Hashable):
+        if key in self._entries:
+            self._remove(key)
+
+    def invalidate_tags(self, tags: Iterable[str]) -> int:
+        """Drops every entry carrying one of `tags`; returns how many were dropped."""
+        dropped = 0
+        for tag in tags:
+            self._tag_generations[tag] = self._tag_generations.get(tag, 0) + 1
+            for key in self._keys_by_tag.pop(tag, ()):
+                if key in self._entries:
+                    self._remove(key)
+                    dropped += 1
+        self.invalidations += dropped
+        return dropped
+
+    def clear(self):
+        self.invalidations += len(self._entries)
+        self._entries.clear()
+        self._keys_by_tag.clear()
+        self.current_bytes = 0
+        self._epoch += 1 # In-flight loads started before the clear are not stored
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "entries": len(self._entries),
+            "bytes": self.current_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+        }
+
+    def _remove(self, key: Hashable):
+        entry = self._entries.pop(key)
+        self.current_bytes -= entry.size
+        for tag in entry.tags:
+            keys = self._keys_by_tag.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._keys_by_tag[tag]
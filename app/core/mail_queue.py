@@ -0,0 +1,243 @@
+import asyncio
+import json
+import logging
+import time
+import uuid
+from collections import deque
+from typing import TYPE_CHECKING, Deque, List, Optional
+
+import redis.asyncio as redis
+
+if TYPE_CHECKING:
+    import aiosmtplib # Imported in the pool methods: the API process enqueues mail but never opens SMTP connections
+
+from app.core import cache
+from app.core.config import (
+    MAIL_QUEUE_ENABLED, MAIL_BATCH_SIZE, MAIL_MAX_ATTEMPTS, MAIL_RETRY_BASE_SECONDS, MAIL_RETRY_MAX_SECONDS,
+)
+from app.core.mailer import TEMPLATES
+
+logger = logging.getLogger(__name__)
+
+# Redis keys. Jobs are JSON strings: LPUSHed onto QUEUE_KEY and moved atomically into the worker's
+# processing list while being sent, so a crash never loses one (it is recovered on the next start).
+QUEUE_KEY = "mail:queue"
+PROCESSING_KEY_PREFIX = "mail:processing:"
+RETRY_KEY = "mail:retry" # Sorted set scored by the time the job is due again
+DEAD_LETTER_KEY = "mail:dead"
+RETRY_POLL_SECONDS = 1.0
+
+# Moves up to ARGV[2] due jobs from the retry set back onto the queue
+_PROMOTE_DUE_LUA = """
+local due = redis.call('zrangebyscore', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+for _, job in ipairs(due) do
+    redis.call('zrem', KEYS[1], job)
+    redis.call('lpush', KEYS[2], job)
+end
+return #due
+"""
+
+
+async def enqueue_email(kind: str, **fields) -> bool:
+    """
+    Queues an email for the mail worker. Returns False if the queue is disabled or Redis is unavailable,
+    in which case the caller should fall back to sending it itself.
+    """
+    if not MAIL_QUEUE_ENABLED or not cache.redis_available():
+        return False
+    job = {"id": uuid.uuid4().hex, "kind": kind, "attempts": 0, **fields}
+    try:
+        await cache.redis_client.lpush(QUEUE_KEY, json.dumps(job))
+        return True
+    except redis.RedisError as e:
+        logger.warning(f"Could not queue {kind} email, sending inline instead: {e}")
+        return False
+
+
+async def enqueue_welcome_email(recipient_email: str, recipient_name: str) -> bool:
+    return await enqueue_email("welcome", to=recipient_email, name=recipient_name)
+
+
+def retry_delay(attempts: int) -> float:
+    """Exponential backoff: base, 2*base, 4*base, ... capped at MAIL_RETRY_MAX_SECONDS."""
+    return min(MAIL_RETRY_BASE_SECONDS * 2 ** (attempts - 1), MAIL_RETRY_MAX_SECONDS)
+
+
+class SMTPConnectionPool:
+    """
+    Fixed-size pool of persistent aiosmtplib connections. acquire() waits when all `size` slots are taken,
+    which also caps the number of concurrent sends. A slot is given back on every path (sent, broken
+    connection, failed connect), so a waiter always wakes up and opens a fresh connection if it needs one.
+    """
+
+    def __init__(self, hostname: str, port: int, size: int, timeout: float):
+        self.hostname = hostname
+        self.port = port
+        self.size = size
+        self.timeout = timeout # Per SMTP operation, and for waiting on a free slot
+        self._slots = asyncio.Semaphore(size)
+        self._idle: Deque["aiosmtplib.SMTP"] = deque()
+
+    async def _connect(self) -> "aiosmtplib.SMTP":
+        import aiosmtplib
+        client = aiosmtplib.SMTP(hostname=self.hostname, port=self.port, timeout=self.timeout)
+        await client.connect()
+        return client
+
+    async def acquire(self) -> "aiosmtplib.SMTP":
+        # Raises asyncio.TimeoutError if no slot frees up in time; the job is then retried like any failed send
+        await asyncio.wait_for(self._slots.acquire(), self.timeout)
+        try:
+            client = self._idle.pop() if self._idle else None
+            if client is None:
+                return await self._connect()
+            if not client.is_connected: # The server may have dropped an idle connection
+                await client.connect()
+            return client
+        except BaseException:
+            self._slots.release()
+            raise
+
+    async def release(self, client: "aiosmtplib.SMTP", broken: bool = False):
+        if broken:
+            client.close()
+        else:
+            self._idle.append(client)
+        self._slots.release()
+
+    async def send(self, message):
+        """Sends over a pooled connection, retrying once on a fresh one if the server had hung up."""
+        import aiosmtplib
+        for attempt in range(2):
+            client = await self.acquire()
+            try:
+                await client.send_message(message)
+            except aiosmtplib.SMTPServerDisconnected:
+                await self.release(client, broken=True)
+                if attempt:
+                    raise
+                continue
+            except Exception:
+                await self.release(client, broken=True)
+                raise
+            await self.release(client)
+            return
+
+    async def close(self):
+        while self._idle:
+            client = self._idle.pop()
+            try:
+                await client.quit()
+            except Exception:
+                client.close()
+
+
+class MailWorker:
+    """
+    Consumes the mail queue: takes up to MAIL_BATCH_SIZE jobs at a time, sends them concurrently over the
+    connection pool, re-schedules failures with exponential backoff and dead-letters them after
+    MAIL_MAX_ATTEMPTS attempts.
+    """
+
+    def __init__(self, client: redis.Redis, pool: SMTPConnectionPool, worker_id: str, batch_size: int = MAIL_BATCH_SIZE):
+        self.redis = client
+        self.pool = pool
+        self.processing_key = PROCESSING_KEY_PREFIX + worker_id
+        self.batch_size = batch_size
+        self.sent = 0
+        self.retried = 0
+        self.dead_lettered = 0
+        self._next_retry_poll = 0.0
+
+    async def recover(self) -> int:
+        """Puts back jobs this worker had taken but not finished before it last stopped."""
+        recovered = 0
+        while await self.redis.lmove(self.processing_key, QUEUE_KEY, "LEFT", "RIGHT"):
+            recovered += 1
+        if recovered:
+            logger.warning(f"Recovered {recovered} unfinished mail job(s)")
+        return recovered
+
+    async def promote_due_retries(self):
+        now = time.time()
+        if now < self._next_retry_poll:
+            return
+        self._next_retry_poll = now + RETRY_POLL_SECONDS
+        await self.redis.eval(_PROMOTE_DUE_LUA, 2, RETRY_KEY, QUEUE_KEY, now, self.batch_size * 10)
+
+    async def fetch_batch(self, timeout: float = 1.0) -> List[str]:
+        first = await self.redis.blmove(QUEUE_KEY, self.processing_key, timeout, "RIGHT", "LEFT")
+        if first is None:
+            return []
+        batch = [first]
+        while len(batch) < self.batch_size:
+            job = await self.redis.lmove(QUEUE_KEY, self.processing_key, "RIGHT", "LEFT")
+            if job is None:
+                break
+            batch.append(job)
+        return batch
+
+    async def process(self, raw: str):
+        try:
+            job = json.loads(raw)
+            if not (isinstance(job, dict) and isinstance(job.get("kind"), str) and isinstance(job.get("attempts"), int)):
+                raise ValueError("not a mail job")
+        except ValueError as e: # Includes JSONDecodeError
+            await self._dead_letter_malformed(raw, e)
+            return
+        try:
+            await self.pool.send(TEMPLATES[job["kind"]](job))
+        except Exception as e:
+            await self._fail(raw, job, e)
+            return
+        await self.redis.lrem(self.processing_key, 1, raw)
+        self.sent += 1
+        logger.info(f"{job['kind']} email sent to {job.get('to')}")
+
+    async def _fail(self, raw: str, job: dict, error: Exception):
+        job["attempts"] += 1
+        job["last_error"] = str(error)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.lrem(self.processing_key, 1, raw)
+            if job["attempts"] >= MAIL_MAX_ATTEMPTS or job["kind"] not in TEMPLATES:
+                pipe.lpush(DEAD_LETTER_KEY, json.dumps(job))
+                self.dead_lettered += 1
+                logger.error(f"Giving up on {job['kind']} email to {job.get('to')} after {job['attempts']} attempt(s): {error}")
+            else:
+                delay = retry_delay(job["attempts"])
+                pipe.zadd(RETRY_KEY, {json.dumps(job): time.time() + delay})
+                self.retried += 1
+                logger.warning(f"Failed to send {job['kind']} email to {job.get('to')}, retrying in {delay:.0f}s: {error}")
+            await pipe.execute()
+
+    async def _dead_letter_malformed(self, raw: str, error: Exception):
+        # Kept as it was received, so it can be inspected
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.lrem(self.processing_key, 1, raw)
+            pipe.lpush(DEAD_LETTER_KEY, raw)
+            await pipe.execute()
+        self.dead_lettered += 1
+        logger.error(f"Dead-lettered a malformed mail job ({error}): {raw[:200]!r}")
+
+    async def run(self, stop: Optional[asyncio.Event] = None):
+        """Processes batches until `stop` is set; the batch in progress is always finished first."""
+        stop = stop or asyncio.Event()
+        await self.recover()
+        while not stop.is_set():
+            try:
+                await self.promote_due_retries()
+                batch = await self.fetch_batch()
+            except redis.RedisError as e:
+                logger.error(f"Mail queue unavailable: {e}")
+                await asyncio.sleep(1)
+                continue
+            if batch:
+                await asyncio.gather(*(self._process_logged(raw) for raw in batch))
+
+    async def _process_logged(self, raw: str):
+        # A Redis failure while acking or rescheduling one job must not take down the worker (or the rest of the
+        # batch). The job stays in the processing list and is recovered on the next start, so it may be sent twice.
+        try:
+            await self.process(raw)
+        except redis.RedisError as e:
+            logger.error(f"Mail queue unavailable while finishing a job, it will be recovered on restart: {e}")
@@ -1,4 +1,3 @@
-import aiosmtplib
 from email.message import EmailMessage
 import logging
 
@@ -6,7 +5,7 @@ from app.core.config import SMTP_HOST, SMTP_PORT, SENDER_EMAIL
 
 logger = logging.getLogger(__name__)
 
-async def send_welcome_email(recipient_email: str, recipient_name: str):
+def build_welcome_email(recipient_email: str, recipient_name: str) -> EmailMessage:
     msg = EmailMessage()
     msg["Subject"] = "Welcome to Our Application!"
     msg["From"] = SENDER_EMAIL
@@ -23,6 +22,17 @@ async def send_welcome_email(recipient_email: str, recipient_name: str):
     The App Team
     """
     msg.set_content(body)
+    return msg
+
+# Message builders by job kind, used by the mail queue worker
+TEMPLATES = {
+    "welcome": lambda job: build_welcome_email(job["to"], job["name"]),
+}
+
+async def send_welcome_email(recipient_email: str, recipient_name: str):
+    """Sends the welcome email directly over a fresh SMTP connection (fallback when the mail queue is unavailable)."""
+    import aiosmtplib # Only needed on this fallback path; not loaded at boot
+    msg = build_welcome_email(recipient_email, recipient_name)
 
     try:
         await aiosmtplib.send(
@@ -34,4 +44,4 @@ async def send_welcome_email(recipient_email: str, recipient_name: str):
     except aiosmtplib.SMTPException as e:
         logger.error(f"Failed to send welcome email to {recipient_email}: {e}", exc_info=True)
     except Exception as e:
-        logger.error(f"An unexpected error occurred while sending email to {recipient_email}: {e}", exc_info=True)
\ No newline at end of file
+        logger.error(f"An unexpected error occurred while sending email to {recipient_email}: {e}", exc_info=True)
@@ -0,0 +1,331 @@
+"""
+Minimal in-process Prometheus instrumentation: counters, gauges and histograms rendered in the
+text exposition format on /metrics, an ASGI middleware timing every route, a PyMongo command
+listener and a Redis client that times every command.
+
+Everything here runs on the request path, so recording is a dict lookup plus a few integer
+additions; all formatting happens at scrape time.
+"""
+import contextvars
+import logging
+import random
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import redis.asyncio as redis
+from pymongo import monitoring
+
+from app.core.config import SLOW_REQUEST_SECONDS, SLOW_REQUEST_SAMPLE_RATE
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_metrics: List["_Metric"] = []
+_scrape_hooks: List[Callable[[], None]] = []
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence, extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        _metrics.append(self)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, *labels, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def set_total(self, *labels, value: float):
+        """For counters mirrored from an existing monotonic count (e.g. cache stats) at scrape time."""
+        self._values[labels] = value
+
+    def render(self) -> List[str]:
+        return super().render() + [
+            f"{self.name}{_labels(self.labelnames, labels)} {_number(v)}" for labels, v in self._values.items()
+        ]
+
+
+class Gauge(Counter):
+    type_name = "gauge"
+
+    def set(self, *labels, value: float):
+        self._values[labels] = value
+
+    def dec(self, *labels, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) - amount
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        self._series: Dict[Tuple, list] = {} # labels -> [count per bucket..., +Inf count, sum]
+
+    def observe(self, value: float, *labels):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        for labels, series in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound!r}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {series[-1]!r}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+def on_scrape(hook: Callable[[], None]) -> Callable[[], None]:
+    """Registers a function refreshing gauges/counters from state kept elsewhere, run on every scrape."""
+    _scrape_hooks.append(hook)
+    return hook
+
+
+def render_metrics() -> str:
+    for hook in _scrape_hooks:
+        hook()
+    return "\n".join(line for metric in _metrics for line in metric.render()) + "\n"
+
+
+class timed:
+    """Context manager observing the elapsed time of its block into `histogram` with `labels`."""
+
+    __slots__ = ("histogram", "labels", "start")
+
+    def __init__(self, histogram: Histogram, *labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+
+
+# HTTP
+HTTP_REQUESTS = Counter("http_requests_total", "HTTP requests by route template and status", ("method", "route", "status"))
+HTTP_LATENCY = Histogram("http_request_duration_seconds", "HTTP request latency by route template", ("method", "route"))
+HTTP_IN_FLIGHT = Gauge("http_requests_in_flight", "HTTP requests currently being served")
+
+# MongoDB
+MONGO_LATENCY = Histogram("mongodb_command_duration_seconds", "MongoDB command latency", ("command", "collection"))
+MONGO_FAILURES = Counter("mongodb_command_failures_total", "Failed MongoDB commands", ("command", "collection"))
+
+MONGO_POOL_CHECKOUT_WAIT = Histogram("mongodb_pool_checkout_duration_seconds", "Time spent waiting for a pooled MongoDB connection", ("address",))
+MONGO_POOL_CHECKOUT_FAILURES = Counter("mongodb_pool_checkout_failures_total", "Failed MongoDB connection checkouts", ("address", "reason"))
+MONGO_POOL_CONNECTIONS = Gauge("mongodb_pool_connections", "Pooled MongoDB connections by state", ("address", "state"))
+
+# Redis
+REDIS_LATENCY = Histogram("redis_command_duration_seconds", "Redis command latency", ("command",))
+REDIS_FAILURES = Counter("redis_command_failures_total", "Failed Redis commands", ("command",))
+
+# Startup: one value per phase of this worker's boot, also shown on /healthz
+STARTUP_SECONDS = Gauge("app_startup_seconds", "Duration of each startup phase of this worker", ("phase",))
+startup_timings: Dict[str, float] = {}
+
+def record_startup(phase: str, seconds: float):
+    startup_timings[phase] = round(seconds, 4)
+    STARTUP_SECONDS.set(phase, value=seconds)
+
+# Auth
+PASSWORD_HASH_LATENCY = Histogram(
+    "password_hash_duration_seconds", "bcrypt hash/verify time on the hashing pool", ("operation",),
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.2, 0.3, 0.5, 1.0, 2.5),
+)
+JWT_LATENCY = Histogram(
+    "jwt_duration_seconds", "JWT encode/decode time", ("operation",),
+    buckets=(0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.005),
+)
+
+# Commands issued by the current request, collected only for requests sampled for the slow-request log
+_request_commands: contextvars.ContextVar[Optional[list]] = contextvars.ContextVar("request_commands", default=None)
+
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware (no BaseHTTPMiddleware task/stream overhead) recording latency, status and
+    in-flight count per route template. Requests slower than SLOW_REQUEST_SECONDS are logged together
+    with the MongoDB commands they issued, for a SLOW_REQUEST_SAMPLE_RATE fraction of requests.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+        commands = [] if SLOW_REQUEST_SAMPLE_RATE and random.random() < SLOW_REQUEST_SAMPLE_RATE else None
+        token = _request_commands.set(commands)
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            HTTP_IN_FLIGHT.dec()
+            _request_commands.reset(token)
+            route = scope.get("route") # Set by FastAPI once a route matched; keeps label cardinality bounded
+            route_path = getattr(route, "path", "unmatched")
+            HTTP_LATENCY.observe(elapsed, scope["method"], route_path)
+            HTTP_REQUESTS.inc(scope["method"], route_path, status_code)
+            if commands is not None and elapsed >= SLOW_REQUEST_SECONDS:
+                logger.warning(
+                    f"Slow request {scope['method']} {scope['path']} ({route_path}) -> {status_code} "
+                    f"in {elapsed * 1000:.1f} ms; mongo commands: "
+                    + (", ".join(f"{name} {coll} {ms:.1f}ms" for name, coll, ms in commands) or "none")
+                )
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """PyMongo command listener feeding MONGO_LATENCY and the slow-request log. Pass it in event_listeners."""
+
+    def __init__(self):
+        self._collections: Dict[Tuple, str] = {}
+
+    def started(self, event: monitoring.CommandStartedEvent):
+        target = event.command.get(event.command_name)
+        self._collections[(event.connection_id, event.request_id)] = target if isinstance(target, str) else ""
+
+    def _finished(self, event, failed: bool):
+        collection = self._collections.pop((event.connection_id, event.request_id), "")
+        seconds = event.duration_micros / 1_000_000
+        MONGO_LATENCY.observe(seconds, event.command_name, collection)
+        if failed:
+            MONGO_FAILURES.inc(event.command_name, collection)
+        commands = _request_commands.get()
+        if commands is not None:
+            commands.append((event.command_name, collection, seconds * 1000))
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent):
+        self._finished(event, failed=False)
+
+    def failed(self, event: monitoring.CommandFailedEvent):
+        self._finished(event, failed=True)
+
+
+class MongoPoolMetrics(monitoring.ConnectionPoolListener):
+    """
+    PyMongo connection pool (CMAP) listener tracking open, checked-out and waiting connections per server,
+    for /metrics and the pool saturation reported by /healthz and /readyz. Pass it in event_listeners.
+    """
+
+    def __init__(self):
+        self.pools: Dict[str, Dict[str, int]] = {}
+
+    def _pool(self, event) -> Tuple[str, Dict[str, int]]:
+        address = f"{event.address[0]}:{event.address[1]}"
+        pool = self.pools.get(address)
+        if pool is None:
+            pool = self.pools[address] = {"open": 0, "in_use": 0, "waiting": 0}
+        return address, pool
+
+    def _add(self, event, state: str, amount: int):
+        self._pool(event)[1][state] += amount
+
+    def pool_created(self, event):
+        self._pool(event)
+
+    def pool_closed(self, event):
+        self.pools.pop(f"{event.address[0]}:{event.address[1]}", None)
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass # Connections of a cleared pool report connection_closed as they are discarded
+
+    def connection_created(self, event):
+        self._add(event, "open", 1)
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._add(event, "open", -1)
+
+    def connection_check_out_started(self, event):
+        self._add(event, "waiting", 1)
+
+    def connection_check_out_failed(self, event):
+        address, pool = self._pool(event)
+        pool["waiting"] -= 1
+        MONGO_POOL_CHECKOUT_FAILURES.inc(address, event.reason)
+
+    def connection_checked_out(self, event):
+        address, pool = self._pool(event)
+        pool["waiting"] -= 1
+        pool["in_use"] += 1
+        if event.duration is not None:
+            MONGO_POOL_CHECKOUT_WAIT.observe(event.duration, address)
+
+    def connection_checked_in(self, event):
+        self._add(event, "in_use", -1)
+
+    def export(self):
+        for address, pool in self.pools.items():
+            for state, count in pool.items():
+                MONGO_POOL_CONNECTIONS.set(address, state, value=count)
+
+
+class InstrumentedRedis(redis.Redis):
+    """redis.asyncio client timing every command it sends directly (commands queued on a pipeline are not timed)."""
+
+    async def execute_command(self, *args, **options):
+        start = time.perf_counter()
+        try:
+            return await super().execute_command(*args, **options)
+        except Exception:
+            REDIS_FAILURES.inc(str(args[0]).upper())
+            raise
+        finally:
+            REDIS_LATENCY.observe(time.perf_counter() - start, str(args[0]).upper())
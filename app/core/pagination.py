@@ -0,0 +1,128 @@
+import base64
+import json
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Type, Union
+
+from beanie import Document
+from bson import ObjectId
+from bson.errors import InvalidId
+from fastapi import HTTPException, status
+from pydantic import BaseModel
+from pymongo import ASCENDING, DESCENDING
+
+from app.core.database import heavy_collection
+from app.core.serialization import model_projection
+from app.models.pagination import CursorPage
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+
+def encode_cursor(sort: str, last_value: Any, last_id: ObjectId) -> str:
+    """Builds an opaque cursor from the sort spec and the last row of a page."""
+    payload = json.dumps([sort, last_value, str(last_id)], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, sort: str) -> Tuple[Any, ObjectId]:
+    """Returns (last sort value, last _id) from a cursor, or raises 400 if it is malformed or was issued for another sort."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        cursor_sort, last_value, last_id = json.loads(base64.urlsafe_b64decode(padded))
+        if cursor_sort != sort:
+            raise ValueError("cursor was issued for a different sort order")
+        return last_value, ObjectId(last_id)
+    except (ValueError, TypeError, InvalidId): # binascii.Error and JSONDecodeError are ValueErrors too
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+
+def parse_sort(sort: str, allowed: Iterable[str]) -> Tuple[str, int]:
+    """Turns 'price' / '-price' into ('price', ASCENDING / DESCENDING). 'id' maps to '_id'."""
+    field = sort.lstrip("-")
+    if field not in allowed:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Cannot sort by '{field}'. Allowed: {', '.join(sorted(allowed))}"
+        )
+    direction = DESCENDING if sort.startswith("-") else ASCENDING
+    return ("_id" if field == "id" else field), direction
+
+
+def parse_fields(fields: Optional[str], allowed: Iterable[str]) -> Optional[frozenset]:
+    """Parses the comma-separated ?fields= parameter; None means 'all fields'."""
+    if not fields:
+        return None
+    requested = frozenset(f.strip() for f in fields.split(",") if f.strip())
+    unknown = requested - set(allowed)
+    if unknown:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unknown fields: {', '.join(sorted(unknown))}"
+        )
+    return requested
+
+
+def view_projection(view: Type[BaseModel], fields: Optional[frozenset]) -> Dict[str, int]:
+    """MongoDB projection for `view`, restricted to `fields` when given."""
+    if fields is None:
+        return model_projection(view)
+    return {"_id": 1, **{view.model_fields[f].alias or f: 1 for f in fields}}
+
+
+def keyset_filter(field: str, direction: int, last_value: Any, last_id: ObjectId) -> Dict[str, Any]:
+    """Filter matching every row strictly after (last_value, last_id) in (field, _id) order."""
+    op = "$gt" if direction == ASCENDING else "$lt"
+    if field == "_id":
+        return {"_id": {op: last_id}}
+    return {"$or": [{field: {op: last_value}}, {field: last_value, "_id": {op: last_id}}]}
+
+
+async def paginate(
+    document: Type[Document],
+    view: Type[BaseModel],
+    filters: Dict[str, Any],
+    sort: str,
+    allowed_sorts: Iterable[str],
+    limit: int,
+    cursor: Optional[str] = None,
+    fields: Optional[frozenset] = None,
+    raw: bool = False,
+) -> Union[CursorPage, Dict[str, Any]]:
+    """
+    Keyset (seek) pagination over `document`.
+    Each page is a bounded index range scan starting right after the previous page's last
+    (sort value, _id), so page N costs the same as page 1 - unlike skip(), which walks every earlier row.
+
+    With raw=True the page is read straight off the PyMongo cursor and returned as a plain
+    {"items": [...], "next_cursor": ...} dict with the projected documents, for serialization with raw_json.
+    """
+    field, direction = parse_sort(sort, allowed_sorts)
+    if cursor:
+        last_value, last_id = decode_cursor(cursor, sort)
+        after = keyset_filter(field, direction, last_value, last_id)
+        filters = {"$and": [filters, after]} if filters else after
+
+    sort_spec: List[Tuple[str, int]] = [("_id", direction)]
+    if field != "_id":
+        sort_spec.insert(0, (field, direction))
+        if fields is not None:
+            fields = fields | {field} # The cursor needs the sort value of the last row
+
+    # Read through heavy_collection so list pages follow MONGO_HEAVY_READ_PREFERENCE
+    items = await heavy_collection(document).find(
+        filters, view_projection(view, fields), sort=sort_spec, limit=limit + 1
+    ).to_list()
+    if not raw:
+        # Fields left out of the projection stay unset, so response_model_exclude_unset drops them
+        items = [view.model_validate(item) for item in items]
+
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        last = items[-1]
+        if raw:
+            next_cursor = encode_cursor(sort, None if field == "_id" else last.get(field), last["_id"])
+        else:
+            next_cursor = encode_cursor(sort, None if field == "_id" else getattr(last, field), last.id)
+    if raw:
+        return {"items": items, "next_cursor": next_cursor}
+    return CursorPage(items=items, next_cursor=next_cursor)
@@ -0,0 +1,223 @@
+"""
+Admission control: per-client token buckets and per-worker concurrency caps, used as route dependencies.
+
+    @router.get("/products/withUsers", dependencies=[limit(cost=20), concurrency_limit(HEAVY_READS)])
+
+Token buckets live in Redis (one Lua script call per request, atomic across workers) and are keyed by the
+authenticated user where the router has one, by client IP otherwise. While Redis is unavailable each worker
+falls back to an in-memory bucket, so limits are then enforced per worker instead of globally.
+
+Concurrency caps are per worker: an expensive endpoint that already has `limit` requests in flight in this
+process is shed immediately with 503 instead of queueing behind them. Slots are released by
+AdmissionMiddleware once the response has been sent completely, so streamed exports hold theirs until the end.
+"""
+import logging
+import math
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Optional, Tuple
+
+import redis.asyncio as redis
+from fastapi import Depends, HTTPException, Request, status
+
+from app.core import cache
+from app.core.config import (
+    RATE_LIMIT_ENABLED, RATE_LIMIT_API_BURST, RATE_LIMIT_API_PER_SECOND, RATE_LIMIT_AUTH_BURST,
+    RATE_LIMIT_AUTH_PER_SECOND, RATE_LIMIT_LOCAL_MAX_KEYS, TRUST_PROXY_HEADERS,
+    MAX_CONCURRENT_HEAVY_READS, MAX_CONCURRENT_EXPORTS, MAX_CONCURRENT_BULK_WRITES, MAX_CONCURRENT_EVENT_STREAMS,
+)
+from app.core.metrics import Counter, Gauge, on_scrape
+
+logger = logging.getLogger(__name__)
+
+# policy -> (burst capacity, refill rate in tokens per second)
+POLICIES: Dict[str, Tuple[float, float]] = {
+    "api": (RATE_LIMIT_API_BURST, RATE_LIMIT_API_PER_SECOND),
+    "auth": (RATE_LIMIT_AUTH_BURST, RATE_LIMIT_AUTH_PER_SECOND), # Login/registration: each attempt costs a bcrypt hash
+}
+KEY_PREFIX = "ratelimit:"
+RELEASES_SCOPE_KEY = "admission.releases"
+
+# Refills the bucket for the time elapsed since the last call, then takes `cost` tokens if there are enough.
+# Uses the Redis server clock, so workers with skewed clocks still share one consistent bucket.
+# Returns {allowed (0/1), milliseconds until `cost` tokens will be available}.
+_TOKEN_BUCKET_LUA = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate / 1000)
+local allowed = 0
+local wait = 0
+if tokens >= cost then
+    tokens = tokens - cost
+    allowed = 1
+else
+    wait = math.ceil((cost - tokens) * 1000 / rate)
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity * 1000 / rate) + 1000)
+return {allowed, wait}
+"""
+
+RATE_LIMITED = Counter("rate_limited_requests_total", "Requests rejected with 429 by a token bucket", ("policy", "backend"))
+ADMISSION_SHED = Counter("admission_shed_requests_total", "Requests shed with 503 by a per-worker concurrency cap", ("limiter",))
+ADMISSION_IN_FLIGHT = Gauge("admission_in_flight", "Requests currently holding a concurrency slot in this worker", ("limiter",))
+
+
+class LocalTokenBucket:
+    """In-memory token buckets for when Redis is unavailable; the least recently used keys are dropped beyond max_keys."""
+
+    def __init__(self, max_keys: int):
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, list]" = OrderedDict() # key -> [tokens, monotonic timestamp]
+
+    def take(self, key: str, capacity: float, rate: float, cost: float) -> Tuple[bool, float]:
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [capacity, now]
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+        bucket[0] = min(capacity, bucket[0] + (now - bucket[1]) * rate)
+        bucket[1] = now
+        if bucket[0] >= cost:
+            bucket[0] -= cost
+            return True, 0.0
+        return False, (cost - bucket[0]) / rate
+
+
+local_buckets = LocalTokenBucket(RATE_LIMIT_LOCAL_MAX_KEYS)
+_script = None
+
+
+def _bucket_script():
+    global _script
+    if _script is None or _script.registered_client is not cache.redis_client:
+        _script = cache.redis_client.register_script(_TOKEN_BUCKET_LUA) # EVALSHA, falling back to EVAL once per server
+    return _script
+
+
+async def take_tokens(policy: str, identity: str, cost: float) -> Tuple[bool, float]:
+    """Returns (allowed, seconds until `cost` tokens are available) for `identity`'s bucket under `policy`."""
+    capacity, rate = POLICIES[policy]
+    key = f"{KEY_PREFIX}{policy}:{identity}"
+    if cache.redis_available():
+        try:
+            allowed, wait_ms = await _bucket_script()(keys=[key], args=[capacity, rate, cost])
+            return bool(allowed), wait_ms / 1000
+        except redis.RedisError as e:
+            cache.mark_redis_down(e)
+    return local_buckets.take(key, capacity, rate, cost)
+
+
+def client_ip(request: Request) -> str:
+    if TRUST_PROXY_HEADERS:
+        forwarded = request.headers.get("x-forwarded-for")
+        if forwarded:
+            return forwarded.split(",")[0].strip() # Left-most entry: the original client
+    return request.client.host if request.client else "unknown"
+
+
+async def _admit(policy: str, identity: str, cost: float):
+    if not RATE_LIMIT_ENABLED:
+        return
+    allowed, wait = await take_tokens(policy, identity, cost)
+    if not allowed:
+        RATE_LIMITED.inc(policy, "redis" if cache.redis_available() else "local")
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Rate limit exceeded",
+            headers={"Retry-After": str(max(1, math.ceil(wait)))},
+        )
+
+
+def rate_limit(policy: str = "api", cost: float = 1, user_dependency: Optional[Callable] = None):
+    """
+    Route dependency charging `cost` tokens from the caller's bucket under `policy`.
+    With `user_dependency` (e.g. get_current_user) the bucket is the user's; FastAPI caches dependencies per
+    request, so this reuses the user the router already resolved. Otherwise the bucket is the client IP's.
+    """
+    capacity, _ = POLICIES[policy]
+    if cost > capacity:
+        raise ValueError(f"cost {cost} can never be admitted by policy '{policy}' (capacity {capacity})")
+
+    if user_dependency is None:
+        async def limiter(request: Request):
+            await _admit(policy, f"ip:{client_ip(request)}", cost)
+    else:
+        async def limiter(user=Depends(user_dependency)):
+            await _admit(policy, f"user:{user.id}", cost)
+    return Depends(limiter)
+
+
+class ConcurrencyLimiter:
+    """Caps the requests in flight in this worker for a group of expensive endpoints."""
+
+    def __init__(self, name: str, limit: int, retry_after: int = 1):
+        self.name = name
+        self.limit = limit
+        self.retry_after = retry_after
+        self.in_flight = 0
+
+    def try_acquire(self) -> bool:
+        if self.in_flight >= self.limit:
+            return False
+        self.in_flight += 1
+        return True
+
+    def release(self):
+        self.in_flight -= 1
+
+
+HEAVY_READS = ConcurrencyLimiter("heavy_reads", MAX_CONCURRENT_HEAVY_READS)
+EXPORTS = ConcurrencyLimiter("exports", MAX_CONCURRENT_EXPORTS, retry_after=5)
+BULK_WRITES = ConcurrencyLimiter("bulk_writes", MAX_CONCURRENT_BULK_WRITES, retry_after=2)
+EVENT_STREAMS = ConcurrencyLimiter("event_streams", MAX_CONCURRENT_EVENT_STREAMS, retry_after=5) # Held for the life of the connection
+
+
+@on_scrape
+def _export_in_flight():
+    for limiter in (HEAVY_READS, EXPORTS, BULK_WRITES, EVENT_STREAMS):
+        ADMISSION_IN_FLIGHT.set(limiter.name, value=limiter.in_flight)
+
+
+def concurrency_limit(limiter: ConcurrencyLimiter):
+    """Route dependency taking a slot of `limiter` for the whole request, or answering 503 if none is free."""
+    async def guard(request: Request):
+        releases = request.scope.get(RELEASES_SCOPE_KEY)
+        if releases is None:
+            raise RuntimeError("concurrency_limit needs AdmissionMiddleware to release its slots")
+        if not limiter.try_acquire():
+            ADMISSION_SHED.inc(limiter.name)
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Server busy, retry later",
+                headers={"Retry-After": str(limiter.retry_after)},
+            )
+        releases.append(limiter.release)
+    return Depends(guard)
+
+
+class AdmissionMiddleware:
+    """Pure ASGI middleware releasing the concurrency slots a request took, after its response has been fully sent."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        releases = scope[RELEASES_SCOPE_KEY] = []
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            for release in releases:
+                release()
@@ -1,37 +1,114 @@
+import asyncio
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
-from typing import Optional
+from typing import Optional, Tuple
 
-from passlib.context import CryptContext # For password hashing
-from jose import JWTError, jwt           # For JWTs
+from fastapi import HTTPException, status
 
-from app.core.config import SECRET_KEY, ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES
+# passlib (bcrypt) and python-jose (JWTs) are imported on first use rather than at boot, to keep worker
+# start-up short; processes that never hash a password or issue a token never load them.
 
-# Password hashing context (using bcrypt)
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+from app.core.metrics import Gauge, JWT_LATENCY, PASSWORD_HASH_LATENCY, on_scrape, timed
+from app.core.config import (
+    SECRET_KEY, ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES,
+    BCRYPT_ROUNDS, PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_PENDING,
+)
+
+_pwd_context = None
+
+def get_pwd_context():
+    """Password hashing context (using bcrypt), built on first use."""
+    global _pwd_context
+    if _pwd_context is None:
+        from passlib.context import CryptContext
+        _pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+    return _pwd_context
+
+# bcrypt takes 100-300 ms of CPU and releases the GIL, so the async variants below run it on a small
+# dedicated pool instead of blocking the event loop. The pool is sized to the cores we are willing to
+# give to hashing; anything queued beyond PASSWORD_HASH_MAX_PENDING is rejected rather than left to pile up.
+_hash_executor: Optional[ThreadPoolExecutor] = None
+_pending_hash_jobs = 0
+
+PASSWORD_HASH_PENDING = Gauge("password_hash_jobs_pending", "bcrypt jobs running or queued on the hashing pool")
+
+@on_scrape
+def _export_pending_hash_jobs():
+    PASSWORD_HASH_PENDING.set(value=_pending_hash_jobs)
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """Verifies a plain password against a hashed password."""
-    return pwd_context.verify(plain_password, hashed_password)
+    return get_pwd_context().verify(plain_password, hashed_password)
 
 def get_password_hash(password: str) -> str:
     """Hashes a plain password."""
-    return pwd_context.hash(password)
+    return get_pwd_context().hash(password)
+
+def _timed_hash_job(func, *args):
+    # Runs on a pool thread; measures bcrypt itself, not the time spent queued
+    with timed(PASSWORD_HASH_LATENCY, func.__name__):
+        return func(*args)
+
+async def _run_hash_job(func, *args):
+    global _pending_hash_jobs
+    if _pending_hash_jobs >= PASSWORD_HASH_MAX_PENDING:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Authentication service is busy, please retry shortly",
+            headers={"Retry-After": "1"},
+        )
+    global _hash_executor
+    if _hash_executor is None:
+        _hash_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt")
+    _pending_hash_jobs += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_hash_executor, _timed_hash_job, func, *args)
+    finally:
+        _pending_hash_jobs -= 1
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    """verify_password on the hashing pool; raises 503 when the pool is saturated."""
+    return await _run_hash_job(get_pwd_context().verify, plain_password, hashed_password)
+
+async def get_password_hash_async(password: str) -> str:
+    """get_password_hash on the hashing pool; raises 503 when the pool is saturated."""
+    return await _run_hash_job(get_pwd_context().hash, password)
+
+async def verify_and_update_password(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """
+    Verifies a password on the hashing pool and, if the stored hash uses outdated settings
+    (CryptContext.needs_update, e.g. BCRYPT_ROUNDS was raised), also returns a fresh hash to store.
+    """
+    return await _run_hash_job(get_pwd_context().verify_and_update, plain_password, hashed_password)
+
+def shutdown_hash_executor():
+    """Lets queued hash jobs finish and stops the pool threads."""
+    global _hash_executor
+    if _hash_executor is not None:
+        _hash_executor.shutdown(wait=True)
+        _hash_executor = None
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     """Creates a JWT access token."""
+    from jose import jwt # Cached in sys.modules after the first call
     to_encode = data.copy()
     if expires_delta:
         expire = datetime.now(timezone.utc) + expires_delta
     else:
         expire = datetime.now(timezone.utc) + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     to_encode.update({"exp": expire}) # Add expiration time to payload
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    to_encode.setdefault("jti", uuid.uuid4().hex) # Unique token id, used as the principal cache key
+    with timed(JWT_LATENCY, "encode"):
+        encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
 def decode_access_token(token: str) -> Optional[dict]:
     """Decodes a JWT access token and returns its payload, or None if invalid/expired."""
+    from jose import JWTError, jwt
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        with timed(JWT_LATENCY, "decode"):
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         return payload
     except JWTError: # Catches all JWT related errors (e.g., signature mismatch, expiration)
         return None
\ No newline at end of file
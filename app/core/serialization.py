@@ -0,0 +1,67 @@
+from functools import lru_cache
+from typing import Any, Dict, Optional, Type, get_args, get_origin
+
+from fastapi import Response
+from pydantic import BaseModel, TypeAdapter
+from pydantic_core import to_json
+
+JSON_MEDIA_TYPE = "application/json"
+
+
+@lru_cache(maxsize=None)
+def type_adapter(model: Any) -> TypeAdapter:
+    """One TypeAdapter per response type; building the core schema is the expensive part."""
+    return TypeAdapter(model)
+
+
+def dump_json(model: Any, value: Any, **kwargs) -> bytes:
+    """
+    Serializes `value` (model instances, or lists of them) straight to JSON bytes in pydantic-core.
+    Unlike returning the value through response_model, the instances are not validated a second time first.
+    """
+    return type_adapter(model).dump_json(value, by_alias=True, **kwargs)
+
+
+def raw_json(value: Any) -> bytes:
+    """
+    Serializes documents as they come off a PyMongo cursor (dicts with '_id' keys) without building models.
+    ObjectIds (and any other BSON type JSON has no equivalent for) are written as strings, which is what
+    the models' serializers produce as well.
+    """
+    return to_json(value, fallback=str)
+
+
+def json_response(body: bytes, status_code: int = 200, headers: Optional[Dict[str, str]] = None) -> Response:
+    # FastAPI sends a Response untouched; the route's response_model still documents the schema
+    return Response(content=body, status_code=status_code, headers=headers, media_type=JSON_MEDIA_TYPE)
+
+
+def _nested_model(annotation: Any) -> Optional[Type[BaseModel]]:
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        return annotation
+    for arg in get_args(annotation): # List[Model], Optional[Model]
+        nested = _nested_model(arg)
+        if nested is not None:
+            return nested
+    return None
+
+
+@lru_cache(maxsize=None)
+def model_projection(model: Type[BaseModel], prefix: str = "") -> Dict[str, int]:
+    """
+    MongoDB inclusion projection of exactly the fields `model` serializes, recursing into embedded
+    models and lists of them ('products.price'). Raw cursor output projected with it has the model's shape,
+    except that missing optional fields are left out instead of being written as null.
+    """
+    projection = {}
+    for name, field in model.model_fields.items():
+        if field.exclude:
+            continue
+        key = prefix + (field.alias or name)
+        nested = _nested_model(field.annotation)
+        if nested is not None and get_origin(field.annotation) is not dict:
+            projection.update(model_projection(nested, key + "."))
+        else:
+            projection[key] = 1
+    return projection
+
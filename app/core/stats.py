@@ -0,0 +1,183 @@
+"""
+Materialized product aggregates: one product_stats document per category and per creator holding the product
+count, the price sum (for the average) and the min/max price, so /products/stats reads one small document
+per group instead of aggregating over the whole products collection.
+
+Every product write hands the affected products' (category, creator_id, price) before and after the write to a
+StatsDelta, and apply() turns it into one $inc/$min/$max upsert per touched group. Counts and sums are exact
+deltas. A min or max can only be maintained with $min/$max while it moves outward: when a write removes a
+product priced at a group's current bound, that bound is re-read with one indexed query (category_price_id
+or creator_id_price). Groups whose count drops to zero are deleted.
+
+The product write and its stats update are separate operations, so a crash in between (or bulk writes racing
+other writes on the same products) can leave the stats off; `python -m app.workers.rebuild_stats` recomputes
+them from scratch.
+"""
+import logging
+from typing import Any, Dict, Mapping, Optional, Tuple
+
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+from pymongo.errors import PyMongoError
+
+from app.core.metrics import Counter
+from app.models.product import Product
+from app.models.product_stats import ProductStats
+
+logger = logging.getLogger(__name__)
+
+# dimension -> the product field it groups by
+DIMENSIONS = {"category": "category", "creator": "creator_id"}
+# The product fields a StatsDelta needs; project before-images down to these
+STATS_PROJECTION = {"category": 1, "creator_id": 1, "price": 1}
+
+STATS_UPDATE_FAILURES = Counter("product_stats_update_failures_total", "Product writes whose stats update failed (run rebuild_stats)")
+
+
+class _GroupDelta:
+    __slots__ = ("count", "price_sum", "added_min", "added_max", "removed_min", "removed_max")
+
+    def __init__(self):
+        self.count = 0
+        self.price_sum = 0.0
+        self.added_min = self.added_max = None
+        self.removed_min = self.removed_max = None
+
+    def add(self, price: float):
+        self.count += 1
+        self.price_sum += price
+        self.added_min = price if self.added_min is None else min(self.added_min, price)
+        self.added_max = price if self.added_max is None else max(self.added_max, price)
+
+    def remove(self, price: float):
+        self.count -= 1
+        self.price_sum -= price
+        self.removed_min = price if self.removed_min is None else min(self.removed_min, price)
+        self.removed_max = price if self.removed_max is None else max(self.removed_max, price)
+
+
+class StatsDelta:
+    """The net effect of a set of product writes on every group they touch."""
+
+    def __init__(self):
+        self.groups: Dict[Tuple[str, Any], _GroupDelta] = {}
+
+    def _group(self, dimension: str, key: Any) -> _GroupDelta:
+        group = self.groups.get((dimension, key))
+        if group is None:
+            group = self.groups[(dimension, key)] = _GroupDelta()
+        return group
+
+    def change(self, before: Optional[Mapping], after: Optional[Mapping]):
+        """Records one write: before=None for an insert, after=None for a delete."""
+        for dimension, field in DIMENSIONS.items():
+            if before is not None and after is not None and before[field] == after[field] and before["price"] == after["price"]:
+                continue # e.g. a rename: nothing this group aggregates changed
+            if before is not None:
+                self._group(dimension, before[field]).remove(before["price"])
+            if after is not None:
+                self._group(dimension, after[field]).add(after["price"])
+
+
+def stats_collection():
+    return ProductStats.get_pymongo_collection()
+
+
+async def _price_bound(dimension: str, key: Any, direction: int) -> Optional[float]:
+    # Cheapest (ASCENDING) or most expensive product of the group: one step into a {field, price} index
+    doc = await Product.get_pymongo_collection().find_one(
+        {DIMENSIONS[dimension]: key}, {"_id": 0, "price": 1}, sort=[("price", direction)]
+    )
+    return doc["price"] if doc else None
+
+
+async def _apply(delta: StatsDelta):
+    collection = stats_collection()
+    ops = []
+    for (dimension, key), group in delta.groups.items():
+        update = {"$inc": {"product_count": group.count, "price_sum": group.price_sum}, "$currentDate": {"updated_at": True}}
+        if group.added_min is not None:
+            update["$min"] = {"min_price": group.added_min}
+            update["$max"] = {"max_price": group.added_max}
+        ops.append(UpdateOne({"dimension": dimension, "key": key}, update, upsert=True))
+    if not ops:
+        return
+    await collection.bulk_write(ops, ordered=False)
+
+    # Groups that lost products: drop the empty ones, re-read any bound a removed price may have been holding
+    shrunk: Dict[str, list] = {}
+    for dimension, key in delta.groups:
+        if delta.groups[(dimension, key)].removed_min is not None:
+            shrunk.setdefault(dimension, []).append(key)
+    for dimension, keys in shrunk.items():
+        async for doc in collection.find({"dimension": dimension, "key": {"$in": keys}}):
+            group = delta.groups[(dimension, doc["key"])]
+            if doc["product_count"] <= 0:
+                await collection.delete_one({"_id": doc["_id"], "product_count": {"$lte": 0}}) # Unless a concurrent insert refilled it
+                continue
+            bounds = {}
+            if doc.get("min_price") is None or group.removed_min <= doc["min_price"]:
+                bounds["min_price"] = await _price_bound(dimension, doc["key"], ASCENDING)
+            if doc.get("max_price") is None or group.removed_max >= doc["max_price"]:
+                bounds["max_price"] = await _price_bound(dimension, doc["key"], DESCENDING)
+            if bounds:
+                await collection.update_one({"_id": doc["_id"]}, {"$set": bounds})
+
+
+async def apply(delta: StatsDelta):
+    """
+    Applies `delta` to product_stats. Failures are logged rather than raised: the product write itself has
+    already succeeded, and a rebuild repairs the stats.
+    """
+    try:
+        await _apply(delta)
+    except PyMongoError as e:
+        STATS_UPDATE_FAILURES.inc()
+        logger.error(f"Product stats update failed, stats are off until the next rebuild_stats run: {e}")
+
+
+async def record(before: Optional[Mapping], after: Optional[Mapping]):
+    """apply() for a single product write."""
+    delta = StatsDelta()
+    delta.change(before, after)
+    await apply(delta)
+
+
+def stats_view(doc: Mapping) -> Dict[str, Any]:
+    """GroupStats fields of a product_stats document."""
+    return {
+        "count": doc["product_count"],
+        "avg_price": doc["price_sum"] / doc["product_count"] if doc["product_count"] > 0 else None,
+        "min_price": doc.get("min_price"),
+        "max_price": doc.get("max_price"),
+    }
+
+
+async def rebuild() -> Dict[str, int]:
+    """
+    Recomputes every group from the products collection (two $group scans, written with $merge) and deletes
+    groups that no longer have products. Returns the number of groups per dimension.
+    Exact when no product writes run concurrently; otherwise run it again once they have stopped.
+    """
+    collection = stats_collection()
+    # Server clock, like $$NOW and the $currentDate of incremental updates: anything older was not rewritten
+    started = (await collection.database.command("hello"))["localTime"]
+    counts = {}
+    for dimension, field in DIMENSIONS.items():
+        pipeline = [
+            {"$group": {
+                "_id": f"${field}",
+                "product_count": {"$sum": 1},
+                "price_sum": {"$sum": "$price"},
+                "min_price": {"$min": "$price"},
+                "max_price": {"$max": "$price"},
+            }},
+            {"$project": {
+                "_id": 0, "dimension": {"$literal": dimension}, "key": "$_id", "product_count": 1,
+                "price_sum": 1, "min_price": 1, "max_price": 1, "updated_at": "$$NOW",
+            }},
+            {"$merge": {"into": collection.name, "on": ["dimension", "key"], "whenMatched": "replace", "whenNotMatched": "insert"}},
+        ]
+        await (await Product.get_pymongo_collection().aggregate(pipeline, allowDiskUse=True)).to_list()
+        await collection.delete_many({"dimension": dimension, "updated_at": {"$lt": started}})
+        counts[dimension] = await collection.count_documents({"dimension": dimension})
+    return counts
@@ -0,0 +1,67 @@
+from typing import AsyncIterator, Optional, Type
+
+from pydantic import BaseModel
+
+from app.core.serialization import raw_json
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+DEFAULT_EXPORT_BATCH_SIZE = 500
+MAX_EXPORT_BATCH_SIZE = 10_000
+
+
+def _dump(item, model: Optional[Type[BaseModel]] = None) -> bytes:
+    if model is not None and isinstance(item, dict):
+        item = model.model_validate(item)
+    if isinstance(item, BaseModel):
+        return item.model_dump_json(by_alias=True).encode() # Same shape the response_model endpoints produce
+    if isinstance(item, dict):
+        return raw_json(item) # Raw PyMongo cursor document (FAST_SERIALIZATION)
+    raise TypeError(f"Cannot stream {type(item).__name__}; pass a projection_model to the query")
+
+
+def _encode_batch(buffer, fmt: str, first: bool) -> bytes:
+    if fmt == "ndjson":
+        return b"\n".join(buffer) + b"\n"
+    chunk = b",".join(buffer)
+    return chunk if first else b"," + chunk
+
+
+async def close_query(query):
+    """Releases the server-side cursor behind a Beanie query, a raw PyMongo cursor or an async generator over one."""
+    if hasattr(query, "aclose"): # e.g. RelationLoader.iter_with_creators, which closes its own query
+        await query.aclose()
+        return
+    cursor = getattr(query, "cursor", query) # Beanie queries wrap the PyMongo cursor; raw cursors are closed directly
+    if cursor is not None and hasattr(cursor, "close"):
+        await cursor.close()
+
+
+async def stream_query(
+    query, fmt: str = "ndjson", batch_size: int = DEFAULT_EXPORT_BATCH_SIZE, model: Optional[Type[BaseModel]] = None,
+) -> AsyncIterator[bytes]:
+    """
+    Iterates a Beanie find/aggregate query (or a raw PyMongo cursor) and yields the serialized documents in chunks of `batch_size`.
+    Only one batch is held in memory at a time, and the first chunk goes out as soon as the first
+    batch has been read from Mongo instead of after the whole result set has been materialized.
+
+    fmt="ndjson" writes one JSON document per line; fmt="json" writes a single JSON array.
+    Raw cursor documents are validated into `model` first when one is given, otherwise written as they are.
+    """
+    buffer = []
+    first = True
+    if fmt == "json":
+        yield b"["
+    try:
+        async for item in query:
+            buffer.append(_dump(item, model))
+            if len(buffer) >= batch_size:
+                yield _encode_batch(buffer, fmt, first)
+                first = False
+                buffer.clear()
+        if buffer:
+            yield _encode_batch(buffer, fmt, first)
+        if fmt == "json":
+            yield b"]"
+    finally:
+        # The client may disconnect mid-export; release the server-side cursor instead of waiting for it to time out
+        await close_query(query)
@@ -0,0 +1,233 @@
+"""
+Write-behind buffer behind PATCH /products/{id}?buffered=true, for clients (e.g. the pricing service) that send
+bursts of partial updates to the same products.
+
+Each worker keeps one ProductWriteBuffer. Updates to the same product are merged field by field (the later
+value wins) until WRITE_BEHIND_WINDOW_MS after the first one, or until WRITE_BEHIND_MAX_BATCH products are
+pending, and then written as one unordered bulk_write of $set updates: one write per product per flush
+however many updates it received. Each flush bumps a product's version once, not once per update.
+
+Acknowledgement:
+  wait=false (202 queued)   The update is only in this worker's memory. It is lost if the worker dies before
+                            the flush (a graceful shutdown flushes first), dropped after WRITE_BEHIND_MAX_ATTEMPTS
+                            failed flushes while MongoDB is unreachable, and silently ignored if the product does
+                            not exist. The client learns none of this.
+  wait=true (200 written)   Answered once the flush containing the update has been acknowledged by MongoDB (with
+                            the client's write concern), or 404 / 503 / 500 if the product was missing, MongoDB
+                            stayed unreachable or the write failed. Coalescing still applies: the write may carry
+                            later updates from other requests.
+Either way the update is not readable (nor in /products/stats) until it has been flushed, and a direct PUT or
+PATCH to the same product in between can be overwritten by the flush. The buffer is bounded: a worker holding
+WRITE_BEHIND_MAX_PENDING products answers further buffered PATCHes for other products with 503.
+"""
+import asyncio
+import itertools
+import logging
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+from fastapi import HTTPException, status
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
+
+from app.core import stats
+from app.core.cache import invalidate_tags, PRODUCTS_TAG
+from app.core.config import WRITE_BEHIND_WINDOW_MS, WRITE_BEHIND_MAX_BATCH, WRITE_BEHIND_MAX_PENDING, WRITE_BEHIND_MAX_ATTEMPTS
+from app.core.metrics import Counter, Gauge, on_scrape
+from app.core.stats import StatsDelta, STATS_PROJECTION
+from app.models.product import Product
+
+logger = logging.getLogger(__name__)
+
+RETRY_DELAY_SECONDS = 1.0 # After a flush failed because MongoDB was unreachable
+
+WRITE_BEHIND_UPDATES = Counter("product_write_behind_updates_total", "PATCH updates accepted into the write-behind buffer")
+WRITE_BEHIND_REJECTED = Counter("product_write_behind_rejected_total", "Buffered PATCHes answered with 503 because the buffer was full")
+WRITE_BEHIND_WRITES = Counter("product_write_behind_writes_total", "Coalesced product writes by outcome", ("outcome",))
+WRITE_BEHIND_PENDING = Gauge("product_write_behind_pending", "Products with buffered updates in this worker")
+
+
+class _Pending:
+    __slots__ = ("fields", "updates", "attempts", "waiters")
+
+    def __init__(self):
+        self.fields: Dict[str, Any] = {}
+        self.updates = 0 # PATCHes merged into this write
+        self.attempts = 0
+        self.waiters: List[asyncio.Future] = [] # wait=true requests
+
+    def resolve(self, result: str):
+        for waiter in self.waiters:
+            if not waiter.done(): # Cancelled when the client went away
+                waiter.set_result(result)
+
+    def fail(self, error: BaseException):
+        for waiter in self.waiters:
+            if not waiter.done():
+                waiter.set_exception(error)
+
+
+class ProductWriteBuffer:
+    def __init__(self, window: float, max_batch: int, max_pending: int, max_attempts: int):
+        self.window = window
+        self.max_batch = max_batch
+        self.max_pending = max(max_pending, max_batch)
+        self.max_attempts = max_attempts
+        self.pending: Dict[Any, _Pending] = {} # product _id -> merged update, in arrival order
+        self._has_pending = asyncio.Event()
+        self._full = asyncio.Event() # max_batch products pending: flush without waiting for the window
+        self._lock = asyncio.Lock() # One flush at a time
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stops the flush loop and writes out everything still buffered. Run before the MongoDB client closes."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        while self.pending: # Ends: a failing flush drops updates after max_attempts
+            if not await self.flush():
+                await asyncio.sleep(RETRY_DELAY_SECONDS)
+
+    def submit(self, product_id: Any, fields: Dict[str, Any], wait: bool = False) -> Optional[asyncio.Future]:
+        """
+        Buffers a partial update. Returns None, or with wait=True a future resolving to "written" or "not_found"
+        once the update was flushed (or failing with the error that prevented it).
+        Raises 503 if the buffer is full.
+        """
+        entry = self.pending.get(product_id)
+        if entry is None:
+            if len(self.pending) >= self.max_pending:
+                WRITE_BEHIND_REJECTED.inc()
+                raise HTTPException(
+                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                    detail="Too many buffered product updates, please retry shortly",
+                    headers={"Retry-After": "1"},
+                )
+            entry = self.pending[product_id] = _Pending()
+        entry.fields.update(fields)
+        entry.updates += 1
+        WRITE_BEHIND_UPDATES.inc()
+        self._has_pending.set()
+        if len(self.pending) >= self.max_batch:
+            self._full.set()
+        if not wait:
+            return None
+        waiter = asyncio.get_running_loop().create_future()
+        entry.waiters.append(waiter)
+        return waiter
+
+    async def _run(self):
+        while True:
+            await self._has_pending.wait()
+            try:
+                await asyncio.wait_for(self._full.wait(), self.window)
+            except asyncio.TimeoutError:
+                pass
+            if not await self.flush():
+                await asyncio.sleep(RETRY_DELAY_SECONDS) # Don't hammer an unreachable MongoDB
+
+    def _take(self) -> Dict[Any, _Pending]:
+        if len(self.pending) <= self.max_batch:
+            batch, self.pending = self.pending, {}
+        else:
+            batch = {product_id: self.pending.pop(product_id) for product_id in list(itertools.islice(self.pending, self.max_batch))}
+        if not self.pending:
+            self._has_pending.clear()
+        if len(self.pending) < self.max_batch:
+            self._full.clear()
+        return batch
+
+    async def flush(self) -> bool:
+        """Writes up to max_batch buffered products. Returns False if MongoDB could not be reached (the batch is re-queued)."""
+        async with self._lock:
+            batch = self._take()
+            if not batch:
+                return True
+            try:
+                await self._write(batch)
+            except PyMongoError as e:
+                logger.warning(f"Write-behind flush of {len(batch)} products failed, will retry: {e}")
+                self._requeue(batch, e)
+                return False
+            except Exception as e:
+                logger.exception(f"Write-behind flush of {len(batch)} products failed")
+                WRITE_BEHIND_WRITES.inc("failed", amount=len(batch))
+                for entry in batch.values():
+                    entry.fail(e)
+            return True
+
+    async def _write(self, batch: Dict[Any, _Pending]):
+        collection = Product.get_pymongo_collection()
+        # One $in read for the whole batch: which products exist, and their before-images for the stats
+        current = {doc["_id"]: doc for doc in await collection.find({"_id": {"$in": list(batch)}}, STATS_PROJECTION).to_list()}
+        now = datetime.now(timezone.utc)
+        ids, ops = [], []
+        for product_id, entry in batch.items():
+            if product_id not in current:
+                WRITE_BEHIND_WRITES.inc("not_found")
+                entry.resolve("not_found")
+                continue
+            ids.append(product_id)
+            # $set is idempotent, so a batch re-sent after a network error converges to the same fields
+            ops.append(UpdateOne({"_id": product_id}, {"$set": {**entry.fields, "updated_at": now}, "$inc": {"version": 1}}))
+        if not ops:
+            return
+
+        failed: Dict[Any, str] = {}
+        try:
+            await collection.bulk_write(ops, ordered=False)
+        except BulkWriteError as e:
+            failed = {ids[error["index"]]: error["errmsg"] for error in e.details.get("writeErrors", [])}
+            if not failed: # e.g. only a write concern error: nothing to attribute to single products
+                raise
+
+        delta = StatsDelta()
+        for product_id in ids:
+            entry = batch[product_id]
+            if product_id in failed:
+                WRITE_BEHIND_WRITES.inc("failed")
+                entry.fail(HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Update failed: {failed[product_id]}"))
+                continue
+            before = current[product_id]
+            delta.change(before, {**before, **entry.fields})
+            WRITE_BEHIND_WRITES.inc("written")
+        if len(failed) < len(ids):
+            await stats.apply(delta)
+            await invalidate_tags(PRODUCTS_TAG) # Before the waiters are answered, so they read their own write
+        for product_id in ids:
+            if product_id not in failed:
+                batch[product_id].resolve("written")
+
+    def _requeue(self, batch: Dict[Any, _Pending], error: PyMongoError):
+        # Newer updates to the same product were buffered meanwhile: they go on top of the failed ones
+        for product_id, entry in batch.items():
+            entry.attempts += 1
+            if entry.attempts >= self.max_attempts:
+                logger.error(f"Dropping {entry.updates} buffered update(s) to product {product_id} after {entry.attempts} failed flushes")
+                WRITE_BEHIND_WRITES.inc("dropped")
+                entry.fail(error)
+                continue
+            newer = self.pending.pop(product_id, None)
+            if newer is not None:
+                entry.fields.update(newer.fields)
+                entry.updates += newer.updates
+                entry.waiters += newer.waiters
+            self.pending[product_id] = entry # Already accepted: may take the buffer past max_pending for a while
+        if self.pending:
+            self._has_pending.set()
+
+
+product_writes = ProductWriteBuffer(WRITE_BEHIND_WINDOW_MS / 1000, WRITE_BEHIND_MAX_BATCH, WRITE_BEHIND_MAX_PENDING, WRITE_BEHIND_MAX_ATTEMPTS)
+
+
+@on_scrape
+def _export_pending():
+    WRITE_BEHIND_PENDING.set(value=len(product_writes.pending))
@@ -1,25 +1,64 @@
 # app/main.py
+import time
+_import_started = time.perf_counter()
+
+import asyncio
+from contextlib import asynccontextmanager, AsyncExitStack
 from fastapi import FastAPI
-from app.core.database import lifespan_mongodb # Import the renamed lifespan function
+from app.core.database import lifespan_mongodb, mongo_unavailable_handler # Import the renamed lifespan function
+from pymongo.errors import ConnectionFailure
 from app.api.v1.users import users # Import your users router
 from app.api.v1.products import products # Import your products router
 from app.api.v1.auth import auth # Import your auth router
-from contextlib import asynccontextmanager
+from app.api import ops # /metrics, /healthz, /readyz
 from app.core.cache import connect_to_redis, close_redis_connection # <-- NEW IMPORTS
+from app.core.config import EVENTS_ENABLED, WRITE_BEHIND_ENABLED
+from app.core.events import product_events
+from app.core.write_behind import product_writes
+from app.core.security import shutdown_hash_executor
+from app.core.metrics import MetricsMiddleware, record_startup, startup_timings
+from app.core.ratelimit import AdmissionMiddleware
+import logging
+
+logger = logging.getLogger(__name__)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    async with lifespan_mongodb(app):
-        await connect_to_redis()
-        try:
-            yield
-        finally:
-            await close_redis_connection()
+    start = time.perf_counter()
+    async with AsyncExitStack() as stack:
+        # Undone in reverse order on shutdown
+        stack.callback(shutdown_hash_executor)
+        stack.push_async_callback(close_redis_connection)
+        # MongoDB and Redis setup are independent round trips: run them concurrently.
+        # connect_to_redis never raises (the app starts without Redis); a MongoDB failure aborts startup.
+        for result in await asyncio.gather(
+            stack.enter_async_context(lifespan_mongodb(app)), connect_to_redis(), return_exceptions=True,
+        ):
+            if isinstance(result, BaseException):
+                raise result
+        if EVENTS_ENABLED:
+            product_events.start() # One products watcher per worker: /products/events and local cache invalidation
+            stack.push_async_callback(product_events.stop)
+        if WRITE_BEHIND_ENABLED:
+            product_writes.start()
+            stack.push_async_callback(product_writes.stop) # Flushes buffered PATCHes while MongoDB and Redis are still open
+        record_startup("lifespan", time.perf_counter() - start)
+        logger.info("Startup timings (s): " + ", ".join(f"{phase}={seconds}" for phase, seconds in startup_timings.items()))
+        yield
 
 # Initialize FastAPI with the lifespan handler
 app = FastAPI(lifespan=lifespan)
+app.add_middleware(AdmissionMiddleware) # Releases per-worker concurrency slots once a response is fully sent
+app.add_middleware(MetricsMiddleware) # Per-route latency, status and in-flight counts for /metrics
+app.add_exception_handler(ConnectionFailure, mongo_unavailable_handler) # MongoDB unreachable or pool exhausted -> 503
 
 # Include your API routers
 app.include_router(auth.router, prefix="/api/v1/auth", tags=["Authentication"])
 app.include_router(users.router, prefix="/api/v1")
+app.include_router(products.events_router, prefix="/api/v1", tags=["Products"]) # Before products.router: /products/{product_id}
 app.include_router(products.router, prefix="/api/v1", tags=["Products"])
+app.include_router(ops.router)
+
+# Everything above: third-party imports, models and route table. Heavy optional libraries (passlib, jose,
+# aiosmtplib) are imported on first use instead.
+record_startup("import_app", time.perf_counter() - _import_started)
@@ -1,6 +1,8 @@
 # app/models/product.py
-from pydantic import BaseModel, Field
-from beanie import Document, PydanticObjectId
+from datetime import datetime, timezone
+from pydantic import BaseModel, ConfigDict, Field, model_validator
+from beanie import Document, PydanticObjectId, Insert, Replace, Save, before_event
+from pymongo import ASCENDING, TEXT, IndexModel
 from typing import Optional
 
 # Pydantic model for creating a product (request body)
@@ -10,13 +12,83 @@ class ProductCreate(BaseModel):
     price: float = Field(..., gt=0, description="Price must be greater than zero")
     category: str
 
+# Item of POST /products/bulk; creator_id defaults to the authenticated user
+class ProductBulkCreate(ProductCreate):
+    creator_id: Optional[PydanticObjectId] = None
+
+# Item of PUT /products/bulk; creator_id is left unchanged when omitted
+class ProductBulkUpdate(ProductBulkCreate):
+    id: PydanticObjectId
+
+# Body of PATCH /products/{id}: only the fields sent are changed
+class ProductPatch(BaseModel):
+    name: Optional[str] = None
+    description: Optional[str] = None
+    price: Optional[float] = Field(None, gt=0, description="Price must be greater than zero")
+    category: Optional[str] = None
+
+    @model_validator(mode="after")
+    def _check_fields(self):
+        if not self.model_fields_set:
+            raise ValueError("At least one field must be given")
+        for field in ("name", "price", "category"): # description is the only field that may be cleared
+            if field in self.model_fields_set and getattr(self, field) is None:
+                raise ValueError(f"{field} cannot be null")
+        return self
+
 # Beanie Document for the Product collection in MongoDB
 class Product(Document):
     name: str
     description: Optional[str] = None
     price: float
     category: str
-    creator_id: PydanticObjectId = Field(index=True) # Index this for efficient lookups by creator
+    creator_id: PydanticObjectId # Indexed together with _id below for efficient lookups by creator
+    version: int = 0 # Bumped on every write; ETags and If-Match are based on it (0: written before versioning)
+    updated_at: Optional[datetime] = None # Last-Modified
+
+    # insert()/save()/replace() keep version and updated_at current; raw PyMongo writes must $inc/$set them themselves
+    @before_event(Insert)
+    def _start_version(self):
+        self.version = 1
+        self.updated_at = datetime.now(timezone.utc)
+
+    @before_event(Replace, Save)
+    def _bump_version(self):
+        self.version += 1
+        self.updated_at = datetime.now(timezone.utc)
 
     class Settings:
         name = "products" # Collection name in MongoDB
+        # Compound indexes backing the GET /products filters; _id is the keyset tie-breaker,
+        # so every (filter, sort) combination is a single index range scan.
+        indexes = [
+            IndexModel([("category", ASCENDING), ("price", ASCENDING), ("_id", ASCENDING)], name="category_price_id"),
+            IndexModel([("category", ASCENDING), ("_id", ASCENDING)], name="category_id"),
+            IndexModel([("price", ASCENDING), ("_id", ASCENDING)], name="price_id"),
+            IndexModel([("creator_id", ASCENDING), ("_id", ASCENDING)], name="creator_id_id"),
+            # Per-creator min/max price for the product_stats bounds (category_price_id serves categories)
+            IndexModel([("creator_id", ASCENDING), ("price", ASCENDING)], name="creator_id_price"),
+            # Change polling for /products/events on deployments without change streams
+            IndexModel([("updated_at", ASCENDING), ("_id", ASCENDING)], name="updated_at_id"),
+            # Full-text search for /products/search; a name match ranks well above a description match
+            IndexModel([("name", TEXT), ("description", TEXT)], weights={"name": 10, "description": 1}, name="name_description_text"),
+        ]
+
+# Read-side projection of Product for list endpoints.
+# Everything but the id is optional so ?fields= can trim the payload without failing validation.
+class ProductView(BaseModel):
+    model_config = ConfigDict(populate_by_name=True)
+
+    id: PydanticObjectId = Field(alias="_id")
+    name: Optional[str] = None
+    description: Optional[str] = None
+    price: Optional[float] = None
+    category: Optional[str] = None
+    creator_id: Optional[PydanticObjectId] = None
+
+PRODUCT_VIEW_FIELDS = ("name", "description", "price", "category", "creator_id")
+PRODUCT_SORTS = ("id", "price") # Keyset sort fields of product lists (GET /products and the products embedded in users)
+
+# Item of /products/search; score is the text relevance when a query string was given
+class ProductSearchHit(ProductView):
+    score: Optional[float] = None
@@ -0,0 +1,37 @@
+# app/models/product_stats.py
+from datetime import datetime
+from typing import Any, Optional
+from pydantic import BaseModel
+from beanie import Document, PydanticObjectId
+from pymongo import ASCENDING, DESCENDING, IndexModel
+
+# Materialized aggregates of the products collection, one document per group; maintained by app/core/stats.py
+class ProductStats(Document):
+    dimension: str # "category" or "creator"
+    key: Any # The category name, or the creator's ObjectId
+    product_count: int = 0 # Not `count`, which would shadow Document.count()
+    price_sum: float = 0 # The average is price_sum / product_count, computed on read
+    min_price: Optional[float] = None
+    max_price: Optional[float] = None
+    updated_at: Optional[datetime] = None # Server time of the last change; the rebuild uses it to find stale groups
+
+    class Settings:
+        name = "product_stats"
+        indexes = [
+            # Point lookups, the category listing, and the `on` fields of the rebuild's $merge (must be unique)
+            IndexModel([("dimension", ASCENDING), ("key", ASCENDING)], unique=True, name="dimension_key"),
+            # Top creators by product count
+            IndexModel([("dimension", ASCENDING), ("product_count", DESCENDING), ("key", ASCENDING)], name="dimension_count_key"),
+        ]
+
+class GroupStats(BaseModel):
+    count: int
+    avg_price: Optional[float] = None
+    min_price: Optional[float] = None
+    max_price: Optional[float] = None
+
+class CategoryStats(GroupStats):
+    category: str
+
+class CreatorStats(GroupStats):
+    creator_id: PydanticObjectId
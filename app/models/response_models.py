@@ -1,13 +1,136 @@
-from typing import List
+from typing import Any, AsyncIterator, Dict, Iterable, List, Literal, Optional, Tuple
+from pydantic import BaseModel
+from beanie import PydanticObjectId
+from pymongo import ASCENDING
+
+from app.core.streaming import close_query
 
 # Import the core Beanie Documents they are based on
-from app.models.user import User
-from app.models.product import Product
+from app.models.user import User, UserPublic
+from app.models.product import Product, ProductSearchHit
 
 # Moved from app/models/user.py
-class UserWithProducts(User): # Inherits from the core User Document
+class UserWithProducts(UserPublic): # Public user fields only; hashed_password is never embedded
     products: List[Product] = []
 
 # Moved from app/models/product.py
 class ProductWithUser(Product): # Inherits from the core Product Document
-    creator: User # The full User object will be embedded here
\ No newline at end of file
+    creator: UserPublic # The creator's public fields are embedded here
+
+USER_PUBLIC_PROJECTION = {"_id": 1, "name": 1, "email": 1}
+
+class CategoryFacet(BaseModel):
+    category: str
+    count: int
+
+class PriceBucketFacet(BaseModel):
+    min: float
+    max: Optional[float] = None # None for the open-ended top bucket
+    count: int
+
+class ProductSearchFacets(BaseModel):
+    categories: List[CategoryFacet] = []
+    price_buckets: List[PriceBucketFacet] = []
+
+# Response of /products/search: one page of hits plus facet counts over everything that matched
+class ProductSearchResult(BaseModel):
+    total: int
+    items: List[ProductSearchHit]
+    facets: ProductSearchFacets
+
+
+class RelationLoader:
+    """
+    DataLoader-style alternative to the $lookup pipelines.
+
+    Instead of joining per document on the server, it collects the distinct foreign keys of a whole page,
+    fetches the related documents with one projected $in query and attaches them in Python. Users already
+    seen are kept in an identity map, so a creator owning thousands of products is fetched (and
+    serialized from Mongo) once per loader instead of once per product. Use one loader per request.
+    """
+
+    def __init__(self, in_batch_size: int = 1000):
+        self.in_batch_size = in_batch_size # Max ids per $in query
+        self._users: Dict[PydanticObjectId, UserPublic] = {}
+
+    async def load_users(self, ids: Iterable[PydanticObjectId]) -> Dict[PydanticObjectId, UserPublic]:
+        """Returns the public view of each existing user in `ids`, querying only for ids not seen before."""
+        ids = set(ids)
+        missing = list(ids - self._users.keys())
+        for start in range(0, len(missing), self.in_batch_size):
+            chunk = missing[start:start + self.in_batch_size]
+            async for user in User.find({"_id": {"$in": chunk}}).project(UserPublic):
+                self._users[user.id] = user
+        return {i: self._users[i] for i in ids if i in self._users}
+
+    async def with_creators(self, products: List[Product]) -> List[ProductWithUser]:
+        """Attaches the creator to each product. Products whose creator is gone are dropped, as with $unwind."""
+        creators = await self.load_users(p.creator_id for p in products)
+        return [
+            ProductWithUser.model_construct(**dict(p), creator=creators[p.creator_id]) # Both sides are already validated
+            for p in products if p.creator_id in creators
+        ]
+
+    async def iter_with_creators(self, query, batch_size: int = 1000) -> AsyncIterator[ProductWithUser]:
+        """Streams a product query as ProductWithUser, resolving creators one batch of products at a time."""
+        batch: List[Product] = []
+        try:
+            async for product in query:
+                batch.append(product)
+                if len(batch) >= batch_size:
+                    for item in await self.with_creators(batch):
+                        yield item
+                    batch = []
+            for item in await self.with_creators(batch):
+                yield item
+        finally:
+            await close_query(query) # Also runs on aclose(), when the consumer stops early
+
+    async def with_products(
+        self,
+        users: List[UserPublic],
+        limit: Optional[int] = None,
+        sort: Tuple[str, int] = ("_id", ASCENDING),
+    ) -> List[UserWithProducts]:
+        """
+        Attaches each user's products, at most `limit` per user in `sort` order, using one aggregation per
+        chunk of users: $match on creator_id $in (creator_id_id index), $sort, then $group with $firstN so
+        a user with millions of products never contributes more than `limit` documents.
+        """
+        products_by_user: Dict[Any, List[Product]] = {}
+        field, direction = sort
+        user_ids = [u.id for u in users]
+        for start in range(0, len(user_ids), self.in_batch_size):
+            chunk = user_ids[start:start + self.in_batch_size]
+            accumulator = {"$firstN": {"n": limit, "input": "$$ROOT"}} if limit else {"$push": "$$ROOT"}
+            pipeline = [
+                {"$match": {"creator_id": {"$in": chunk}}},
+                {"$sort": {"creator_id": ASCENDING, field: direction, **({"_id": direction} if field != "_id" else {})}},
+                {"$group": {"_id": "$creator_id", "products": accumulator}},
+            ]
+            async for group in await Product.get_pymongo_collection().aggregate(pipeline):
+                products_by_user[group["_id"]] = [Product.model_validate(doc) for doc in group["products"]]
+        return [
+            UserWithProducts.model_construct(**dict(u), products=products_by_user.get(u.id, []))
+            for u in users
+        ]
+
+
+# Per-item failure reported by the bulk endpoints
+class BulkItemError(BaseModel):
+    index: int # Position of the item in the uploaded array / NDJSON stream
+    error: str
+
+# Summary returned by the bulk endpoints
+class BulkResult(BaseModel):
+    processed: int = 0 # Items read from the upload (an ordered run stops reading at the first failure)
+    succeeded: int = 0
+    failed: int = 0
+    errors: List[BulkItemError] = []
+    errors_truncated: bool = False # True when there were more failures than are listed in `errors`
+    ids: Optional[List[PydanticObjectId]] = None # _ids of the written documents, when requested
+
+# Answer of a buffered PATCH /products/{id}?buffered=true (see app/core/write_behind.py)
+class BufferedUpdate(BaseModel):
+    id: PydanticObjectId
+    status: Literal["queued", "written"] # queued: held in this worker's buffer (202); written: acknowledged by MongoDB
@@ -1,5 +1,8 @@
-from pydantic import Field, EmailStr, BaseModel
-from beanie import Document
+from datetime import datetime, timezone
+from pydantic import Field, EmailStr, BaseModel, ConfigDict
+from beanie import Document, PydanticObjectId, Insert, Replace, Save, before_event
+from pymongo import ASCENDING, IndexModel
+from typing import Optional
 
 # Updated UserCreate to include password
 class UserCreate(BaseModel):
@@ -17,6 +20,39 @@ class User(Document):
     name: str
     email: EmailStr = Field(unique=True, index=True)
     hashed_password: str # <-- NEW: To store the hashed password
+    version: int = 0 # Bumped on every write, so If-Match updates can detect concurrent changes
+    updated_at: Optional[datetime] = None
+
+    @before_event(Insert)
+    def _start_version(self):
+        self.version = 1
+        self.updated_at = datetime.now(timezone.utc)
+
+    @before_event(Replace, Save)
+    def _bump_version(self):
+        self.version += 1
+        self.updated_at = datetime.now(timezone.utc)
 
     class Settings:
         name = "users"
+        indexes = [
+            IndexModel([("name", ASCENDING), ("_id", ASCENDING)], name="name_id"), # GET /users?name=... and sort=name
+        ]
+
+# Read-side projection of User for list endpoints (never exposes hashed_password)
+class UserView(BaseModel):
+    model_config = ConfigDict(populate_by_name=True)
+
+    id: PydanticObjectId = Field(alias="_id")
+    name: Optional[str] = None
+    email: Optional[EmailStr] = None
+
+USER_VIEW_FIELDS = ("name", "email")
+
+# Public view of a user embedded in other responses (ProductWithUser.creator, UserWithProducts)
+class UserPublic(BaseModel):
+    model_config = ConfigDict(populate_by_name=True)
+
+    id: PydanticObjectId = Field(alias="_id")
+    name: str
+    email: EmailStr
@@ -0,0 +1,173 @@
+# app/server.py
+# Production entry point:
+#     python -m app.server
+# The supervisor imports the app once (WEB_PRELOAD), binds the listening socket, then forks WEB_WORKERS
+# uvicorn workers that all accept on it. Each worker runs its own event loop and lifespan, so the MongoDB and
+# Redis clients are created after the fork and never shared. A worker that dies is replaced.
+# uvloop and httptools are used when installed (WEB_LOOP / WEB_HTTP "auto").
+#
+# Shutdown (SIGTERM or SIGINT to the supervisor, forwarded to every worker): a worker stops accepting, ends its
+# /products/events streams, gives in-flight requests and their background tasks (e.g. the fallback welcome
+# email) up to WEB_GRACEFUL_TIMEOUT_SECONDS to finish, then runs the lifespan shutdown, which closes Redis and
+# MongoDB last. Workers still running WEB_KILL_TIMEOUT_SECONDS after that are killed.
+#
+# For development, `uvicorn app.main:app --reload` still works as before.
+import asyncio
+import logging
+import os
+import signal
+import sys
+import time
+from typing import Dict, Optional
+
+import uvicorn
+
+from app.core.config import (
+    WEB_HOST, WEB_PORT, WEB_WORKERS, WEB_PRELOAD, WEB_LOOP, WEB_HTTP, WEB_BACKLOG, WEB_KEEPALIVE_SECONDS,
+    WEB_GRACEFUL_TIMEOUT_SECONDS, WEB_KILL_TIMEOUT_SECONDS, WEB_ACCESS_LOG, WEB_LOG_LEVEL,
+)
+
+APP = "app.main:app"
+RESPAWN_BACKOFF_SECONDS = 1.0 # A worker that dies this soon after starting is not replaced immediately
+STARTUP_FAILURE = 3 # Worker exit code when the lifespan startup failed, as with the uvicorn CLI
+
+logger = logging.getLogger("app.server")
+
+
+def _installed(module: str) -> bool:
+    try:
+        __import__(module)
+        return True
+    except ImportError:
+        return False
+
+
+def build_config() -> uvicorn.Config:
+    return uvicorn.Config(
+        APP,
+        host=WEB_HOST,
+        port=WEB_PORT,
+        loop=WEB_LOOP,
+        http=WEB_HTTP,
+        backlog=WEB_BACKLOG,
+        timeout_keep_alive=WEB_KEEPALIVE_SECONDS,
+        timeout_graceful_shutdown=WEB_GRACEFUL_TIMEOUT_SECONDS,
+        access_log=WEB_ACCESS_LOG,
+        log_level=WEB_LOG_LEVEL,
+        lifespan="on", # A failing startup (e.g. MongoDB unreachable) must stop the worker, not serve 500s
+    )
+
+
+class WorkerServer(uvicorn.Server):
+    """uvicorn.Server that ends the product event streams as soon as shutdown starts; they never finish on their own."""
+
+    def __init__(self, config: uvicorn.Config):
+        super().__init__(config)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None # Set while serve() runs
+
+    async def serve(self, sockets=None):
+        self._loop = asyncio.get_running_loop()
+        try:
+            await super().serve(sockets)
+        finally:
+            self._loop = None
+
+    def handle_exit(self, sig, frame):
+        super().handle_exit(sig, frame)
+        if self._loop is None: # Not serving (yet): there are no streams to end
+            return
+        from app.core.events import product_events
+        self._loop.call_soon_threadsafe(product_events.drain) # We are in a signal handler: defer to the loop
+
+
+def _run_worker(config: uvicorn.Config, sock) -> int:
+    server = WorkerServer(config)
+    try:
+        server.run(sockets=[sock])
+    except BaseException:
+        logger.exception("Worker crashed")
+        return 1
+    return 0 if server.started else STARTUP_FAILURE
+
+
+class Supervisor:
+    def __init__(self, config: uvicorn.Config, sock, workers: int):
+        self.config = config
+        self.sock = sock
+        self.workers = workers
+        self.children: Dict[int, float] = {} # pid -> start time
+        self.stopping = False
+
+    def spawn(self):
+        pid = os.fork()
+        if pid == 0:
+            signal.alarm(0)
+            for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGALRM):
+                signal.signal(sig, signal.SIG_DFL) # uvicorn installs its own once the worker runs
+            os._exit(_run_worker(self.config, self.sock))
+        self.children[pid] = time.monotonic()
+
+    def stop(self, sig, frame):
+        if self.stopping and sig == signal.SIGINT:
+            sig = signal.SIGKILL # Second Ctrl+C: don't wait
+        self.stopping = True
+        for pid in list(self.children):
+            try:
+                os.kill(pid, sig if sig == signal.SIGKILL else signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        signal.alarm(WEB_GRACEFUL_TIMEOUT_SECONDS + WEB_KILL_TIMEOUT_SECONDS)
+
+    def kill(self, sig, frame):
+        for pid in list(self.children):
+            logger.warning(f"Worker {pid} still running after the shutdown timeout, killing it")
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+
+    def run(self) -> int:
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGALRM, self.kill)
+        for _ in range(self.workers):
+            self.spawn()
+        failed = False
+        while self.children:
+            try:
+                pid, status = os.waitpid(-1, 0)
+            except ChildProcessError:
+                break
+            started = self.children.pop(pid, None)
+            if started is None:
+                continue
+            code = os.waitstatus_to_exitcode(status)
+            failed |= code != 0
+            if not self.stopping:
+                logger.warning(f"Worker {pid} exited with {code}, starting a replacement")
+                if time.monotonic() - started < RESPAWN_BACKOFF_SECONDS:
+                    time.sleep(RESPAWN_BACKOFF_SECONDS) # Crash loop (e.g. MongoDB down at startup): don't spin
+                if not self.stopping:
+                    self.spawn()
+        logger.info("All workers stopped")
+        return 1 if failed else 0
+
+
+def main() -> int:
+    logging.basicConfig(level=WEB_LOG_LEVEL.upper(), format="%(asctime)s %(process)d %(levelname)s %(name)s: %(message)s")
+    config = build_config()
+    loop = "uvloop" if WEB_LOOP == "uvloop" or (WEB_LOOP == "auto" and _installed("uvloop")) else "asyncio"
+    http = "httptools" if WEB_HTTP == "httptools" or (WEB_HTTP == "auto" and _installed("httptools")) else "h11"
+    if WEB_PRELOAD:
+        start = time.perf_counter()
+        config.load() # Imports the app in the supervisor; forked workers share those pages copy-on-write
+        logger.info(f"App preloaded in {time.perf_counter() - start:.2f}s")
+    sock = config.bind_socket()
+    logger.info(f"Serving {APP} on {WEB_HOST}:{WEB_PORT} with {WEB_WORKERS} worker(s), {loop} event loop, {http} HTTP parser")
+    if WEB_WORKERS <= 1:
+        return _run_worker(config, sock) # No supervisor needed: uvicorn handles the signals itself
+    return Supervisor(config, sock, WEB_WORKERS).run()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,37 @@
+# app/workers/mail_worker.py
+# Mail queue consumer, run as its own process next to the API:
+#     python -m app.workers.mail_worker
+# For local testing point SMTP_HOST/SMTP_PORT at a stub server, e.g. MailHog (docker-compose)
+# or `python -m aiosmtpd -n -l localhost:1025`.
+import asyncio
+import logging
+import signal
+
+from app.core.cache import connect_to_redis, close_redis_connection, get_redis_client
+from app.core.config import SMTP_HOST, SMTP_PORT, SMTP_TIMEOUT_SECONDS, MAIL_WORKER_ID, MAIL_WORKER_CONCURRENCY
+from app.core.mail_queue import MailWorker, SMTPConnectionPool
+
+logger = logging.getLogger(__name__)
+
+async def main():
+    await connect_to_redis()
+    client = get_redis_client() # Raises if Redis is down: without it there is nothing to consume
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set) # Finish the current batch, then exit
+
+    pool = SMTPConnectionPool(SMTP_HOST, SMTP_PORT, size=MAIL_WORKER_CONCURRENCY, timeout=SMTP_TIMEOUT_SECONDS)
+    worker = MailWorker(client, pool, MAIL_WORKER_ID)
+    logger.info(f"Mail worker {MAIL_WORKER_ID} started ({MAIL_WORKER_CONCURRENCY} SMTP connections to {SMTP_HOST}:{SMTP_PORT})")
+    try:
+        await worker.run(stop)
+    finally:
+        await pool.close()
+        await close_redis_connection()
+        logger.info(f"Mail worker stopped: {worker.sent} sent, {worker.retried} retried, {worker.dead_lettered} dead-lettered")
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    asyncio.run(main())
@@ -0,0 +1,32 @@
+# app/workers/rebuild_stats.py
+# Recomputes the product_stats collection from the products collection:
+#     python -m app.workers.rebuild_stats
+# Run it once to backfill after deploying the stats, and whenever the stats may have drifted
+# (see product_stats_update_failures_total on /metrics).
+import asyncio
+import logging
+import time
+
+from app.core.cache import connect_to_redis, close_redis_connection, invalidate_tags, redis_available, PRODUCTS_TAG
+from app.core.database import lifespan_mongodb
+from app.core.stats import rebuild
+
+logger = logging.getLogger(__name__)
+
+async def main():
+    async with lifespan_mongodb(None, sync_indexes=True): # The $merge relies on product_stats' unique index
+        start = time.perf_counter()
+        counts = await rebuild()
+        logger.info(f"Product stats rebuilt in {time.perf_counter() - start:.1f}s: " + ", ".join(f"{n} {d} groups" for d, n in counts.items()))
+    # The /products/stats ETags come from the products tag: bump it, or clients keep getting 304s for the old stats
+    await connect_to_redis()
+    try:
+        if not redis_available():
+            logger.warning("Redis unavailable: /products/stats ETags stay unchanged until the next product write")
+        await invalidate_tags(PRODUCTS_TAG)
+    finally:
+        await close_redis_connection()
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    asyncio.run(main())
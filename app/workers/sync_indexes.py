@@ -0,0 +1,24 @@
+# app/workers/sync_indexes.py
+# Creates the indexes declared in the Beanie models' Settings.indexes:
+#     python -m app.workers.sync_indexes
+# Run it once per deploy (before or alongside the new API workers) when they start with
+# MONGO_SYNC_INDEXES=false, instead of every worker checking every index on boot.
+import asyncio
+import logging
+import time
+
+from app.core.database import lifespan_mongodb, DOCUMENT_MODELS
+
+logger = logging.getLogger(__name__)
+
+async def main():
+    start = time.perf_counter()
+    async with lifespan_mongodb(None, sync_indexes=True):
+        for model in DOCUMENT_MODELS:
+            names = [index["name"] async for index in await model.get_pymongo_collection().list_indexes()]
+            logger.info(f"{model.get_pymongo_collection().name}: {', '.join(names)}")
+    logger.info(f"Indexes synced in {time.perf_counter() - start:.1f}s")
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    asyncio.run(main())
@@ -0,0 +1,140 @@
+"""
+Worker boot time: how long a fresh process takes to import the app, and to serve its first request.
+
+Every repetition runs in new processes, so nothing is warm except the OS file cache:
+
+  import      `import app.main` in a fresh interpreter (interpreter start-up excluded)
+  first_req   from spawning `uvicorn app.main:app` until GET --path first answers 200: imports, lifespan
+              (MongoDB + Redis connections, Beanie init, index sync), then one request
+  phases      the per-phase startup timings the worker reports on /healthz
+
+Each variant is run with its own environment, e.g. index sync on every boot vs. skipped:
+
+    python -m benchmarks.bench_boot --repeat 5
+    python -m benchmarks.bench_boot --variant sync=MONGO_SYNC_INDEXES=true --variant skip=MONGO_SYNC_INDEXES=false
+    python -m benchmarks.bench_boot --importtime   # also list the slowest imports (python -X importtime)
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from typing import Dict, List, Tuple
+
+from benchmarks.common import run_metadata, write_results
+
+IMPORT_SNIPPET = "import time, json; t = time.perf_counter(); import app.main; print(json.dumps(time.perf_counter() - t))"
+DEFAULT_VARIANTS = ["sync-indexes=MONGO_SYNC_INDEXES=true", "skip-indexes=MONGO_SYNC_INDEXES=false"]
+
+
+def parse_variant(spec: str) -> Tuple[str, Dict[str, str]]:
+    # name=KEY=VALUE[,KEY=VALUE...]
+    name, _, assignments = spec.partition("=")
+    env = {}
+    for assignment in filter(None, assignments.split(",")):
+        key, _, value = assignment.partition("=")
+        env[key] = value
+    return name, env
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def measure_import(env: Dict[str, str]) -> float:
+    out = subprocess.run([sys.executable, "-c", IMPORT_SNIPPET], env=env, capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def slowest_imports(env: Dict[str, str], top: int) -> List[Tuple[int, str]]:
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app.main"], env=env, capture_output=True, text=True, check=True)
+    rows = []
+    for line in out.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth <= 1: # app.main and what it imports directly; deeper imports are included in their parent
+            rows.append((int(cumulative), name.strip()))
+    return sorted(rows, reverse=True)[:top]
+
+
+def measure_first_request(env: Dict[str, str], path: str, timeout: float) -> Dict:
+    port = free_port()
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+    )
+    try:
+        while True:
+            if server.poll() is not None:
+                raise RuntimeError(f"server exited during startup:\n{server.stderr.read().decode()}")
+            if time.perf_counter() - start > timeout:
+                raise RuntimeError(f"no answer on {path} within {timeout}s")
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}{path}", timeout=1) as response:
+                    if response.status == 200:
+                        elapsed = time.perf_counter() - start
+                        break
+            except (urllib.error.URLError, ConnectionError, socket.timeout):
+                time.sleep(0.01)
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/healthz", timeout=5) as response:
+            phases = json.loads(response.read()).get("startup_seconds", {})
+        return {"first_request_s": elapsed, "phases": phases}
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+
+def median_ms(values: List[float]) -> float:
+    return round(statistics.median(values) * 1000, 1)
+
+
+def main(args):
+    variants = [parse_variant(spec) for spec in (args.variant or DEFAULT_VARIANTS)]
+    results = {"meta": run_metadata(args), "variants": {}}
+    for name, overrides in variants:
+        env = {**os.environ, **overrides}
+        imports, first_requests, phases = [], [], {}
+        for _ in range(args.repeat):
+            imports.append(measure_import(env))
+            run = measure_first_request(env, args.path, args.timeout)
+            first_requests.append(run["first_request_s"])
+            for phase, seconds in run["phases"].items():
+                phases.setdefault(phase, []).append(seconds)
+        summary = {
+            "env": overrides,
+            "import_ms": median_ms(imports),
+            "first_request_ms": median_ms(first_requests),
+            "phases_ms": {phase: median_ms(values) for phase, values in phases.items()},
+            "samples": {"import_s": imports, "first_request_s": first_requests},
+        }
+        results["variants"][name] = summary
+        phase_text = ", ".join(f"{p} {ms}" for p, ms in summary["phases_ms"].items())
+        print(f"{name:<16} import {summary['import_ms']:8.1f} ms   first request {summary['first_request_ms']:8.1f} ms   ({phase_text})")
+
+    if args.importtime:
+        print("\nSlowest top-level imports of app.main (cumulative):")
+        for micros, module in slowest_imports(dict(os.environ), args.importtime_top):
+            print(f"  {micros / 1000:8.1f} ms  {module}")
+    print(f"Results written to {write_results(args.output, 'boot', results)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--variant", action="append", help="name=KEY=VALUE[,KEY=VALUE...]; repeatable (default: index sync on vs. off)")
+    parser.add_argument("--path", default="/healthz", help="request timed as the first one served")
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--importtime", action="store_true")
+    parser.add_argument("--importtime-top", type=int, default=15)
+    parser.add_argument("--output", help="result file (default: benchmarks/results/boot-<timestamp>.json)")
+    main(parser.parse_args())
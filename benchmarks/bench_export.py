@@ -0,0 +1,68 @@
+"""
+Compares the list endpoints with their streaming export counterparts:
+peak RSS growth and time-to-first-byte for /products/withUsers vs /products/withUsers/export
+and /users/withProducts vs /users/withProducts/export.
+
+    python -m benchmarks.bench_export --products 200000 --users 2000
+"""
+import argparse
+import asyncio
+import subprocess
+import sys
+
+from benchmarks.common import (
+    BENCH_EMAIL_DOMAIN, RssSampler, asgi_request, auth_headers, cleanup, fmt_bytes, running_app, seed,
+)
+
+CASES = [
+    ("list", "/api/v1/products/withUsers", {}),
+    ("ndjson", "/api/v1/products/withUsers/export", {"format": "ndjson"}),
+    ("json", "/api/v1/products/withUsers/export", {"format": "json"}),
+    ("list", "/api/v1/users/withProducts", {}),
+    ("ndjson", "/api/v1/users/withProducts/export", {"format": "ndjson"}),
+]
+
+
+async def run_case(index: int, batch_size: int):
+    mode, path, params = CASES[index]
+    if mode != "list":
+        params = {**params, "batch_size": batch_size}
+    async with running_app() as app:
+        from app.models.user import User
+
+        user = await User.get_pymongo_collection().find_one({"email": {"$regex": f"@{BENCH_EMAIL_DOMAIN}$"}})
+        async with RssSampler() as rss:
+            r = await asgi_request(app, "GET", path, params=params, headers=auth_headers(user), keep_body=False)
+    print(
+        f"{mode:<8} {path:<40} {r['status']:>6} {r['ttfb'] * 1000:>9.1f} {r['total'] * 1000:>9.1f} "
+        f"{fmt_bytes(r['bytes']):>10} {fmt_bytes(rss.peak_delta):>10}",
+        flush=True,
+    )
+
+
+async def main(args):
+    if args.case is not None:
+        await run_case(args.case, args.batch_size)
+        return
+    async with running_app():
+        await seed(args.users, args.products)
+    try:
+        print(f"{'mode':<8} {'path':<40} {'status':>6} {'ttfb ms':>9} {'total ms':>9} {'size':>10} {'peak rss':>10}", flush=True)
+        for index in range(len(CASES)):
+            # One process per case so the allocator high-water mark of one run can't hide the next
+            subprocess.run(
+                [sys.executable, "-m", "benchmarks.bench_export", "--case", str(index), "--batch-size", str(args.batch_size)],
+                check=True,
+            )
+    finally:
+        async with running_app():
+            await cleanup()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--products", type=int, default=100_000)
+    parser.add_argument("--users", type=int, default=1_000)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--case", type=int, help=argparse.SUPPRESS) # Internal: run a single case in this process
+    asyncio.run(main(parser.parse_args()))
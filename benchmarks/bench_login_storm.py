@@ -0,0 +1,95 @@
+"""
+Latency of an unrelated endpoint while the worker is flooded with logins.
+
+Measures p50/p99 of GET /api/v1/products?limit=1 on its own and during a storm of concurrent
+POST /api/v1/auth/token requests, with bcrypt on the hashing pool (default) or, with --blocking,
+called inline on the event loop the way the handlers used to.
+
+    python -m benchmarks.bench_login_storm --logins 200 --concurrency 32
+"""
+import argparse
+import asyncio
+import time
+
+from benchmarks.common import asgi_request, auth_headers, cleanup, percentile, running_app, seed
+
+PROBE_PATH = "/api/v1/products"
+LOGIN_PATH = "/api/v1/auth/token"
+
+
+async def probe(app, headers, stop: asyncio.Event, interval: float):
+    latencies = []
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asgi_request(app, "GET", PROBE_PATH, params={"limit": 1}, headers=headers, keep_body=False)
+        latencies.append(time.perf_counter() - start)
+        await asyncio.sleep(interval)
+    return latencies
+
+
+async def login_storm(app, email: str, total: int, concurrency: int):
+    body = f"username={email}&password=benchmark".encode()
+    headers = {"Content-Type": "application/x-www-form-urlencoded"}
+    statuses = {}
+    queue = iter(range(total))
+
+    async def worker():
+        for _ in queue:
+            r = await asgi_request(app, "POST", LOGIN_PATH, headers=headers, body=body, keep_body=False)
+            statuses[r["status"]] = statuses.get(r["status"], 0) + 1
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return statuses
+
+
+def use_blocking_bcrypt():
+    """Swaps the pooled verify for an inline one, reproducing the old event-loop-blocking behaviour."""
+    from app.api.v1.auth import auth
+    from app.core.security import get_pwd_context
+
+    async def verify_inline(plain, hashed):
+        return get_pwd_context().verify_and_update(plain, hashed)
+
+    auth.verify_and_update_password = verify_inline
+
+
+def report(label, latencies):
+    print(
+        f"{label:<22} n={len(latencies):<5} p50={percentile(latencies, 50) * 1000:8.1f} ms "
+        f"p99={percentile(latencies, 99) * 1000:8.1f} ms max={max(latencies, default=0) * 1000:8.1f} ms"
+    )
+
+
+async def main(args):
+    if args.blocking:
+        use_blocking_bcrypt()
+    async with running_app() as app:
+        users, _ = await seed(n_users=1, n_products=100)
+        headers = auth_headers(users[0])
+        try:
+            stop = asyncio.Event()
+            probe_task = asyncio.create_task(probe(app, headers, stop, args.interval))
+            await asyncio.sleep(args.warmup)
+            stop.set()
+            report("idle", await probe_task)
+
+            stop = asyncio.Event()
+            probe_task = asyncio.create_task(probe(app, headers, stop, args.interval))
+            start = time.perf_counter()
+            statuses = await login_storm(app, users[0]["email"], args.logins, args.concurrency)
+            elapsed = time.perf_counter() - start
+            stop.set()
+            report("during login storm", await probe_task)
+            print(f"logins: {args.logins} in {elapsed:.2f}s ({args.logins / elapsed:.1f}/s), statuses {statuses}")
+        finally:
+            await cleanup()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--interval", type=float, default=0.01, help="pause between probe requests (s)")
+    parser.add_argument("--warmup", type=float, default=2.0, help="seconds of idle probing before the storm")
+    parser.add_argument("--blocking", action="store_true", help="verify passwords inline on the event loop")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,78 @@
+"""
+$lookup aggregations vs the batched RelationLoader on a skewed dataset.
+
+For products-with-creators and users-with-products, times both strategies end to end
+(query + model building + JSON serialization) and reports the response size.
+With --skew > 0 a few users own most of the products, which is where per-document joins hurt.
+
+    python -m benchmarks.bench_relations --products 200000 --users 5000 --skew 1.2 --products-limit 20
+"""
+import argparse
+import asyncio
+import time
+from typing import List
+
+from pydantic import TypeAdapter
+
+from benchmarks.common import cleanup, fmt_bytes, running_app, seed
+
+
+async def timed(label: str, load, adapter: TypeAdapter, repeat: int):
+    best = float("inf")
+    size = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        size = len(adapter.dump_json(await load(), by_alias=True))
+        best = min(best, time.perf_counter() - start)
+    print(f"{label:<42} best of {repeat}: {best * 1000:9.1f} ms   {fmt_bytes(size):>10}")
+
+
+async def main(args):
+    async with running_app():
+        from app.api.v1.products.products import PRODUCTS_WITH_USERS_PIPELINE
+        from app.api.v1.users.users import users_with_products_pipeline
+        from app.models.product import Product
+        from app.models.response_models import ProductWithUser, RelationLoader, UserWithProducts
+        from app.models.user import User, UserPublic
+
+        await seed(args.users, args.products, skew=args.skew)
+        try:
+            products_adapter = TypeAdapter(List[ProductWithUser])
+            users_adapter = TypeAdapter(List[UserWithProducts])
+
+            await timed(
+                "products/withUsers  lookup",
+                lambda: Product.aggregate(PRODUCTS_WITH_USERS_PIPELINE, projection_model=ProductWithUser).to_list(),
+                products_adapter, args.repeat,
+            )
+
+            async def products_batched():
+                return [p async for p in RelationLoader().iter_with_creators(Product.find_all(), args.batch_size)]
+
+            await timed("products/withUsers  batched", products_batched, products_adapter, args.repeat)
+
+            async def users_lookup():
+                return users_adapter.validate_python(
+                    await User.aggregate(users_with_products_pipeline(args.products_limit)).to_list()
+                )
+
+            async def users_batched():
+                users = await User.find_all().project(UserPublic).to_list()
+                return await RelationLoader().with_products(users, args.products_limit)
+
+            label = f"limit {args.products_limit}" if args.products_limit else "no limit"
+            await timed(f"users/withProducts  lookup  ({label})", users_lookup, users_adapter, args.repeat)
+            await timed(f"users/withProducts  batched ({label})", users_batched, users_adapter, args.repeat)
+        finally:
+            await cleanup()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--products", type=int, default=100_000)
+    parser.add_argument("--users", type=int, default=2_000)
+    parser.add_argument("--skew", type=float, default=1.2, help="Zipf exponent for product ownership (0 = uniform)")
+    parser.add_argument("--products-limit", type=int, default=None, help="max embedded products per user")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=3)
+    asyncio.run(main(parser.parse_args()))
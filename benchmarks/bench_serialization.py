@@ -0,0 +1,88 @@
+"""
+CPU cost of serializing large list responses: the default response_model path vs FAST_SERIALIZATION.
+
+For products/withUsers and users/withProducts the documents are read from Mongo once, then each
+serialization path is timed in process CPU time (the database round trip is the same for all of them):
+
+  response_model  Beanie builds the models, then FastAPI validates them again against the
+                  response_model and encodes the result (what the endpoints do by default)
+  dump_json       Beanie builds the models, pydantic-core writes them straight to bytes
+  raw             the projected cursor documents are written to bytes without building models
+
+    python -m benchmarks.bench_serialization --products 10000 --users 500 --repeat 5
+"""
+import argparse
+import asyncio
+import json
+import time
+from typing import List
+
+from benchmarks.common import cleanup, fmt_bytes, running_app, seed
+
+
+async def cpu_best(fn, repeat: int):
+    best = float("inf")
+    size = 0
+    for _ in range(repeat):
+        start = time.process_time()
+        size = len(await fn())
+        best = min(best, time.process_time() - start)
+    return best, size
+
+
+async def report(label: str, fn, repeat: int, baseline=None):
+    best, size = await cpu_best(fn, repeat)
+    saving = f"{(1 - best / baseline) * 100:5.1f}% less CPU" if baseline else ""
+    print(f"{label:<40} {best * 1000:9.1f} ms CPU   {fmt_bytes(size):>10}   {saving}")
+    return best
+
+
+async def main(args):
+    async with running_app():
+        from fastapi.routing import serialize_response
+        from fastapi.utils import create_model_field
+
+        from app.api.v1.products.products import PRODUCTS_WITH_USERS_PIPELINE
+        from app.api.v1.users.users import users_with_products_pipeline
+        from app.core.serialization import dump_json, model_projection, raw_json, type_adapter
+        from app.models.product import Product
+        from app.models.response_models import ProductWithUser, UserWithProducts
+        from app.models.user import User
+
+        await seed(args.users, args.products)
+        try:
+            cases = [
+                ("products/withUsers", Product, PRODUCTS_WITH_USERS_PIPELINE, List[ProductWithUser]),
+                ("users/withProducts", User, users_with_products_pipeline(), List[UserWithProducts]),
+            ]
+            for name, document, pipeline, model in cases:
+                pipeline = pipeline + [{"$project": model_projection(model.__args__[0])}]
+                docs = await (await document.get_pymongo_collection().aggregate(pipeline)).to_list()
+                field = create_model_field(name="Response", type_=model, mode="serialization")
+                adapter = type_adapter(model)
+                print(f"{name}: {len(docs)} items")
+
+                async def response_model_path():
+                    # What FastAPI does with a handler's return value: validate against response_model, then JSONResponse
+                    value = await serialize_response(field=field, response_content=adapter.validate_python(docs))
+                    return json.dumps(value, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode()
+
+                async def dump_json_path():
+                    return dump_json(model, adapter.validate_python(docs))
+
+                async def raw_path():
+                    return raw_json(docs)
+
+                baseline = await report("  response_model (default)", response_model_path, args.repeat)
+                await report("  models + dump_json", dump_json_path, args.repeat, baseline)
+                await report("  raw cursor documents", raw_path, args.repeat, baseline)
+        finally:
+            await cleanup()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--products", type=int, default=10_000)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=5)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,162 @@
+"""
+Throughput scaling with the number of server workers.
+
+For each worker count, starts `python -m app.server` with WEB_WORKERS=n on a free port and drives it over real
+HTTP for --duration seconds. The load comes from --clients processes, each holding --connections keep-alive
+connections (a minimal asyncio HTTP/1.1 client, so the load generator itself scales across cores):
+
+    python -m benchmarks.bench_workers --workers 1 2 4 8
+    python -m benchmarks.bench_workers --workers 1 4 --path /api/v1/products --auth   # seeds products, sends a token
+
+Reports requests/s, p50/p99 latency, errors and the speed-up over the first worker count. Keep --clients large
+enough that the client side is not the bottleneck (it should not reach 100% CPU before the server does).
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional
+
+from benchmarks.bench_boot import free_port
+from benchmarks.common import percentile, run_metadata, write_results
+
+
+async def _connection(port: int, request: bytes, deadline: float, latencies: List[float], errors: List[int]):
+    reader = writer = None
+    while time.perf_counter() < deadline:
+        try:
+            if writer is None:
+                reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            start = time.perf_counter()
+            writer.write(request)
+            head = await reader.readuntil(b"\r\n\r\n")
+            status = int(head.split(b" ", 2)[1])
+            length = 0
+            for line in head.split(b"\r\n")[1:]:
+                name, _, value = line.partition(b":")
+                if name.strip().lower() == b"content-length":
+                    length = int(value)
+            await reader.readexactly(length)
+            latencies.append(time.perf_counter() - start)
+            if status != 200:
+                errors[0] += 1
+        except (OSError, asyncio.IncompleteReadError, ValueError):
+            errors[0] += 1
+            if writer is not None:
+                writer.close()
+            writer = None
+            await asyncio.sleep(0.01)
+    if writer is not None:
+        writer.close()
+
+
+def client_process(port: int, request: bytes, connections: int, duration: float) -> Dict:
+    latencies: List[float] = []
+    errors = [0]
+
+    async def run():
+        deadline = time.perf_counter() + duration
+        await asyncio.gather(*(_connection(port, request, deadline, latencies, errors) for _ in range(connections)))
+
+    asyncio.run(run())
+    return {"latencies": latencies, "errors": errors[0]}
+
+
+def wait_ready(server: subprocess.Popen, port: int, timeout: float):
+    start = time.perf_counter()
+    while True:
+        if server.poll() is not None:
+            raise RuntimeError(f"server exited during startup:\n{server.stderr.read().decode()}")
+        if time.perf_counter() - start > timeout:
+            raise RuntimeError(f"/healthz did not answer within {timeout}s")
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/healthz", timeout=1) as response:
+                if response.status == 200:
+                    return
+        except (urllib.error.URLError, ConnectionError, OSError):
+            time.sleep(0.05)
+
+
+def measure(workers: int, args, headers: Dict[str, str]) -> Dict:
+    port = free_port()
+    env = {**os.environ, "WEB_WORKERS": str(workers), "WEB_HOST": "127.0.0.1", "WEB_PORT": str(port), "WEB_LOG_LEVEL": "warning"}
+    server = subprocess.Popen([sys.executable, "-m", "app.server"], env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    try:
+        wait_ready(server, port, args.timeout)
+        time.sleep(args.warmup) # Let every worker finish its lifespan; /healthz only proves one is up
+        lines = [f"GET {args.path} HTTP/1.1", f"Host: 127.0.0.1:{port}"] + [f"{k}: {v}" for k, v in headers.items()]
+        request = ("\r\n".join(lines) + "\r\n\r\n").encode()
+        with ProcessPoolExecutor(args.clients) as pool:
+            start = time.perf_counter()
+            runs = list(pool.map(client_process, *zip(*[(port, request, args.connections, args.duration)] * args.clients)))
+            elapsed = time.perf_counter() - start
+    finally:
+        server.terminate()
+        server.wait(timeout=60)
+    latencies = [latency for run in runs for latency in run["latencies"]]
+    return {
+        "workers": workers,
+        "requests": len(latencies),
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        "errors": sum(run["errors"] for run in runs),
+    }
+
+
+async def prepare_auth(n_products: int) -> Dict[str, str]:
+    from app.core.database import lifespan_mongodb
+    from benchmarks.common import auth_headers, seed
+
+    async with lifespan_mongodb(None):
+        users, _ = await seed(1, n_products)
+    return auth_headers(users[0])
+
+
+async def teardown_auth():
+    from app.core.database import lifespan_mongodb
+    from benchmarks.common import cleanup
+
+    async with lifespan_mongodb(None):
+        await cleanup()
+
+
+def main(args):
+    headers = asyncio.run(prepare_auth(args.products)) if args.auth else {}
+    results = {"meta": run_metadata(args), "runs": []}
+    baseline: Optional[float] = None
+    try:
+        for workers in args.workers:
+            run = measure(workers, args, headers)
+            baseline = baseline or run["throughput_rps"]
+            run["speedup"] = round(run["throughput_rps"] / baseline, 2) if baseline else None
+            results["runs"].append(run)
+            print(
+                f"{workers:>3} worker(s)  {run['throughput_rps']:10.1f} req/s  p50 {run['p50_ms']:8.2f} ms  "
+                f"p99 {run['p99_ms']:8.2f} ms  errors {run['errors']:5d}  x{run['speedup']}"
+            )
+    finally:
+        if args.auth:
+            asyncio.run(teardown_auth())
+    print(f"Results written to {write_results(args.output, 'workers', results)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=sorted({1, 2, max(1, (os.cpu_count() or 1) // 2), os.cpu_count() or 1}))
+    parser.add_argument("--path", default="/healthz")
+    parser.add_argument("--auth", action="store_true", help="seed a user and --products products, send a bearer token")
+    parser.add_argument("--products", type=int, default=1000)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--warmup", type=float, default=2)
+    parser.add_argument("--clients", type=int, default=max(1, (os.cpu_count() or 2) // 2), help="load generator processes")
+    parser.add_argument("--connections", type=int, default=32, help="keep-alive connections per client process")
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--output", help="result file (default: benchmarks/results/workers-<timestamp>.json)")
+    main(parser.parse_args())
@@ -0,0 +1,259 @@
+"""
+Shared helpers for the benchmark scripts.
+
+The scripts drive the FastAPI app in-process through its ASGI interface (no HTTP client or
+server needed) against the MongoDB/Redis pointed to by MONGODB_URL / REDIS_URL.
+Seeded documents are tagged so they can be removed afterwards without touching other data.
+"""
+import asyncio
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlencode
+
+os.environ.setdefault("SECRET_KEY", "benchmark-secret-key")
+os.environ.setdefault("RATE_LIMIT_ENABLED", "false") # Measure the routes, not the limiter; set it to "true" to include admission control
+
+from bson import ObjectId
+
+BENCH_CATEGORY_PREFIX = "bench-"
+BENCH_EMAIL_DOMAIN = "bench.example.com"
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+
+def current_rss() -> int:
+    """Resident set size of this process in bytes (Linux)."""
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * PAGE_SIZE
+
+
+class RssSampler:
+    """Samples RSS on the event loop every `interval` seconds and keeps the peak above the starting point."""
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.baseline = 0
+        self.peak = 0
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self):
+        while True:
+            self.peak = max(self.peak, current_rss())
+            await asyncio.sleep(self.interval)
+
+    async def __aenter__(self):
+        self.baseline = self.peak = current_rss()
+        self._task = asyncio.create_task(self._run())
+        return self
+
+    async def __aexit__(self, *exc):
+        self._task.cancel()
+        self.peak = max(self.peak, current_rss())
+
+    @property
+    def peak_delta(self) -> int:
+        return self.peak - self.baseline
+
+
+async def asgi_request(
+    app,
+    method: str,
+    path: str,
+    params: Optional[Dict] = None,
+    headers: Optional[Dict[str, str]] = None,
+    body: bytes = b"",
+    keep_body: bool = True,
+) -> Dict:
+    """
+    Sends one request through the ASGI app and returns status, time-to-first-byte, total time,
+    response size and (unless keep_body=False, e.g. when measuring memory) the response body.
+    """
+    raw_headers = [(k.lower().encode(), v.encode()) for k, v in (headers or {}).items()]
+    if body:
+        raw_headers.append((b"content-length", str(len(body)).encode()))
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": urlencode(params or {}, doseq=True).encode(),
+        "headers": raw_headers,
+        "client": ("127.0.0.1", 50000),
+        "server": ("testserver", 80),
+        "root_path": "",
+    }
+    request_sent = False
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        await asyncio.Event().wait() # Never disconnect while the response is streaming
+
+    result = {"status": None, "ttfb": None, "bytes": 0, "headers": {}}
+    chunks: List[bytes] = []
+    start = time.perf_counter()
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            result["status"] = message["status"]
+            result["headers"] = {k.decode(): v.decode() for k, v in message.get("headers", [])}
+        elif message["type"] == "http.response.body":
+            chunk = message.get("body", b"")
+            if chunk and result["ttfb"] is None:
+                result["ttfb"] = time.perf_counter() - start
+            result["bytes"] += len(chunk)
+            if keep_body:
+                chunks.append(chunk)
+
+    await app(scope, receive, send)
+    result["total"] = time.perf_counter() - start
+    result["body"] = b"".join(chunks)
+    return result
+
+
+@asynccontextmanager
+async def running_app():
+    """Imports the app and runs its lifespan (Mongo + Redis connections) around the block."""
+    from app.main import app
+
+    async with app.router.lifespan_context(app):
+        yield app
+
+
+def auth_headers(user_doc: Dict) -> Dict[str, str]:
+    from app.core.security import create_access_token
+
+    token = create_access_token(data={"sub": user_doc["email"]})
+    return {"Authorization": f"Bearer {token}"}
+
+
+async def seed(n_users: int, n_products: int, skew: float = 0.0, batch: int = 10_000) -> Tuple[List[Dict], int]:
+    """
+    Inserts benchmark users and products straight through PyMongo.
+    With skew > 0 product creators follow a Zipf-like distribution (a few users own most products).
+    Returns the user documents and the number of products inserted.
+    """
+    from app.core.security import get_password_hash
+    from app.models.product import Product
+    from app.models.user import User
+
+    await cleanup()
+    hashed = get_password_hash("benchmark") # Same hash for everyone; hashing is benchmarked separately
+    users = [
+        {"_id": ObjectId(), "name": f"Bench User {i}", "email": f"user{i}@{BENCH_EMAIL_DOMAIN}", "hashed_password": hashed}
+        for i in range(n_users)
+    ]
+    await User.get_pymongo_collection().insert_many(users)
+
+    weights = [1 / (i + 1) ** skew for i in range(n_users)] if skew else None
+    inserted = 0
+    while inserted < n_products:
+        count = min(batch, n_products - inserted)
+        creators = random.choices(users, weights=weights, k=count)
+        docs = [
+            {
+                "name": f"Product {inserted + i}",
+                "description": "Benchmark product " * 4,
+                "price": round(random.uniform(1, 1000), 2),
+                "category": f"{BENCH_CATEGORY_PREFIX}{random.randrange(20)}",
+                "creator_id": creator["_id"],
+            }
+            for i, creator in enumerate(creators)
+        ]
+        await Product.get_pymongo_collection().insert_many(docs, ordered=False)
+        inserted += count
+    return users, inserted
+
+
+async def cleanup():
+    from app.models.product import Product
+    from app.models.user import User
+
+    await Product.get_pymongo_collection().delete_many({"category": {"$regex": f"^{BENCH_CATEGORY_PREFIX}"}})
+    await User.get_pymongo_collection().delete_many({"email": {"$regex": f"@{BENCH_EMAIL_DOMAIN}$"}})
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    """Nearest-rank percentile of `samples` (0 when empty)."""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = max(0, min(len(ordered) - 1, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+async def run_concurrent(call: Callable[[int], Awaitable[Dict]], total: int, concurrency: int) -> Dict:
+    """
+    Issues `total` calls (call(i) returns an asgi_request result) from `concurrency` concurrent workers
+    and returns throughput, latency percentiles, status counts and the peak RSS growth while running.
+    """
+    latencies: List[float] = []
+    statuses: Dict[str, int] = {}
+    counter = iter(range(total))
+
+    async def worker():
+        for i in counter:
+            start = time.perf_counter()
+            r = await call(i)
+            latencies.append(time.perf_counter() - start)
+            statuses[str(r["status"])] = statuses.get(str(r["status"]), 0) + 1
+
+    async with RssSampler() as rss:
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    return {
+        "requests": total,
+        "concurrency": concurrency,
+        "elapsed_s": round(elapsed, 4),
+        "throughput_rps": round(total / elapsed, 2) if elapsed else None,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        "max_ms": round(max(latencies, default=0) * 1000, 3),
+        "statuses": statuses,
+        "peak_rss_bytes": rss.peak,
+        "peak_rss_growth_bytes": rss.peak_delta,
+    }
+
+
+def run_metadata(args) -> Dict:
+    """What a result file needs to be comparable later: when, which commit, which settings."""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": commit or None,
+        "python": platform.python_version(),
+        "cpus": os.cpu_count(),
+        "args": vars(args),
+    }
+
+
+def write_results(path: Optional[str], name: str, results: Dict) -> str:
+    """Writes results as JSON (default: benchmarks/results/<name>-<timestamp>.json) and returns the path."""
+    if path is None:
+        directory = os.path.join(os.path.dirname(__file__), "results")
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{name}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2, default=str)
+    return path
+
+
+def fmt_bytes(n: int) -> str:
+    return f"{n / (1024 * 1024):.1f} MiB"
@@ -0,0 +1,41 @@
+"""
+Compares two result files written by benchmarks.load (or benchmarks.micro) scenario by scenario.
+
+    python -m benchmarks.compare benchmarks/results/load-before.json benchmarks/results/load-after.json
+"""
+import argparse
+import json
+
+
+def pct_change(old, new):
+    if not old or new is None:
+        return "n/a"
+    return f"{(new - old) / old * 100:+.1f}%"
+
+
+def main(args):
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+    print(f"baseline:  {baseline['meta'].get('commit')} {baseline['meta'].get('timestamp')}")
+    print(f"candidate: {candidate['meta'].get('commit')} {candidate['meta'].get('timestamp')}")
+    print(f"{'scenario':<28} {'metric':<16} {'baseline':>12} {'candidate':>12} {'change':>9}")
+    for name, old in baseline["scenarios"].items():
+        new = candidate["scenarios"].get(name)
+        if new is None:
+            print(f"{name:<28} missing from candidate")
+            continue
+        for metric in args.metrics.split(","):
+            if metric in old:
+                print(f"{name:<28} {metric:<16} {old[metric]:>12} {new.get(metric)!s:>12} {pct_change(old[metric], new.get(metric)):>9}")
+    for name in candidate["scenarios"].keys() - baseline["scenarios"].keys():
+        print(f"{name:<28} new in candidate")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--metrics", default="throughput_rps,p50_ms,p99_ms,peak_rss_growth_bytes,ops_per_s")
+    main(parser.parse_args())
@@ -0,0 +1,125 @@
+"""
+Fixed-concurrency load test of every route in app/api/v1 (auth, users, products).
+
+Seeds the MongoDB/Redis given by MONGODB_URL / REDIS_URL (e.g. `docker compose up mongodb redis`
+or local mongod/redis-server binaries) with --users/--products documents, then runs each scenario
+for --requests requests at --concurrency and reports throughput, p50/p95/p99 latency and peak RSS.
+Results are written as JSON so runs can be compared with `python -m benchmarks.compare old.json new.json`.
+
+    python -m benchmarks.load --products 100000 --users 1000 --requests 2000 --concurrency 32
+    python -m benchmarks.load --only products_list,products_search
+"""
+import argparse
+import asyncio
+import json
+import random
+import uuid
+
+from benchmarks.common import (
+    BENCH_CATEGORY_PREFIX, BENCH_EMAIL_DOMAIN, asgi_request, auth_headers, cleanup,
+    run_concurrent, run_metadata, running_app, seed, write_results,
+)
+
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+
+def product_body(i: int) -> dict:
+    return {"name": f"Load product {i}", "description": "Created by the load test", "price": round(random.uniform(1, 1000), 2), "category": f"{BENCH_CATEGORY_PREFIX}{i % 20}"}
+
+
+class Context:
+    """Seeded ids and tokens shared by the scenarios."""
+
+    def __init__(self, users, product_ids, victim_users, victim_products):
+        self.users = users
+        self.user_ids = [str(u["_id"]) for u in users]
+        self.product_ids = [str(p) for p in product_ids]
+        self.headers = auth_headers(users[0])
+        self.victim_users = iter(str(u) for u in victim_users) # Consumed by the delete scenarios
+        self.victim_products = iter(str(p) for p in victim_products)
+        self.run_id = uuid.uuid4().hex[:8]
+
+
+def scenarios(ctx: Context):
+    """name -> function(i) building the kwargs of one asgi_request."""
+    auth = ctx.headers
+    user = ctx.users[0]
+    return {
+        "auth_register": lambda i: dict(method="POST", path="/api/v1/auth/register", headers=JSON_HEADERS, body=json.dumps(
+            {"name": f"Registered {i}", "email": f"reg-{ctx.run_id}-{i}@{BENCH_EMAIL_DOMAIN}", "password": "benchmark"}).encode()),
+        "auth_token": lambda i: dict(method="POST", path="/api/v1/auth/token",
+            headers={"Content-Type": "application/x-www-form-urlencoded"},
+            body=f"username={random.choice(ctx.users)['email']}&password=benchmark".encode()),
+        "users_create": lambda i: dict(method="POST", path="/api/v1/users", headers=JSON_HEADERS, body=json.dumps(
+            {"name": f"Created {i}", "email": f"new-{ctx.run_id}-{i}@{BENCH_EMAIL_DOMAIN}", "password": "benchmark"}).encode()),
+        "users_list": lambda i: dict(method="GET", path="/api/v1/users", params={"limit": 50}),
+        "users_list_projected": lambda i: dict(method="GET", path="/api/v1/users", params={"limit": 50, "fields": "name"}),
+        "users_get": lambda i: dict(method="GET", path=f"/api/v1/users/{random.choice(ctx.user_ids)}"),
+        "users_with_products": lambda i: dict(method="GET", path="/api/v1/users/withProducts", params={"products_limit": 10}),
+        "users_update": lambda i: dict(method="PUT", path=f"/api/v1/users/{user['_id']}", headers=JSON_HEADERS, body=json.dumps(
+            {"name": f"Bench User {i}", "email": user["email"], "password": "benchmark"}).encode()),
+        "users_delete": lambda i: dict(method="DELETE", path=f"/api/v1/users/{next(ctx.victim_users)}"),
+        "products_create": lambda i: dict(method="POST", path="/api/v1/products", headers={**auth, **JSON_HEADERS},
+            body=json.dumps(product_body(i)).encode()),
+        "products_bulk_create": lambda i: dict(method="POST", path="/api/v1/products/bulk", headers={**auth, **JSON_HEADERS},
+            body=json.dumps([product_body(i * 100 + j) for j in range(100)]).encode()),
+        "products_list": lambda i: dict(method="GET", path="/api/v1/products", headers=auth, params={"limit": 50}),
+        "products_list_filtered": lambda i: dict(method="GET", path="/api/v1/products", headers=auth,
+            params={"limit": 50, "category": f"{BENCH_CATEGORY_PREFIX}{i % 20}", "sort": "-price", "fields": "name,price"}),
+        "products_get": lambda i: dict(method="GET", path=f"/api/v1/products/{random.choice(ctx.product_ids)}", headers=auth),
+        "products_search": lambda i: dict(method="GET", path="/api/v1/products/search", headers=auth,
+            params={"q": f"Product {random.randrange(1000)}", "sort": "relevance"}),
+        "products_with_users": lambda i: dict(method="GET", path="/api/v1/products/withUsers", headers=auth),
+        "products_export": lambda i: dict(method="GET", path="/api/v1/products/withUsers/export", headers=auth),
+        "products_update": lambda i: dict(method="PUT", path=f"/api/v1/products/{random.choice(ctx.product_ids)}",
+            headers={**auth, **JSON_HEADERS}, body=json.dumps(product_body(i)).encode()),
+        "products_delete": lambda i: dict(method="DELETE", path=f"/api/v1/products/{next(ctx.victim_products)}", headers=auth),
+    }
+
+
+# Whole-collection reads are much heavier than everything else; they get fewer requests
+HEAVY = {"products_with_users", "products_export", "users_with_products"}
+
+
+async def main(args):
+    async with running_app() as app:
+        from app.models.product import Product
+
+        users, _ = await seed(args.users + args.requests, args.products + args.requests)
+        seeded_products = [d["_id"] async for d in await Product.get_pymongo_collection().find(
+            {"category": {"$regex": f"^{BENCH_CATEGORY_PREFIX}"}}, {"_id": 1})]
+        victim_users, users = users[args.users:], users[:args.users]
+        victim_products, product_ids = seeded_products[args.products:], seeded_products[:args.products]
+        # Victim users must not own anything the other scenarios read
+        await Product.get_pymongo_collection().update_many(
+            {"creator_id": {"$in": [u["_id"] for u in victim_users]}}, {"$set": {"creator_id": users[0]["_id"]}}
+        )
+        ctx = Context(users, product_ids, [u["_id"] for u in victim_users], victim_products)
+
+        selected = scenarios(ctx)
+        if args.only:
+            selected = {name: selected[name] for name in args.only.split(",")}
+        results = {"meta": run_metadata(args), "scenarios": {}}
+        try:
+            print(f"{'scenario':<24} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}  statuses")
+            for name, build in selected.items():
+                total = max(1, args.requests // 20) if name in HEAVY else args.requests
+                stats = await run_concurrent(
+                    lambda i, build=build: asgi_request(app, keep_body=False, **build(i)), total, args.concurrency
+                )
+                results["scenarios"][name] = stats
+                print(f"{name:<24} {stats['throughput_rps']:>9.1f} {stats['p50_ms']:>9.2f} {stats['p95_ms']:>9.2f} {stats['p99_ms']:>9.2f}  {stats['statuses']}", flush=True)
+        finally:
+            await cleanup()
+    print(f"Results written to {write_results(args.output, 'load', results)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--products", type=int, default=50_000)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--requests", type=int, default=1_000, help="requests per scenario (heavy scenarios run 1/20 of this)")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--only", help="comma-separated scenario names")
+    parser.add_argument("--output", help="result file (default: benchmarks/results/load-<timestamp>.json)")
+    asyncio.run(main(parser.parse_args()))
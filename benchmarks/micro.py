@@ -0,0 +1,92 @@
+"""
+Micro-benchmarks of the CPU-bound pieces every request goes through:
+response serialization (FastAPI's jsonable_encoder path vs pydantic's dump_json), JWT encode/decode
+and password hashing. Beanie has to be initialised to validate documents, so this still needs MongoDB.
+
+    python -m benchmarks.micro --items 1000 --rounds 20
+"""
+import argparse
+import asyncio
+import time
+
+from bson import ObjectId
+
+from benchmarks.common import run_metadata, running_app, write_results
+
+
+def bench(fn, rounds: int) -> dict:
+    fn() # Warm up (schema building, caches)
+    start = time.perf_counter()
+    for _ in range(rounds):
+        fn()
+    elapsed = time.perf_counter() - start
+    return {"rounds": rounds, "mean_ms": round(elapsed / rounds * 1000, 4), "ops_per_s": round(rounds / elapsed, 2)}
+
+
+def serialization_cases(items: int) -> dict:
+    from fastapi.encoders import jsonable_encoder
+    from pydantic import TypeAdapter
+    from typing import List
+    import json
+
+    from app.models.response_models import ProductWithUser, UserWithProducts
+
+    users = [{"_id": ObjectId(), "name": f"User {i}", "email": f"user{i}@example.com"} for i in range(max(1, items // 10))]
+    products = [
+        {"_id": ObjectId(), "name": f"Product {i}", "description": "Benchmark product " * 4, "price": i * 1.5,
+         "category": f"category-{i % 20}", "creator_id": users[i % len(users)]["_id"], "creator": users[i % len(users)]}
+        for i in range(items)
+    ]
+    with_users = TypeAdapter(List[ProductWithUser]).validate_python(products)
+    with_products = TypeAdapter(List[UserWithProducts]).validate_python(
+        [{**u, "products": [p for p in products if p["creator_id"] == u["_id"]]} for u in users]
+    )
+    cases = {}
+    for name, model, value in (
+        ("products_with_users", List[ProductWithUser], with_users),
+        ("users_with_products", List[UserWithProducts], with_products),
+    ):
+        adapter = TypeAdapter(model)
+        # What FastAPI does for a plain return value: jsonable_encoder, then json.dumps
+        cases[f"{name}_jsonable_encoder"] = lambda value=value: json.dumps(jsonable_encoder(value, by_alias=True)).encode()
+        cases[f"{name}_dump_json"] = lambda adapter=adapter, value=value: adapter.dump_json(value, by_alias=True)
+        cases[f"{name}_validate_python"] = lambda adapter=adapter, value=value: adapter.validate_python(
+            adapter.dump_python(value, by_alias=True)
+        )
+    return cases
+
+
+def auth_cases() -> dict:
+    from app.core.security import create_access_token, decode_access_token, get_password_hash, verify_password
+
+    token = create_access_token({"sub": "user@example.com"})
+    hashed = get_password_hash("benchmark")
+    return {
+        "jwt_encode": lambda: create_access_token({"sub": "user@example.com"}),
+        "jwt_decode": lambda: decode_access_token(token),
+        "password_verify": lambda: verify_password("benchmark", hashed),
+    }
+
+
+async def main(args):
+    async with running_app():
+        cases = {**serialization_cases(args.items), **auth_cases()}
+        results = {"meta": run_metadata(args), "scenarios": {}}
+        print(f"{'case':<44} {'mean ms':>10} {'ops/s':>10}")
+        for name, fn in cases.items():
+            if args.only and name not in args.only.split(","):
+                continue
+            rounds = max(1, args.rounds // 10) if name.startswith("password") else args.rounds
+            stats = bench(fn, rounds)
+            results["scenarios"][name] = stats
+            print(f"{name:<44} {stats['mean_ms']:>10.3f} {stats['ops_per_s']:>10.1f}", flush=True)
+    print(f"Results written to {write_results(args.output, 'micro', results)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--items", type=int, default=1_000, help="products per serialized response")
+    parser.add_argument("--rounds", type=int, default=50)
+    parser.add_argument("--only", help="comma-separated case names")
+    parser.add_argument("--output", help="result file (default: benchmarks/results/micro-<timestamp>.json)")
+    asyncio.run(main(parser.parse_args()))
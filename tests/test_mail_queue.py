@@ -0,0 +1,217 @@
+# tests/test_mail_queue.py
+# The mail queue against a minimal in-process SMTP server. Pool tests need nothing else; the MailWorker
+# tests also need Redis (TEST_REDIS_URL) and are skipped without it.
+import asyncio
+import json
+import socket
+import time
+
+import pytest
+
+from app.core.config import MAIL_MAX_ATTEMPTS, MAIL_RETRY_BASE_SECONDS
+from app.core.mail_queue import (
+    MailWorker, SMTPConnectionPool, retry_delay, QUEUE_KEY, RETRY_KEY, DEAD_LETTER_KEY, PROCESSING_KEY_PREFIX,
+)
+from app.core.mailer import build_welcome_email
+from tests.conftest import run, redis_or_skip
+
+WORKER_ID = "test"
+MAIL_KEYS = [QUEUE_KEY, RETRY_KEY, DEAD_LETTER_KEY, PROCESSING_KEY_PREFIX + WORKER_ID]
+
+
+class StubSMTPServer:
+    """Just enough SMTP for aiosmtplib: EHLO, MAIL, RCPT, DATA, RSET, NOOP, QUIT. Keeps the received messages."""
+
+    def __init__(self, reject_mail: bool = False):
+        self.reject_mail = reject_mail # Answer MAIL FROM with a permanent 550
+        self.messages = []
+        self.connections = 0
+        self._server = None
+        self.port = None
+
+    async def __aenter__(self):
+        self._server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def __aexit__(self, *exc):
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def _handle(self, reader, writer):
+        self.connections += 1
+        writer.write(b"220 stub ESMTP\r\n")
+        try:
+            while line := await reader.readline():
+                command = line.decode().strip().upper()
+                if command.startswith(("EHLO", "HELO")):
+                    writer.write(b"250 stub\r\n")
+                elif command.startswith("MAIL"):
+                    writer.write(b"550 rejected\r\n" if self.reject_mail else b"250 OK\r\n")
+                elif command.startswith(("RCPT", "RSET", "NOOP")):
+                    writer.write(b"250 OK\r\n")
+                elif command == "DATA":
+                    writer.write(b"354 go ahead\r\n")
+                    await writer.drain()
+                    self.messages.append((await reader.readuntil(b"\r\n.\r\n")).decode())
+                    writer.write(b"250 queued\r\n")
+                elif command == "QUIT":
+                    writer.write(b"221 bye\r\n")
+                    await writer.drain()
+                    break
+                else:
+                    writer.write(b"502 not implemented\r\n")
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+def refused_port() -> int:
+    # Bound and closed again: nothing listens there, so connecting is refused right away
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def welcome_job(to: str, attempts: int = 0, kind: str = "welcome") -> str:
+    return json.dumps({"id": to, "kind": kind, "attempts": attempts, "to": to, "name": "Test"})
+
+
+def test_retry_delay_backs_off_exponentially():
+    assert [retry_delay(n) for n in (1, 2, 3)] == [MAIL_RETRY_BASE_SECONDS, 2 * MAIL_RETRY_BASE_SECONDS, 4 * MAIL_RETRY_BASE_SECONDS]
+
+
+def test_pool_reuses_connections():
+    async def scenario():
+        async with StubSMTPServer() as server:
+            pool = SMTPConnectionPool("127.0.0.1", server.port, size=2, timeout=5)
+            await asyncio.gather(*(pool.send(build_welcome_email(f"u{i}@example.com", "Test")) for i in range(10)))
+            await pool.close()
+            return server
+
+    server = run(scenario())
+    assert len(server.messages) == 10
+    assert server.connections <= 2
+
+
+def test_pool_refused_connection_does_not_strand_waiters():
+    # More concurrent sends than connections while the server is down: every send must fail, none may hang
+    async def scenario():
+        pool = SMTPConnectionPool("127.0.0.1", refused_port(), size=2, timeout=5)
+        results = await asyncio.wait_for(
+            asyncio.gather(*(pool.send(build_welcome_email(f"u{i}@example.com", "Test")) for i in range(6)), return_exceptions=True),
+            timeout=10,
+        )
+        return pool, results
+
+    pool, results = run(scenario())
+    assert len(results) == 6 and all(isinstance(r, Exception) for r in results)
+    assert pool._slots._value == 2 # Every slot was given back
+
+
+def test_pool_recovers_after_broken_connections():
+    async def scenario():
+        async with StubSMTPServer(reject_mail=True) as server:
+            pool = SMTPConnectionPool("127.0.0.1", server.port, size=1, timeout=5)
+            with pytest.raises(Exception):
+                await pool.send(build_welcome_email("a@example.com", "Test"))
+            server.reject_mail = False
+            await asyncio.wait_for(pool.send(build_welcome_email("b@example.com", "Test")), timeout=5)
+            await pool.close()
+            return server
+
+    assert len(run(scenario()).messages) == 1
+
+
+async def _worker_run(client, port: int, jobs, pool_size: int = 2):
+    await client.delete(*MAIL_KEYS)
+    if jobs:
+        await client.lpush(QUEUE_KEY, *jobs)
+    pool = SMTPConnectionPool("127.0.0.1", port, size=pool_size, timeout=5)
+    worker = MailWorker(client, pool, WORKER_ID)
+    stop = asyncio.Event()
+    task = asyncio.create_task(worker.run(stop))
+    deadline = time.monotonic() + 10
+    while await client.llen(QUEUE_KEY) or await client.llen(PROCESSING_KEY_PREFIX + WORKER_ID):
+        assert time.monotonic() < deadline, "mail worker did not finish its jobs"
+        await asyncio.sleep(0.05)
+    stop.set()
+    await asyncio.wait_for(task, timeout=5)
+    await pool.close()
+    return worker
+
+
+def test_worker_delivers_queued_mail():
+    async def scenario():
+        client = await redis_or_skip()
+        try:
+            async with StubSMTPServer() as server:
+                worker = await _worker_run(client, server.port, [welcome_job(f"u{i}@example.com") for i in range(5)])
+            return server, worker
+        finally:
+            await client.delete(*MAIL_KEYS)
+            await client.aclose()
+
+    server, worker = run(scenario())
+    assert len(server.messages) == 5
+    assert worker.sent == 5 and worker.retried == 0
+
+
+def test_worker_schedules_retries_when_smtp_is_down():
+    # 6 jobs over 2 connections to a refused port: all of them must be rescheduled (the pool used to deadlock here)
+    async def scenario():
+        client = await redis_or_skip()
+        try:
+            before = time.time()
+            worker = await _worker_run(client, refused_port(), [welcome_job(f"u{i}@example.com") for i in range(6)])
+            return worker, before, await client.zrange(RETRY_KEY, 0, -1, withscores=True)
+        finally:
+            await client.delete(*MAIL_KEYS)
+            await client.aclose()
+
+    worker, before, retries = run(scenario())
+    assert worker.retried == 6
+    assert len(retries) == 6
+    for raw, due in retries:
+        job = json.loads(raw)
+        assert job["attempts"] == 1 and job["last_error"]
+        assert due >= before + retry_delay(1)
+
+
+def test_worker_dead_letters_after_max_attempts():
+    async def scenario():
+        client = await redis_or_skip()
+        try:
+            worker = await _worker_run(client, refused_port(), [
+                welcome_job("last-try@example.com", attempts=MAIL_MAX_ATTEMPTS - 1),
+                welcome_job("unknown@example.com", kind="no-such-template"),
+            ])
+            return worker, await client.lrange(DEAD_LETTER_KEY, 0, -1), await client.zcard(RETRY_KEY)
+        finally:
+            await client.delete(*MAIL_KEYS)
+            await client.aclose()
+
+    worker, dead, retrying = run(scenario())
+    assert worker.dead_lettered == 2 and retrying == 0
+    assert {json.loads(raw)["to"] for raw in dead} == {"last-try@example.com", "unknown@example.com"}
+
+
+def test_worker_dead_letters_malformed_jobs():
+    # Jobs that are not JSON or not a mail job must not stop the worker, nor the valid job next to them
+    malformed = ["not json", json.dumps(["a", "list"]), json.dumps({"kind": "welcome", "to": "no-attempts@example.com"})]
+
+    async def scenario():
+        client = await redis_or_skip()
+        try:
+            async with StubSMTPServer() as server:
+                worker = await _worker_run(client, server.port, malformed + [welcome_job("ok@example.com")])
+            return server, worker, await client.lrange(DEAD_LETTER_KEY, 0, -1)
+        finally:
+            await client.delete(*MAIL_KEYS)
+            await client.aclose()
+
+    server, worker, dead = run(scenario())
+    assert len(server.messages) == 1 and worker.sent == 1
+    assert worker.dead_lettered == 3 and sorted(dead) == sorted(malformed)
@@ -0,0 +1,70 @@
+# tests/test_search_plans.py
+# Every /products/search query shape must be answered from an index: explain() each combination of text
+# query, category, price range and sort on seeded data and fail on any COLLSCAN in a winning plan.
+# Needs MongoDB (TEST_MONGODB_URL); skipped without it.
+import itertools
+import random
+
+from bson import ObjectId
+
+from tests.conftest import run, mongodb_or_skip
+
+N_PRODUCTS = 5000 # Enough for the planner to have real statistics
+CATEGORIES = [f"category-{i}" for i in range(20)]
+
+
+def find_stages(plan, name: str) -> bool:
+    if isinstance(plan, dict):
+        return plan.get("stage") == name or any(find_stages(v, name) for v in plan.values())
+    if isinstance(plan, list):
+        return any(find_stages(v, name) for v in plan)
+    return False
+
+
+def winning_plans(explain):
+    """The winning plans of an aggregate explain, skipping rejectedPlans (they are allowed to scan)."""
+    if isinstance(explain, dict):
+        for key, value in explain.items():
+            if key == "winningPlan":
+                yield value
+            elif key != "rejectedPlans":
+                yield from winning_plans(value)
+    elif isinstance(explain, list):
+        for value in explain:
+            yield from winning_plans(value)
+
+
+def test_search_query_shapes_use_indexes():
+    async def scenario():
+        from app.api.v1.products.products import SEARCH_SORTS, build_search_pipeline
+        from app.models.product import Product
+
+        async with mongodb_or_skip() as database:
+            creators = [ObjectId() for _ in range(10)]
+            await Product.get_pymongo_collection().insert_many([
+                {
+                    "name": f"Product {i}",
+                    "description": "Searchable test product " * 4,
+                    "price": round(random.uniform(1, 1000), 2),
+                    "category": random.choice(CATEGORIES),
+                    "creator_id": random.choice(creators),
+                }
+                for i in range(N_PRODUCTS)
+            ])
+            collection = Product.get_settings().name
+            scanning = []
+            shapes = itertools.product(
+                (None, "Product"),                   # q
+                (None, CATEGORIES[3]),               # category
+                ((None, None), (10, None), (None, 500), (10, 500)),
+                SEARCH_SORTS,
+            )
+            for q, category, (min_price, max_price), sort in shapes:
+                pipeline = build_search_pipeline(q, category, min_price, max_price, sort)
+                explain = await database.command("aggregate", collection, pipeline=pipeline, explain=True)
+                if any(find_stages(plan, "COLLSCAN") for plan in winning_plans(explain)):
+                    scanning.append(f"q={q} category={category} price=({min_price}, {max_price}) sort={sort}")
+            return scanning
+
+    scanning = run(scenario())
+    assert not scanning, "query shapes answered with a collection scan:\n" + "\n".join(scanning)